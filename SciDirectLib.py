@@ -34,14 +34,35 @@
 Class Overview
     class ElsClient
     - low level client for sending http requests to the API & getting results
-    - does throttling, writing http requests to log file
+    - does throttling (via a pluggable, thread safe rate limiter from
+        rateLimiter.py), logging http requests (to a log file if
+        elsLogging.configureLogging() has been called)
+    - retries transient failures (429, 5xx, connection errors) w/ backoff
+        (see retryPolicy.py), honoring Retry-After. The default limiter adapts
+        its rate to 429s and the X-RateLimit-* headers.
+    - owns a pooled, keep-alive requests.Session so connections are reused
+        across requests. Use close() or a "with" block to release them.
+        sharingClient() makes a client that shares the session (e.g., w/ a
+        different rate limiter, see harvestDriver.py)
     - knows how to construct http request header w/ appropriate API key, 
         institutional token, and user agent
     - executes a GET request(url, contentType)
         with result content-type either json or pdf.
-        Returns the unserialized json payload or the pdf bytes
+        Returns the unserialized json payload or the pdf bytes.
+        json is decoded straight from the response bytes (w/ orjson if it is
+        installed, see jsonCodec.py)
     - executes a PUT request(url, json_params) and returns unserialized json
         payload.
+    - executes conditional GET requests (If-None-Match/If-Modified-Since) and
+        streams pdfs to files
+    - records request metrics: per endpoint latency histograms, status codes,
+        bytes, retries, throttle & other waits (see elsMetrics.py and
+        getMetrics())
+
+    class AsyncElsClient
+    - asyncio version of ElsClient (needs aiohttp), same GET/PUT semantics.
+        Its execGetRequest() & execPutRequest() are coroutines.
+    - by default shares the request budget w/ ElsClients w/ the same API key
 
     class SciDirectSearch
     - Does a search against the SciDirect API and provides access to the search
@@ -49,93 +70,166 @@ Class Overview
     - search params are specified as a python dict
     - can get count of matching results, unserialized results, or as
         iterator of SciDirectReference objects (below)
-    - saves search results json to a file (for debugging).
-        TODO: make this configurable.
+    - optionally passes each page of raw results to a result sink as it
+        arrives (e.g., to save them as JSON Lines, see resultSink.py)
     - fetches the query results in increments & has an overall maximum result
         set size to be polite to the API
+    - optional parallel mode: once the 1st page says how many results there
+        are, fetches the other pages concurrently (within the client's rate
+        limit) and puts them back in order
+    - optionally splits a query that matches more results than can be paged
+        through (maxResults, the API's max offset) into narrower queries
+        (e.g., by publication year, see querySplit.py) and merges their
+        results w/o duplicate PIIs. A sub-query whose 1st page is the one
+        we have (sorted by date, narrowed by year) starts at its 2nd page
+    - executeAsync() does the search w/ an AsyncElsClient
+    - optional streaming mode: getIterator() pulls each page of results from
+        the API only when the consumer reaches it (flat memory, can stop early)
+    - optional compact mode: makes compact references and drops the raw
+        result records as they are turned into references
 
     class SciDirectReference
     - represents a reference object (article) at SciDirect
     - has article metadata: reference IDs, Journal, title, abstract, pdf, etc.
     - lazily makes requests to the API to get additional metadata/pdf
+    - the metadata comes from the ElsClient's metadata cache (see
+        metadataCache.py), if it has one, so repeat lookups are free.
+        Expired entries are revalidated w/ conditional GETs (HTTP 304 = hit)
+    - w/ an AsyncElsClient, use loadDetailsAsync()/loadPdfAsync() first
+    - uses __slots__. release() drops the raw payloads (search record,
+        details response, pdf bytes) it holds. In compact mode it doesn't
+        keep the search record and only weakly holds the details response.
+    - savePdf(path) streams the pdf straight to a file (atomically) w/o
+        holding it in memory. It keeps the pdf's ETag/Last-Modified next to
+        the file and re-downloads only if the API says the pdf has changed
+        (pdfChanged() reports which)
+
+Module functions
+    prefetchDetails(refs, workers), prefetchPdfs(refs, workers)
+    - load details/pdfs for many SciDirectReferences concurrently (within the
+        ElsClient's rate limit), returning the failures per reference
+    savePdfs(refs, pathFunc, workers)
+    - stream pdfs for many SciDirectReferences to disk concurrently
+    prefetchDetailsAsync(refs, concurrency), prefetchPdfsAsync(...)
+    - the same for refs w/ an AsyncElsClient, multiplexed on one event loop
 
 There are automated tests for this module: # includes usage examples
     cd tests
     python test_SciDirectLib.py [-v]
+    (they replay recorded API responses if there are no API credentials,
+    see recordReplay.py)
 """
 
-import requests, json, time, os, logging
+import requests, requests.adapters, json, time, os, logging, asyncio
+import tempfile, threading, weakref
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, \
+                                FIRST_COMPLETED
+from rateLimiter import getSharedLimiter, AsyncRateLimiter
+from retryPolicy import RetryPolicy, parseRateLimitHeaders
+from elsMetrics import ElsMetrics, endpointOf
+from querySplit import parseYears
+import jsonCodec
+try:
+    import aiohttp          # only needed for AsyncElsClient
+except ImportError:
+    aiohttp = None
 
-def get_logger(name):
-    ## Adapted from https://docs.python.org/3/howto/logging-cookbook.html
-
-    # create logger with module name
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    # create log path, if not already there
-    logPath = './logs'
-    if not os.path.exists(logPath):
-        os.mkdir(logPath)
-    logFileName = 'SciDirectLib-%s.log' % time.strftime('%Y%m%d')
-    logFilePath = os.path.join(logPath, logFileName)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(logFilePath)
-    fh.setLevel(logging.DEBUG)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.ERROR)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter( \
-                        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-    logger.info("SciDirectLib log started.")
-    return logger
-
-# TODO: add option to disable logging, configure location of log file
-#       maybe we just want to pass an open log file to write to instead of 
-#       using the logging framework?
-logger = get_logger(__name__)
+# No handlers here (no side effects on import), see elsLogging.py to send
+#  the log records to a file w/o blocking the request threads
+logger = logging.getLogger(__name__)
 url_base = "https://api.elsevier.com/"
+search_url = url_base + 'content/search/sciencedirect'
+PDF_MAGIC = b'%PDF'                 # all pdfs start with this
+PDF_CHUNK_SIZE = 64*1024            # bytes to read at a time when streaming
+VALIDATOR_HEADERS = ['ETag', 'Last-Modified']   # for conditional GETs
+VALIDATORS_SUFFIX = '.validators.json'  # saved pdf's validators file suffix
+SEARCH_MAX_OFFSET = 6000            # the search API rejects larger offsets
 
-class ElsClient(object):
-    """ See class overview above
+class _ElsClientBase(object):
+    """ What ElsClient and AsyncElsClient have in common: API credentials,
+        request headers, rate limiter, request status & error reporting.
     """
     __user_agent = "MGI-SciDirectClient"
     __min_req_interval = 1        ## min num seconds between requests
                                   ## got RATE_LIMIT_EXCEEDED when I used 0.5
-    __ts_last_req = 0.0           ## time of the last request (in sec)
  
-    def __init__(self, api_key, inst_token=None, ):
-        """Initializes a client with a given API Key and, optionally,
-            institutional token,
-        """
+    def __init__(self, api_key, inst_token, keepAlive, rateLimiter,
+                                        metadataCache, retryPolicy, metrics):
         self.api_key = api_key
         self.inst_token = inst_token
-    # end __init__() -----------------
+        self._keepAlive = keepAlive
+        self._metadataCache = metadataCache
+        if retryPolicy is None:
+            retryPolicy = RetryPolicy()
+        self._retryPolicy = retryPolicy
+        self._numRetries = 0            # total num of retries so far
+        if rateLimiter is None:
+            rateLimiter = getSharedLimiter(api_key,
+                                            rate=1.0/self.__min_req_interval)
+        self._rateLimiter = rateLimiter
+        if metrics is None:
+            metrics = ElsMetrics()
+        self._metrics = metrics
+        self._status_code = None
+        self._status_msg = None
 
-    def execGetRequest(self, URL, contentType='json'):
-        """Send GET request. Return response.
-           Supported contentTypes: 'json' or 'pdf'.
-           If contentType = 'json', returns the unserialized json payload
-           if contentType= 'pdf', returns the raw bytes
+    def getRateLimiter(self): return self._rateLimiter
+    def getMetrics(self):     return self._metrics
+    def getMetadataCache(self): return self._metadataCache
+    def getRetryPolicy(self): return self._retryPolicy
+    def getNumRetries(self):  return self._numRetries
+
+    def _adaptiveLimiter(self):
+        """ Return our rate limiter if it adapts to API feedback, else None
         """
-        ## Validate contentType
-        if contentType not in ['json', 'pdf']:
-            msg = "invalid contentType '%s', only pdf and json are supported" \
-                                                % contentType
-            raise ValueError(msg + '\n')
+        limiter = self._rateLimiter
+        if isinstance(limiter, AsyncRateLimiter):
+            limiter = limiter.getLimiter()
+        if hasattr(limiter, 'onThrottled'):
+            return limiter
+        return None
 
-        ## Throttle request, if need be
-        interval = time.time() - self.__ts_last_req
-        if (interval < self.__min_req_interval):
-            time.sleep( self.__min_req_interval - interval )
-        
-        ## Construct and execute request
+    def _retryDelay(self, attempt, statusCode, headers):
+        """ Adapt the rate limiter to a response.
+            Return None if the request should not be retried, else the
+            number of seconds to wait before retrying it.
+        """
+        limiter = self._adaptiveLimiter()
+        if limiter is not None and statusCode != 429:
+            limiter.onQuota(*parseRateLimitHeaders(headers))
+            if statusCode < 400:
+                limiter.onSuccess()
+
+        if not self._retryPolicy.shouldRetry(attempt, statusCode=statusCode,
+                                                            headers=headers):
+            if limiter is not None and statusCode == 429:
+                limiter.onThrottled()
+            return None
+
+        delay = self._retryPolicy.getDelay(attempt, headers)
+        self._numRetries += 1
+        logger.info('HTTP %s, retry %d in %.1f secs',
+                                                statusCode, attempt+1, delay)
+        if statusCode == 429 and limiter is not None:
+            limiter.onThrottled(delay)  # everyone waits, via the limiter
+            return 0.0
+        return delay
+
+    def _retryDelayForException(self, attempt, exc):
+        """ Return None if a request that raised exc should not be retried,
+            else the number of seconds to wait before retrying it.
+        """
+        if not self._retryPolicy.shouldRetry(attempt, exception=exc):
+            return None
+        delay = self._retryPolicy.getDelay(attempt)
+        self._numRetries += 1
+        logger.info('%s, retry %d in %.1f secs', exc, attempt+1, delay)
+        return delay
+
+    def _buildHeaders(self, contentType):
+        """ Return the http request headers for the given contentType
+        """
         headers = {
             "X-ELS-APIKey"  : self.api_key,
             "User-Agent"    : self.__user_agent,
@@ -143,28 +237,224 @@ class ElsClient(object):
             }
         if self.inst_token:
             headers["X-ELS-Insttoken"] = self.inst_token
-        logger.info("Sending GET request to %s contentType='%s'" % \
-                                                            (URL, contentType))
-        r = requests.get(URL, headers=headers)
 
-        self.__ts_last_req = time.time()
-        self._status_code=r.status_code
+        # json compresses well, pdfs are already compressed
+        if contentType == 'json':
+            headers["Accept-Encoding"] = 'gzip, deflate'
+        else:
+            headers["Accept-Encoding"] = 'identity'
 
-        ## Check results
-        if r.status_code != 200:        # bail out
-            self._status_msg="HTTP " + str(r.status_code) + \
+        if not self._keepAlive:
+            headers["Connection"] = 'close'
+        return headers
+
+    def _addConditionalHeaders(self, headers, validators):
+        """ Add the headers for a conditional GET, given validators from a
+            previous response. Return headers
+        """
+        if validators:
+            if validators.get('ETag'):
+                headers['If-None-Match'] = validators['ETag']
+            if validators.get('Last-Modified'):
+                headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+    def _responseValidators(self, respHeaders):
+        """ Return dict of the validators from the response headers
+        """
+        return {k: respHeaders[k] for k in VALIDATOR_HEADERS
+                                                        if respHeaders.get(k)}
+
+    def _validateContentType(self, contentType):
+        if contentType not in ['json', 'pdf']:
+            msg = "invalid contentType '%s', only pdf and json are supported" \
+                                                % contentType
+            raise ValueError(msg + '\n')
+
+    def _httpError(self, statusCode, URL, headers, text, jsonParams=None):
+        """ Set the request status for a failed request.
+            Return the requests.HTTPError to raise
+        """
+        if jsonParams is None:
+            self._status_msg="HTTP " + str(statusCode) + \
                                 " Error from " + URL + \
                                 " using headers " + str(headers) + \
-                                ":\n" + r.text
-            logger.info(self._status_msg)       # logger.error() instead?
-            raise requests.HTTPError(self._status_msg)
+                                ":\n" + text
+        else:
+            self._status_msg="HTTP " + str(statusCode) + \
+                                " Error from " + URL + \
+                                "\nusing headers: " + str(headers) +  \
+                                "\nand data: " + str(jsonParams) +  \
+                                ":\n" + text
+        logger.info(self._status_msg)       # logger.error() instead?
+        return requests.HTTPError(self._status_msg)
+
+    def getRequestStatus(self):
+    	'''Return the status of the request response, '''
+    	return {'status_code':self._status_code, 'status_msg': self._status_msg}
+# end class _ElsClientBase -------------------------
+
+class ElsClient(_ElsClientBase):
+    """ See class overview above
+    """
+    def __init__(self, api_key, inst_token=None,
+                poolSize=10,       # max num of pooled connections to the API
+                keepAlive=True,    # reuse connections across requests
+                session=None,      # optional requests.Session to use
+                rateLimiter=None,  # optional limiter from rateLimiter.py
+                metadataCache=None,# optional cache from metadataCache.py
+                retryPolicy=None,  # optional policy from retryPolicy.py
+                metrics=None,      # optional elsMetrics.ElsMetrics to use
+                ):
+        """Initializes a client with a given API Key and, optionally,
+            institutional token,
+            The client owns a pooled requests.Session so connections (and
+            their TLS handshakes) are reused across requests.
+            If you pass in your own session, the client will not close it.
+            If no rateLimiter is given, all ElsClients in this process w/
+            the same API key share one limiter that allows
+            1/__min_req_interval requests/sec.
+            If a metadataCache is given, SciDirectReferences using this
+            client look up their details there before asking the API.
+            Transient failures (429, 5xx, connection errors) are retried
+            according to retryPolicy (default: retryPolicy.RetryPolicy()).
+            Use retryPolicy.NO_RETRIES to fail on the 1st error.
+            Request metrics are recorded in metrics (default: a new
+            elsMetrics.ElsMetrics), see getMetrics().
+        """
+        super().__init__(api_key, inst_token, keepAlive, rateLimiter,
+                                        metadataCache, retryPolicy, metrics)
+        if session is None:
+            self._session = self._buildSession(poolSize)
+            self._ownsSession = True
+        else:
+            self._session = session
+            self._ownsSession = False
+    # end __init__() -----------------
+
+    def _buildSession(self, poolSize):
+        """ Return a requests.Session w/ a connection pool of poolSize
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize,
+                                                pool_maxsize=poolSize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        """ Release the pooled connections (if we own the session)
+        """
+        if self._ownsSession and self._session is not None:
+            self._session.close()
+        self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def getSession(self):     return self._session
+
+    def sharingClient(self, rateLimiter=None):
+        """ Return a new ElsClient that shares this client's credentials,
+            session (connection pool), metadata cache, retry policy & metrics
+            but throttles w/ rateLimiter (default: this client's limiter).
+            Closing it does not close the shared session.
+        """
+        if rateLimiter is None:
+            rateLimiter = self._rateLimiter
+        return ElsClient(self.api_key, inst_token=self.inst_token,
+                        keepAlive=self._keepAlive, session=self._session,
+                        rateLimiter=rateLimiter,
+                        metadataCache=self._metadataCache,
+                        retryPolicy=self._retryPolicy,
+                        metrics=self._metrics)
+
+    def _send(self, method, URL, headers, data=None, stream=False):
+        """ Throttle if need be, send the request on the pooled session,
+            retrying transient failures according to our retry policy.
+            Return the requests.Response
+            If stream, the response body has not been read yet.
+        """
+        if self._session is None:
+            raise ValueError('ElsClient has been closed')
+        endpoint = endpointOf(URL)
+
+        attempt = 0
+        while True:
+            ## Throttle request, if need be
+            self._metrics.addThrottle(self._rateLimiter.acquire())
+
+            start = time.monotonic()
+            try:
+                r = self._session.request(method, URL, headers=headers,
+                                                    data=data, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._metrics.observeRequest(endpoint,
+                                        time.monotonic() - start, 'error')
+                delay = self._retryDelayForException(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._metrics.observeRequest(endpoint,
+                                time.monotonic() - start, r.status_code,
+                                0 if stream else len(r.content))
+                self._status_code=r.status_code
+                delay = self._retryDelay(attempt, r.status_code, r.headers)
+                if delay is None:
+                    return r
+                r.close()
+            self._metrics.addRetry(endpoint)
+            if delay > 0:
+                with self._metrics.timer('backoff'):
+                    time.sleep(delay)
+            attempt += 1
+
+    def execGetRequest(self, URL, contentType='json'):
+        """Send GET request. Return response.
+           Supported contentTypes: 'json' or 'pdf'.
+           If contentType = 'json', returns the unserialized json payload
+           if contentType= 'pdf', returns the raw bytes
+        """
+        return self.execConditionalGetRequest(URL, contentType)[0]
+
+    def execConditionalGetRequest(self, URL, contentType='json',
+                                                            validators=None):
+        """Send GET request, conditional on validators from a previous
+            response: {'ETag': .., 'Last-Modified': ..}
+           Return (payload, validators) where payload is as execGetRequest()
+            and validators are the new response's validators.
+           If the API says the content hasn't changed (HTTP 304), payload
+            is None (and validators are the ones passed in).
+        """
+        self._validateContentType(contentType)
+
+        ## Construct and execute request
+        headers = self._addConditionalHeaders(self._buildHeaders(contentType),
+                                                                    validators)
+        logger.info("Sending GET request to %s contentType='%s'",
+                                                            URL, contentType)
+        r = self._send('GET', URL, headers)
+
+        ## Check results
+        if r.status_code == 304 and validators:
+            self._status_msg='%s data not modified' % contentType
+            return None, validators
+
+        if r.status_code != 200:        # bail out
+            raise self._httpError(r.status_code, URL, headers, r.text)
 
         ## Success
         self._status_msg='%s data retrieved' % contentType
         if contentType == 'json':
-            return json.loads(r.text)
+            with self._metrics.timer('json_decode'):
+                payload = jsonCodec.loads(r.content)
         else:
-            return r.content        # binary content
+            payload = r.content        # binary content
+        return payload, self._responseValidators(r.headers)
     # end execGetRequest() -------------------
 
     def execPutRequest(self, URL, jsonParams):
@@ -172,47 +462,459 @@ class ElsClient(object):
             Return the unserialized json payload
             jsonParams should be json payload with the API query params
         """
-        ## Throttle request, if need be
-        interval = time.time() - self.__ts_last_req
-        if (interval < self.__min_req_interval):
-            time.sleep( self.__min_req_interval - interval )
-
         ## Construct and execute request
-        headers = {
-            "X-ELS-APIKey"  : self.api_key,
-            "User-Agent"    : self.__user_agent,
-            "Accept"        : 'application/json'
-            }
-        if self.inst_token:
-            headers["X-ELS-Insttoken"] = self.inst_token
-        logger.info('Sending PUT request to ' + URL)
-        logger.info('Params:  ' + str(jsonParams))
-
-        r = requests.put(URL, headers=headers, data=jsonParams)
+        headers = self._buildHeaders('json')
+        logger.info('Sending PUT request to %s', URL)
+        logger.debug('Params:  %s', jsonParams)
 
-        self.__ts_last_req = time.time()
-        self._status_code=r.status_code
+        r = self._send('PUT', URL, headers, data=jsonParams)
 
         ## Check results
         if r.status_code != 200:        # bail out
-            self._status_msg="HTTP " + str(r.status_code) + \
-                                " Error from " + URL + \
-                                "\nusing headers: " + str(headers) +  \
-                                "\nand data: " + str(jsonParams) +  \
-                                ":\n" + r.text
-            logger.info(self._status_msg)       # logger.error() instead?
-            raise requests.HTTPError(self._status_msg)
+            raise self._httpError(r.status_code, URL, headers, r.text,
+                                                        jsonParams=jsonParams)
 
         ## Success
         self._status_msg='data retrieved'
-        return json.loads(r.text)
+        with self._metrics.timer('json_decode'):
+            return jsonCodec.loads(r.content)
     # end execPutRequest() -------------------
 
-    def getRequestStatus(self):
-    	'''Return the status of the request response, '''
-    	return {'status_code':self._status_code, 'status_msg': self._status_msg}
+    def downloadPdf(self, URL, path, chunkSize=PDF_CHUNK_SIZE):
+        """ Send GET request for a pdf and stream the response into the file
+            'path', chunkSize bytes at a time, so memory use doesn't depend
+            on the size of the pdf.
+            The pdf is written to a temp file and renamed to 'path' only
+            after it has been validated and fsync'ed, so 'path' never holds
+            a partial pdf.
+            Return the number of bytes written.
+        """
+        return self.downloadPdfIfChanged(URL, path, None, chunkSize)[0]
+
+    def downloadPdfIfChanged(self, URL, path, validators,
+                                                    chunkSize=PDF_CHUNK_SIZE,
+                                                    hasher=None):
+        """ downloadPdf() w/ a conditional GET based on validators from the
+            previous download: {'ETag': .., 'Last-Modified': ..}
+            Return (number of bytes written, new response validators).
+            If the API says the pdf hasn't changed (HTTP 304), the file is
+            not touched and we return (None, validators).
+            If hasher is given (e.g., a hashlib.sha256()), it is updated w/
+            the pdf's bytes as they are written.
+        """
+        headers = self._addConditionalHeaders(self._buildHeaders('pdf'),
+                                                                    validators)
+        logger.info("Sending GET request to %s, saving pdf to '%s'",
+                                                                URL, path)
+        r = self._send('GET', URL, headers, stream=True)
+        try:
+            if r.status_code == 304 and validators:
+                self._status_msg='pdf data not modified'
+                return None, validators
+
+            if r.status_code != 200:        # bail out
+                raise self._httpError(r.status_code, URL, headers, r.text)
+
+            writer = _PdfFileWriter(path, _contentLength(r.headers),
+                                                        self._metrics, hasher)
+            try:
+                with self._metrics.timer('pdf_body'):
+                    for chunk in r.iter_content(chunk_size=chunkSize):
+                        writer.write(chunk)
+                numBytes = writer.finish()
+            except:
+                writer.abort()
+                raise
+            finally:
+                self._metrics.addBytes('PDF', writer.getNumBytes())
+        finally:
+            r.close()
+
+        self._status_msg='pdf data saved'
+        return numBytes, self._responseValidators(r.headers)
+    # end downloadPdf() -------------------
 # end class ElsClient -------------------------
 
+class AsyncElsClient(_ElsClientBase):
+    """ asyncio version of ElsClient. See class overview above.
+        Needs the aiohttp package.
+    """
+    def __init__(self, api_key, inst_token=None,
+                poolSize=100,      # max num of simultaneous connections
+                keepAlive=True,    # reuse connections across requests
+                session=None,      # optional aiohttp.ClientSession to use
+                rateLimiter=None,  # optional limiter from rateLimiter.py
+                metadataCache=None,# optional cache from metadataCache.py
+                retryPolicy=None,  # optional policy from retryPolicy.py
+                metrics=None,      # optional elsMetrics.ElsMetrics to use
+                ):
+        """Initializes an async client. Same params as ElsClient.
+            rateLimiter can be a rateLimiter.AsyncRateLimiter or any
+            (threaded) limiter, which will be wrapped in one. So by default
+            this client shares its request budget with ElsClients using the
+            same API key.
+            The aiohttp session is created on the first request (it has to be
+            created inside the running event loop).
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncElsClient requires the aiohttp package')
+        super().__init__(api_key, inst_token, keepAlive, rateLimiter,
+                                        metadataCache, retryPolicy, metrics)
+        if not isinstance(self._rateLimiter, AsyncRateLimiter):
+            self._rateLimiter = AsyncRateLimiter(self._rateLimiter)
+        self._poolSize = poolSize
+        self._session = session
+        self._ownsSession = session is None
+        self._closed = False
+    # end __init__() -----------------
+
+    def _getSession(self):
+        if self._closed:
+            raise ValueError('AsyncElsClient has been closed')
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._poolSize,
+                                            force_close=not self._keepAlive)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """ Release the pooled connections (if we own the session)
+        """
+        if self._ownsSession and self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    def getSession(self):     return self._session
+
+    async def _request(self, method, URL, headers, data=None):
+        """ Throttle if need be, send the request, retrying transient
+            failures according to our retry policy.
+            Return the aiohttp response. Its body has not been read yet, the
+            caller must release() it.
+        """
+        session = self._getSession()
+        endpoint = endpointOf(URL)
+
+        attempt = 0
+        while True:
+            ## Throttle request, if need be
+            self._metrics.addThrottle(await self._rateLimiter.acquire())
+
+            start = time.monotonic()
+            try:
+                r = await session.request(method, URL, headers=headers,
+                                                                    data=data)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self._metrics.observeRequest(endpoint,
+                                        time.monotonic() - start, 'error')
+                delay = self._retryDelayForException(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._metrics.observeRequest(endpoint,
+                                        time.monotonic() - start, r.status)
+                self._status_code = r.status
+                delay = self._retryDelay(attempt, r.status, r.headers)
+                if delay is None:
+                    return r
+                r.release()
+            self._metrics.addRetry(endpoint)
+            if delay > 0:
+                with self._metrics.timer('backoff'):
+                    await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, method, URL, headers, data=None):
+        """ Send the request (see _request()).
+            Return (status code, response headers, body bytes)
+        """
+        r = await self._request(method, URL, headers, data=data)
+        try:
+            body = await r.read()
+        finally:
+            r.release()
+        self._metrics.addBytes(endpointOf(URL), len(body))
+        return r.status, r.headers, body
+
+    async def execGetRequest(self, URL, contentType='json'):
+        """ Send GET request. Return response. See ElsClient.execGetRequest()
+        """
+        return (await self.execConditionalGetRequest(URL, contentType))[0]
+
+    async def execConditionalGetRequest(self, URL, contentType='json',
+                                                            validators=None):
+        """ Send conditional GET request.
+            See ElsClient.execConditionalGetRequest()
+        """
+        self._validateContentType(contentType)
+
+        headers = self._addConditionalHeaders(self._buildHeaders(contentType),
+                                                                    validators)
+        logger.info("Sending async GET request to %s contentType='%s'",
+                                                            URL, contentType)
+        status, respHeaders, body = await self._send('GET', URL, headers)
+
+        if status == 304 and validators:
+            self._status_msg='%s data not modified' % contentType
+            return None, validators
+
+        if status != 200:        # bail out
+            raise self._httpError(status, URL, headers,
+                                            body.decode('utf-8', 'replace'))
+
+        self._status_msg='%s data retrieved' % contentType
+        if contentType == 'json':
+            with self._metrics.timer('json_decode'):
+                payload = jsonCodec.loads(body)
+        else:
+            payload = body
+        return payload, self._responseValidators(respHeaders)
+    # end execGetRequest() -------------------
+
+    async def execPutRequest(self, URL, jsonParams):
+        """ Send request using the PUT method.
+            Return the unserialized json payload.
+            See ElsClient.execPutRequest()
+        """
+        headers = self._buildHeaders('json')
+        logger.info('Sending async PUT request to %s', URL)
+        logger.debug('Params:  %s', jsonParams)
+
+        status, respHeaders, body = await self._send('PUT', URL, headers,
+                                                            data=jsonParams)
+
+        if status != 200:        # bail out
+            raise self._httpError(status, URL, headers,
+                                            body.decode('utf-8', 'replace'),
+                                            jsonParams=jsonParams)
+
+        self._status_msg='data retrieved'
+        with self._metrics.timer('json_decode'):
+            return jsonCodec.loads(body)
+    # end execPutRequest() -------------------
+
+    async def downloadPdf(self, URL, path, chunkSize=PDF_CHUNK_SIZE):
+        """ Stream a pdf into the file 'path'. Return the num of bytes written.
+            See ElsClient.downloadPdf()
+        """
+        return (await self.downloadPdfIfChanged(URL, path, None,
+                                                                chunkSize))[0]
+
+    async def downloadPdfIfChanged(self, URL, path, validators,
+                                                    chunkSize=PDF_CHUNK_SIZE,
+                                                    hasher=None):
+        """ Conditionally stream a pdf into the file 'path'.
+            See ElsClient.downloadPdfIfChanged()
+        """
+        headers = self._addConditionalHeaders(self._buildHeaders('pdf'),
+                                                                    validators)
+        logger.info("Sending async GET request to %s, saving pdf to '%s'",
+                                                                URL, path)
+        r = await self._request('GET', URL, headers)
+        try:
+            if r.status == 304 and validators:
+                self._status_msg='pdf data not modified'
+                return None, validators
+
+            if r.status != 200:        # bail out
+                body = await r.read()
+                raise self._httpError(r.status, URL, headers,
+                                            body.decode('utf-8', 'replace'))
+
+            writer = _PdfFileWriter(path, _contentLength(r.headers),
+                                                        self._metrics, hasher)
+            try:
+                with self._metrics.timer('pdf_body'):
+                    async for chunk in r.content.iter_chunked(chunkSize):
+                        writer.write(chunk)
+                numBytes = writer.finish()
+            except:
+                writer.abort()
+                raise
+            finally:
+                self._metrics.addBytes('PDF', writer.getNumBytes())
+            respValidators = self._responseValidators(r.headers)
+        finally:
+            r.release()
+
+        self._status_msg='pdf data saved'
+        return numBytes, respValidators
+    # end downloadPdf() -------------------
+# end class AsyncElsClient -------------------------
+
+def _contentLength(headers):
+    """ Return the Content-Length from the response headers as int, or None
+    """
+    length = headers.get('Content-Length')
+    if length is None:
+        return None
+    return int(length)
+
+def _validatorsPath(pdfPath):
+    return pdfPath + VALIDATORS_SUFFIX
+
+def readPdfValidators(pdfPath):
+    """ Return the validators saved next to the pdf file pdfPath, or None
+    """
+    try:
+        with open(_validatorsPath(pdfPath), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _writePdfValidators(pdfPath, validators):
+    """ Save the validators for the pdf file pdfPath next to it (atomically)
+        or remove stale ones if there are none.
+    """
+    path = _validatorsPath(pdfPath)
+    if not validators:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmpPath = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmpPath, 'w') as f:
+        json.dump(validators, f)
+    os.replace(tmpPath, path)
+
+class _PdfFileWriter(object):
+    """
+    IS:   a writer that saves a pdf to a file atomically.
+    HAS:  a temp file in the same directory as the final file
+    DOES: write() chunks to the temp file, checking the pdf magic number.
+          finish() checks the length, fsyncs and renames the temp file to the
+            final path. abort() removes the temp file.
+          Raises ValueError if the content is not a pdf or is the wrong length
+    """
+    def __init__(self, path, expectedLength=None,
+                metrics=None,   # optional ElsMetrics to record disk_write time
+                hasher=None,    # optional hashlib object to update w/ the pdf
+                ):
+        self._path = path
+        self._expectedLength = expectedLength
+        self._metrics = metrics
+        self._hasher = hasher
+        self._numBytes = 0
+        self._head = b''        # 1st bytes, to check the magic number
+        dirName, baseName = os.path.split(os.path.abspath(path))
+        fd, self._tmpPath = tempfile.mkstemp(dir=dirName,
+                                        prefix='.%s.' % baseName, suffix='.part')
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        if len(self._head) < len(PDF_MAGIC):
+            self._head += chunk[:len(PDF_MAGIC) - len(self._head)]
+            if not PDF_MAGIC.startswith(self._head):
+                raise ValueError("content for '%s' is not a pdf, starts w/ %s"
+                                                    % (self._path, self._head))
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+        if self._metrics is None:
+            self._file.write(chunk)
+        else:
+            with self._metrics.timer('disk_write'):
+                self._file.write(chunk)
+        self._numBytes += len(chunk)
+
+    def finish(self):
+        """ Validate, fsync and rename to the final path.
+            Return the number of bytes written.
+        """
+        if self._head != PDF_MAGIC:
+            raise ValueError("content for '%s' is not a pdf, starts w/ %s"
+                                                    % (self._path, self._head))
+        if self._expectedLength is not None and \
+                                    self._numBytes != self._expectedLength:
+            raise ValueError("pdf for '%s' is %d bytes, expected %d" % \
+                        (self._path, self._numBytes, self._expectedLength))
+        start = time.monotonic()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmpPath, self._path)
+        if self._metrics is not None:
+            self._metrics.addTime('disk_write', time.monotonic() - start)
+        return self._numBytes
+
+    def abort(self):
+        """ Throw away the temp file
+        """
+        self._file.close()
+        if os.path.exists(self._tmpPath):
+            os.remove(self._tmpPath)
+
+    def getNumBytes(self):  return self._numBytes
+# end class _PdfFileWriter -------------------------
+
+class _PageAssembler(object):
+    """
+    IS:   the bookkeeping for a SciDirectSearch's pages fetched in parallel
+    HAS:  the pages that came back before the pages ahead of them, the PIIs
+          added so far, the latest resultsFound
+    DOES: schedule() - the offsets of the pages to fetch (that we haven't
+            asked for yet)
+          add(offset, api_response) - hold the page until the pages before it
+            are in, then add them all to the search in order.
+          If resultsFound changes between pages (articles loaded or withdrawn
+          during the search), more pages are scheduled for the new results (up
+          to the search's ceiling), and results already seen on another page
+          (they shifted across a page boundary) are dropped.
+    """
+    def __init__(self, search, firstOffset, firstResults):
+        self._search = search
+        self._increment = search._increment
+        self._firstOffset = firstOffset
+        self._nextOffset = firstOffset + self._increment    # next page to add
+        self._endOffset = self._nextOffset  # offsets scheduled are < this
+        self._numFound = search._tot_num_res
+        self._pages = {}        # offset -> page results, waiting their turn
+        self._piis = set(r['pii'] for r in firstResults)
+        self._numDups = 0
+
+    def schedule(self):
+        end = self._firstOffset + min(self._numFound,
+                                                self._search._getCeiling())
+        offsets = list(range(self._endOffset, end, self._increment))
+        if offsets:
+            self._endOffset = offsets[-1] + self._increment
+        return offsets
+
+    def add(self, offset, api_response):
+        numFound = int(api_response['resultsFound'])
+        if numFound != self._numFound:
+            logger.info('search resultsFound changed from %d to %d',
+                                                    self._numFound, numFound)
+            self._search._elsClient.getMetrics().count(
+                                                    'search_results_changed')
+            self._numFound = numFound
+        self._pages[offset] = api_response.get('results', [])
+        while self._nextOffset in self._pages:
+            page = self._pages.pop(self._nextOffset)
+            new = [r for r in page if r['pii'] not in self._piis]
+            self._piis.update(r['pii'] for r in new)
+            self._numDups += len(page) - len(new)
+            self._search._addPage(new)
+            self._nextOffset += self._increment
+
+    def finish(self):
+        """ All the scheduled pages are in, reconcile the search's totals
+        """
+        search = self._search
+        search._tot_num_res = self._numFound
+        if self._numFound > search._getCeiling():
+            search._truncated = True
+        if self._numDups:
+            search._elsClient.getMetrics().count('search_page_duplicates',
+                                                                self._numDups)
+# end class _PageAssembler -------------------------
+
 class SciDirectSearch(object):
     """ See class overview above
     """
@@ -221,13 +923,60 @@ class SciDirectSearch(object):
                 getAll=False,      # if False, only get one API call of results 
                 maxResults=5000,   # max num of matching results to pull down
                 increment=100,     # num results to get w/each API call
+                stream=False,      # if True, fetch pages as they're iterated
+                resultSink=None,   # resultSink(search, records) is called w/
+                                   #  each page of results (see resultSink.py)
+                compact=False,     # if True, make compact references and drop
+                                   #  raw records as they're iterated
+                splitters=None,    # splitters to use if there are too many
+                                   #  results to page through (querySplit.py)
+                parallelPages=1,   # num of pages to fetch at once after the
+                                   #  1st one (w/ getAll = True)
                 ):
         """ Instantiate search object.
             See https://dev.elsevier.com/tecdoc_sdsearch_migration.html
               for details of the PUT API
+            If stream = True (and getAll = True), execute() only gets the 1st
+              page of results. getIterator() gets each following page when the
+              consumer reaches it, so only one page is held in memory and the
+              consumer can stop early w/o fetching the rest.
+            If resultSink is given, it gets each page of raw result records
+              as soon as it arrives. By default the results aren't written
+              anywhere.
+            If compact = True, getIterator() makes compact SciDirectReferences
+              (see SciDirectReference) and drops each raw result record once
+              it has been turned into a reference, so the results can only be
+              iterated once.
+            If splitters are given (and getAll = True) and the query matches
+              more results than we can page through (maxResults, or the API's
+              max offset), the query is split into narrower queries by the
+              1st splitter that can split it (see querySplit.py), and the
+              results of those (split again if need be) are merged, dropping
+              duplicate PIIs. So maxResults is the max num of results to get
+              per (sub-)query. Not w/ stream = True. If the query is sorted
+              by date, a sub-query for the newest years usually has the same
+              1st page as its parent, and starts at its 2nd page.
+              Otherwise the results past maxResults are dropped (isTruncated()
+              says if they were).
+            If parallelPages > 1, once the 1st page says how many results
+              there are, the other pages are fetched parallelPages at a time
+              (still throttled by the client's rate limiter, so the search
+              takes about num pages/rate secs instead of num pages * round
+              trip time). The client's poolSize should be >= parallelPages.
+              The pages are put back in order. If resultsFound changes along
+              the way, the new results are fetched too and duplicate PIIs are
+              dropped. Not w/ stream = True.
         """
+        if splitters and stream:
+            raise ValueError("can't split a streaming search")
+        if parallelPages > 1 and stream:
+            raise ValueError("can't fetch a streaming search's pages in "
+                                                                    "parallel")
         self._elsClient = elsClient
         self._getAll = getAll
+        self._stream = stream
+        self._resultSink = resultSink
+        self._compact = compact
         self._maxResults = maxResults
         self._increment = increment
         self._query = query
@@ -235,7 +984,16 @@ class SciDirectSearch(object):
             raise TypeError('query is not a dictionary')
 
         self._results = []       # the results pulled down so far
+                                 #  (if streaming, just the current page)
         self._tot_num_res = None # total num of matching results at SciDirect
+        self._numFetched = 0     # num of results pulled down so far
+        self._streamQuery = None # if streaming, the query for the next page
+        self._streamStarted = False
+        self._splitters = splitters
+        self._truncated = False  # were there results we couldn't page to
+        self._parallelPages = parallelPages
+        self._knownFirstPage = None # the results of our 1st page if our
+                                    #  parent search has them (_subSearch())
 
     def execute(self):
         """Executes the search using the API V2 PUT method.
@@ -244,8 +1002,165 @@ class SciDirectSearch(object):
             If getAll = True, multiple API calls will be made to iteratively
                 get all results for the search, up to a maximum.
         """
-        url = url_base + 'content/search/sciencedirect'
+        query = self._buildQuery()
+
+        ## do 1st API call (for the 2nd page if we know the 1st)
+        queryJson = self._firstQueryJson(query)
+        api_response = self._elsClient.execPutRequest(search_url, queryJson)
+        firstResults = self._knownFirstPage or api_response.get('results', [])
+        subQueries = self._splitQuery(api_response)
+        if subQueries is not None:  # too many results, run narrower queries
+            for subQuery in subQueries:
+                self._addSplit(
+                        self._subSearch(subQuery, firstResults).execute())
+            return self
+        api_response, prefetched = self._firstResponse(query, api_response)
+        self._startResults(api_response)
+        if self._stream:            # getIterator() gets the rest
+            self._streamQuery = query
+            return self
+        if self._parallelPages > 1 and self._needMorePages():
+            self._fetchPagesParallel(query, prefetched)
+            return self
+
+        while self._needMorePages():    ## do any needed additional API calls
+            query['display']['offset'] += self._increment
+
+            api_response = prefetched.pop(query['display']['offset'], None)
+            if api_response is None:
+                queryJson = json.dumps(query)
+                api_response = self._elsClient.execPutRequest(search_url,
+                                                                    queryJson)
+            self._addPage(api_response['results'])
 
+        return self
+
+    async def executeAsync(self):
+        """ Same as execute() for a search whose elsClient is an
+            AsyncElsClient.
+        """
+        query = self._buildQuery()
+
+        queryJson = self._firstQueryJson(query)
+        api_response = await self._elsClient.execPutRequest(search_url,
+                                                                    queryJson)
+        firstResults = self._knownFirstPage or api_response.get('results', [])
+        subQueries = self._splitQuery(api_response)
+        if subQueries is not None:
+            for subQuery in subQueries:
+                self._addSplit(await self._subSearch(subQuery,
+                                                firstResults).executeAsync())
+            return self
+        api_response, prefetched = self._firstResponse(query, api_response)
+        self._startResults(api_response)
+        if self._stream:            # getAsyncIterator() gets the rest
+            self._streamQuery = query
+            return self
+        if self._parallelPages > 1 and self._needMorePages():
+            await self._fetchPagesParallelAsync(query, prefetched)
+            return self
+
+        while self._needMorePages():
+            query['display']['offset'] += self._increment
+
+            api_response = prefetched.pop(query['display']['offset'], None)
+            if api_response is None:
+                queryJson = json.dumps(query)
+                api_response = await self._elsClient.execPutRequest(
+                                                        search_url, queryJson)
+            self._addPage(api_response['results'])
+
+        return self
+
+    def _fetchPagesParallel(self, query, prefetched):
+        """ Get the pages after the 1st parallelPages at a time, in threads.
+            prefetched = {offset: api response} of pages we have already.
+        """
+        pages = _PageAssembler(self, query['display']['offset'], self._results)
+        futures = {}                # future -> its page offset
+        with ThreadPoolExecutor(max_workers=self._parallelPages) as executor:
+            try:
+                while True:
+                    for offset in pages.schedule():
+                        if offset in prefetched:
+                            pages.add(offset, prefetched.pop(offset))
+                            continue
+                        future = executor.submit(
+                                    self._elsClient.execPutRequest, search_url,
+                                    self._pageQueryJson(query, offset))
+                        futures[future] = offset
+                    if not futures:
+                        break
+                    done, notDone = wait(futures,
+                                                return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pages.add(futures.pop(future), future.result())
+            except BaseException:
+                for future in futures:  # don't start the rest
+                    future.cancel()
+                raise
+        pages.finish()
+
+    async def _fetchPagesParallelAsync(self, query, prefetched):
+        """ Same as _fetchPagesParallel() w/ an AsyncElsClient
+        """
+        pages = _PageAssembler(self, query['display']['offset'], self._results)
+        semaphore = asyncio.Semaphore(self._parallelPages)
+
+        async def fetch(offset):
+            async with semaphore:
+                return await self._elsClient.execPutRequest(search_url,
+                                        self._pageQueryJson(query, offset))
+        tasks = {}                  # task -> its page offset
+        try:
+            while True:
+                for offset in pages.schedule():
+                    if offset in prefetched:
+                        pages.add(offset, prefetched.pop(offset))
+                        continue
+                    tasks[asyncio.ensure_future(fetch(offset))] = offset
+                if not tasks:
+                    break
+                done, notDone = await asyncio.wait(tasks,
+                                        return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pages.add(tasks.pop(task), task.result())
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        pages.finish()
+
+    def _pageQueryJson(self, query, offset):
+        """ Return the json of query for the page at offset
+        """
+        return json.dumps(dict(query,
+                                display=dict(query['display'], offset=offset)))
+
+    def _firstQueryJson(self, query):
+        """ Return the json of the 1st API call's query: for the 1st page,
+            or for the 2nd if we know the 1st (it still tells us
+            resultsFound)
+        """
+        if self._knownFirstPage is None:
+            return json.dumps(query)
+        return self._pageQueryJson(query,
+                                query['display']['offset'] + self._increment)
+
+    def _firstResponse(self, query, api_response):
+        """ Return (the response for the 1st page, {offset: api response}
+            of the later pages we got), from the 1st API call's response
+        """
+        if self._knownFirstPage is None:
+            return api_response, {}
+        self._elsClient.getMetrics().count('search_pages_reused')
+        offset = query['display']['offset'] + self._increment
+        return dict(api_response, results=self._knownFirstPage), \
+                                                    {offset: api_response}
+
+    def _buildQuery(self):
+        """ Return the query dict to send for the 1st API call
+        """
         if self._getAll:        # take over the display 'show' & 'offset' attrs
             query = deepcopy(self._query)
             displayField = query.get('display', {})
@@ -255,67 +1170,266 @@ class SciDirectSearch(object):
             query['display'] = displayField
         else:
             query = self._query
+        return query
+
+    def _getCeiling(self):
+        """ Return the max num of results we can page through
+        """
+        return min(self._maxResults, SEARCH_MAX_OFFSET + self._increment)
+
+    def _splitQuery(self, api_response):
+        """ Return the sub-queries to run instead of this search if the 1st
+            API call found too many results to page through, else None
+        """
+        numFound = int(api_response['resultsFound'])
+        if not (self._getAll and self._splitters) or \
+                                            numFound <= self._getCeiling():
+            return None
+        for splitter in self._splitters:
+            subQueries = splitter(self._query)
+            if subQueries:
+                break
+        else:
+            return None             # can't split it, get what we can
+        logger.info('splitting search (%d results) into %d queries: %s',
+                        numFound, len(subQueries), self._query)
+        metrics = self._elsClient.getMetrics()
+        metrics.count('search_pages')
+        metrics.count('search_splits')
+        self._tot_num_res = numFound
+        self._results = []
+        self._numFetched = 0
+        self._piis = set()          # the PIIs in the merged results
+        return subQueries
+
+    def _subSearch(self, subQuery, firstResults):
+        """ Return a (not yet executed) search for subQuery, like this one.
+            firstResults = our 1st page of results. If they are subQuery's
+            1st page too, the sub-search doesn't ask for them again.
+        """
+        search = SciDirectSearch(self._elsClient, subQuery, getAll=True,
+                        maxResults=self._maxResults, increment=self._increment,
+                        splitters=self._splitters,
+                        parallelPages=self._parallelPages)
+        if self._isFirstPageOf(subQuery, firstResults):
+            search._knownFirstPage = firstResults
+        return search
+
+    def _isFirstPageOf(self, subQuery, firstResults):
+        """ Return True if our (full) 1st page of results is subQuery's 1st
+            page: we're sorted by date, subQuery only narrows our publication
+            years (e.g., querySplit.splitByYear) and all of the page's
+            articles are in its years. (Its results are ours w/ the older
+            ones left out, in the same order.)
+        """
+        if len(firstResults) < self._increment or 'date' not in subQuery or \
+                self._query.get('display', {}).get('sortBy') != 'date':
+            return False
+        if {k: v for k, v in subQuery.items() if k != 'date'} != \
+                {k: v for k, v in self._query.items() if k != 'date'}:
+            return False
+        first, last = parseYears(subQuery['date'])
+        try:
+            return all(first <= int(r['publicationDate'][:4]) <= last
+                                                        for r in firstResults)
+        except (KeyError, TypeError, ValueError):   # no/odd publicationDate
+            return False
+
+    def _addSplit(self, search):
+        """ Merge the results of an executed sub-query search into ours
+        """
+        new = []
+        for r in search.getResults():
+            if r['pii'] not in self._piis:
+                self._piis.add(r['pii'])
+                new.append(r)
+        numDups = search.getNumResults() - len(new)
+        if numDups:
+            self._elsClient.getMetrics().count('search_split_duplicates',
+                                                                    numDups)
+        self._results += new
+        self._numFetched += len(new)
+        self._truncated = self._truncated or search.isTruncated()
+        self._sinkPage(new)
 
-        ## do 1st API call
-        queryJson = json.dumps(query)
-        api_response = self._elsClient.execPutRequest(url, queryJson)
+    def _startResults(self, api_response):
+        """ Initialize our results from the response to the 1st API call
+        """
         self._tot_num_res = int(api_response['resultsFound'])
+        if self._getAll and self._tot_num_res > self._getCeiling():
+            self._truncated = True
+            logger.warning('search found %d results, can only get %d: %s',
+                        self._tot_num_res, self._getCeiling(), self._query)
+            self._elsClient.getMetrics().count('search_truncated')
 
         if self._tot_num_res == 0:
             self._results = []
-            return self
+        else:                   # got some matching results
+            self._results = api_response['results']
+        self._numFetched = len(self._results)
+        self._streamStarted = False
+        self._countPage(self._results)
+        self._sinkPage(self._results)
 
-        # got some matching results
-        self._results = api_response['results']
+    def _addPage(self, pageResults):
+        """ Add a (non-1st) page of results from the API
+        """
+        if self._stream:
+            self._results = pageResults
+        else:
+            self._results += pageResults
+        self._numFetched += len(pageResults)
+        self._countPage(pageResults)
+        self._sinkPage(pageResults)
 
-        if self._getAll:     ## do any needed additional API calls
-            while (len(self._results) < self._tot_num_res) and \
-                                not (len(self._results) >= self._maxResults):
-                query['display']['offset'] += self._increment
+    def _countPage(self, pageResults):
+        metrics = self._elsClient.getMetrics()
+        metrics.count('search_pages')
+        metrics.count('search_results', len(pageResults))
 
-                queryJson = json.dumps(query)
-                api_response = self._elsClient.execPutRequest(url, queryJson)
-                self._results += api_response['results']
+    def _sinkPage(self, pageResults):
+        if self._resultSink is not None and pageResults:
+            self._resultSink(self, pageResults)
 
-        with open('dump.json', 'w') as f:
-            f.write(json.dumps(self._results, sort_keys=True, indent=2))
-        return self
+    def _needMorePages(self):
+        """ Return True if we should make another API call to get more results
+        """
+        return self._getAll and \
+                    (self._numFetched < self._tot_num_res) and \
+                    (self._numFetched < self._getCeiling())
+
+    def _nextStreamQueryJson(self):
+        """ Advance the streaming query to the next page, return its json
+        """
+        self._streamQuery['display']['offset'] += self._increment
+        return json.dumps(self._streamQuery)
 
     def getTotalNumResults(self): return self._tot_num_res
-    def getNumResults(self):      return len(self._results)
+    def getNumResults(self):      return self._numFetched
+    def isTruncated(self):
+        """ Return True if the search matched results we couldn't page to
+            (and couldn't split the query to get)
+        """
+        return self._truncated
 
     def getResults(self):
-        """ Return the list of raw result records from the API."""
+        """ Return the list of raw result records from the API.
+            (if streaming, just the current page of results. If compact, the
+            records not yet turned into references by getIterator())
+        """
         return self._results
 
     def getIterator(self):
-        """ Return iterator of SciDirectReference objects from the results"""
+        """ Return iterator of SciDirectReference objects from the results.
+            If streaming, pages are fetched as the iterator reaches them, and
+            the results can only be iterated once.
+            If compact, the raw records are dropped as they are iterated, so
+            they can only be iterated once too.
+        """
+        if self._stream:
+            self._startStream()
+            return self._streamIterator()
+        if self._compact:
+            self._startStream()
+            return self._consumingIterator()
         it = (SciDirectReference(self._elsClient, r) for r in self._results)
         return it
 
+    def _consumingIterator(self):
+        records = self._results
+        for i in range(len(records)):
+            record = records[i]
+            records[i] = None       # drop it, the reference has what we need
+            yield SciDirectReference(self._elsClient, record, compact=True)
+        del records[:]
+
+    def getAsyncIterator(self):
+        """ Return async iterator of SciDirectReference objects from a
+            streaming search whose elsClient is an AsyncElsClient.
+            Use: async for ref in search.getAsyncIterator(): ...
+        """
+        if not self._stream:
+            raise ValueError('getAsyncIterator() requires stream=True')
+        self._startStream()
+        return self._asyncStreamIterator()
+
+    def _startStream(self):
+        if self._streamStarted:
+            raise ValueError('streaming/compact search results can only be '
+                                                            'iterated once')
+        self._streamStarted = True
+
+    def _streamIterator(self):
+        while True:
+            for r in self._results:
+                yield SciDirectReference(self._elsClient, r,
+                                                        compact=self._compact)
+            if not self._results or not self._needMorePages():
+                return
+            api_response = self._elsClient.execPutRequest(search_url,
+                                                self._nextStreamQueryJson())
+            self._addPage(api_response['results'])
+
+    async def _asyncStreamIterator(self):
+        while True:
+            for r in self._results:
+                yield SciDirectReference(self._elsClient, r,
+                                                        compact=self._compact)
+            if not self._results or not self._needMorePages():
+                return
+            api_response = await self._elsClient.execPutRequest(search_url,
+                                                self._nextStreamQueryJson())
+            self._addPage(api_response['results'])
+
     def getElsClient(self):   return self._elsClient
     def getQuery(self):       return self._query
 
 # end class SciDirectSearch -------------------------
 
+class _Payload(dict):
+    """ A details API response that can be weakly referenced
+    """
+    __slots__ = ('__weakref__',)
+
 class SciDirectReference(object):
     """
     IS:   a reference at ScienceDirect.
     HAS:  IDs, basic metadata fields: title, journal, dates, ...
+          Uses __slots__ so large harvests can hold many of them.
     DOES: loads metadata lazily. Gets PDF.
+          release() drops the raw API payloads (search record, details
+          response, pdf bytes), keeping just the fields we use.
     """
-    def __init__(self, elsClient, searchResult):
+    __details_view = 'META'             # view used for the details API call
+    __no_pmid_cache_ttl = 24*60*60      # seconds to cache details w/o PMID
+
+    __slots__ = ('_elsClient', '_compact', '_searchResultsFields',
+                '_pii', '_doi', '_journal', '_title', '_loadDate',
+                '_publicationDate', '_detailsLoaded', '_detailFields',
+                '_pmid', '_pubType', '_abstract', '_volume',
+                '_pdf', '_pdfChanged', '__weakref__')
+
+    def __init__(self, elsClient, searchResult,
+                compact=False, # if True, don't keep the search result record
+                               #  & only keep a weak ref to the details
+                               #  response (the fields we use are kept)
+                ):
         """ Instantiate a reference object.
             searchResult = record/dict from SciDirectSearch results from the API
         """
         self._elsClient = elsClient
+        self._compact = compact
 
         # unpack fields from SciDirectSearch results
         self._searchResultsFields = searchResult
         self._unpackSciDirectResult()
+        if compact:
+            self._searchResultsFields = None
 
         # fields we have to load from a ref details API call
+        self._detailsLoaded = False
         self._detailFields = None      # the results from the details API call
+                                       #  (if compact, a weakref to them)
         self._pmid = None
         self._pubType = None
         self._abstract = None
@@ -323,6 +1437,7 @@ class SciDirectReference(object):
 
         # the binary pdf contents are loaded from a subsequent API call
         self._pdf = None
+        self._pdfChanged = None     # did the last savePdf() change the file
 
     def _unpackSciDirectResult(self):
         """ unpack the dict from SciDirectSearch result representing the ref
@@ -341,7 +1456,10 @@ class SciDirectReference(object):
     def getTitle(self):       return self._title
     def getLoadDate(self):    return self._loadDate
     def getPublicationDate(self): return self._publicationDate
-    def getSearchResultsFields(self): return self._searchResultsFields
+    def getSearchResultsFields(self):
+        """ Return the raw search result record (None if compact or released)
+        """
+        return self._searchResultsFields
 
     def getElsClient(self):   return self._elsClient
 
@@ -359,34 +1477,134 @@ class SciDirectReference(object):
         self._getDetails()
         return self._volume
     def getDetails(self):
-        self._getDetails()
+        """ Return the details API response ('full-text-retrieval-response').
+            If it was released (or weakly held & freed), it is loaded again.
+        """
+        details = self._heldDetails()
+        if details is None:
+            self._detailsLoaded = False
+            details = self._getDetails()
+        return details
+
+    def _heldDetails(self):
+        """ Return the details API response if we still hold it, else None
+        """
+        if self._compact and self._detailFields is not None:
+            return self._detailFields()         # dereference the weakref
         return self._detailFields
 
+    def release(self):
+        """ Drop the raw payloads this reference holds: the search result
+            record, the details API response and the pdf bytes.
+            The unpacked fields (PMID, etc.) are kept.
+        """
+        self._searchResultsFields = None
+        self._detailFields = None
+        self._pdf = None
+
     def _getDetails(self):
-        """ load the reference details from the API if they have not already
-            been loaded.
+        """ load the reference details from the client's metadata cache or
+            the API if they have not already been loaded.
+            If the cached details have expired, they are revalidated w/ a
+            conditional GET, so unchanged details aren't re-downloaded.
+            Return the details response if we loaded it, else None.
         """
-        if not self._detailFields:
-            # This URL gets full info including full text and abstract
-            #url = url_base + 'content/article/pii/' + str(self._pii)
+        if not self._detailsLoaded:
+            entry = self._getCacheEntry()
+            if entry is not None and not entry.expired:
+                self._elsClient.getMetrics().count('details_from_cache')
+                return self._setDetails(entry.payload)
+            validators = entry.validators if entry else None
+            response, validators = self._elsClient.execConditionalGetRequest(
+                                    self._detailsUrl(), validators=validators)
+            return self._setDetails(
+                                self._updateCache(entry, response, validators))
+        return None
 
-            # This URL just gets meta info and has a smaller payload
-            url = url_base + 'content/article/pii/%s?view=META' % str(self._pii)
-            response = self._elsClient.execGetRequest(url)
+    async def loadDetailsAsync(self):
+        """ load the reference details (if not already loaded) using an
+            AsyncElsClient. Afterwards getPmid(), etc. don't make API calls.
+        """
+        if not self._detailsLoaded:
+            entry = self._getCacheEntry()
+            if entry is not None and not entry.expired:
+                self._elsClient.getMetrics().count('details_from_cache')
+                self._setDetails(entry.payload)
+                return self
+            validators = entry.validators if entry else None
+            response, validators = \
+                        await self._elsClient.execConditionalGetRequest(
+                                    self._detailsUrl(), validators=validators)
+            self._setDetails(self._updateCache(entry, response, validators))
+        return self
 
-            # TODO: should we dump json output somewhere for debugging?
-            r = response['full-text-retrieval-response']
-            #print(json.dumps(response, sort_keys=True, indent="  "))
+    def _getCacheEntry(self):
+        """ Return the details API response CacheEntry from the client's
+            metadata cache, or None if the client has no cache or it's not in
+            there
+        """
+        cache = self._elsClient.getMetadataCache()
+        if cache is None:
+            return None
+        return cache.getEntry(self._pii, self.__details_view)
+
+    def _updateCache(self, entry, response, validators):
+        """ Update the client's metadata cache from the details API response.
+            entry = the (expired) CacheEntry we revalidated, or None
+            response = None if the API said the entry is unchanged (HTTP 304)
+            Return the details API response to use.
+            Articles w/o a PMID yet are only cached briefly so we notice when
+            they get one.
+        """
+        notModified = response is None
+        if notModified:
+            response = entry.payload
+        self._elsClient.getMetrics().count('details_not_modified'
+                                    if notModified else 'details_fetched')
+        cache = self._elsClient.getMetadataCache()
+        if cache is None:
+            return response
+        ttl = None          # the cache's default
+        if 'pubmed-id' not in response['full-text-retrieval-response']:
+            ttl = self.__no_pmid_cache_ttl
+        if notModified:
+            cache.refresh(self._pii, self.__details_view, ttl=ttl)
+        else:
+            cache.put(self._pii, self.__details_view, response, ttl=ttl,
+                                                        validators=validators)
+        return response
+
+    def _detailsUrl(self):
+        # This URL gets full info including full text and abstract
+        #url = url_base + 'content/article/pii/' + str(self._pii)
+
+        # This URL just gets meta info and has a smaller payload
+        return url_base + 'content/article/pii/%s?view=%s' % \
+                                        (str(self._pii), self.__details_view)
+
+    def _setDetails(self, response):
+        """ unpack the details API response, return its
+            'full-text-retrieval-response'
+        """
+        # TODO: should we dump json output somewhere for debugging?
+        r = response['full-text-retrieval-response']
+        #print(json.dumps(response, sort_keys=True, indent="  "))
+        if self._compact:
+            r = _Payload(r)
+            self._detailFields = weakref.ref(r)
+        else:
             self._detailFields = r
+        self._detailsLoaded = True
 
-            # unpack the fields, just these for now.
-            # Other fields are avail, including the full text in xml fmt
-            self._pmid     = r.get('pubmed-id', 'no PMID')
-            self._pubType  = r['coredata'].get('pubType', 'no pubType')
-            self._volume   = r['coredata'].get('prism:volume', 'no volume')
+        # unpack the fields, just these for now.
+        # Other fields are avail, including the full text in xml fmt
+        self._pmid     = r.get('pubmed-id', 'no PMID')
+        self._pubType  = r['coredata'].get('pubType', 'no pubType')
+        self._volume   = r['coredata'].get('prism:volume', 'no volume')
 
-            # If we need abstract, change back to the full URL above
-            #self._abstract = r['coredata'].get('dc:description', 'no abstract')
+        # If we need abstract, change back to the full URL above
+        #self._abstract = r['coredata'].get('dc:description', 'no abstract')
+        return r
 
     # getters for the PDF
     def getPdf(self):
@@ -397,7 +1615,164 @@ class SciDirectReference(object):
         """ Get the PDF from the API if we have not already done so
         """
         if not self._pdf:
-            url = url_base + 'content/article/pii/' + str(self._pii)
-            self._pdf = self._elsClient.execGetRequest(url, contentType='pdf')
+            self._pdf = self._elsClient.execGetRequest(self._pdfUrl(),
+                                                            contentType='pdf')
+
+    async def loadPdfAsync(self):
+        """ Get the PDF (if we have not already done so) using an
+            AsyncElsClient. Afterwards getPdf() doesn't make an API call.
+        """
+        if not self._pdf:
+            self._pdf = await self._elsClient.execGetRequest(self._pdfUrl(),
+                                                            contentType='pdf')
+        return self
+
+    def _pdfUrl(self):
+        return url_base + 'content/article/pii/' + str(self._pii)
+
+    def savePdf(self, path, chunkSize=PDF_CHUNK_SIZE, conditional=True,
+                                                                hasher=None):
+        """ Save the PDF to the file 'path'.
+            Streams it from the API straight to disk (unless we already have
+            it in memory from getPdf()), so the pdf isn't kept in memory.
+            'path' is replaced atomically, it never holds a partial pdf.
+            The response's validators (ETag, Last-Modified) are saved next to
+            the pdf. If conditional and 'path' already exists w/ validators,
+            we send a conditional GET and leave the file alone if the API
+            says it is unchanged.
+            If hasher is given (e.g., a hashlib.sha256()), it is updated w/
+            the pdf's bytes as they are written (see pdfStore.py).
+            Return the number of bytes written (0 if unchanged).
+            See pdfChanged()
+        """
+        if self._pdf:
+            return self._savePdfFromMemory(path, hasher)
+        numBytes, validators = self._elsClient.downloadPdfIfChanged(
+                                    self._pdfUrl(), path,
+                                    self._savedPdfValidators(path, conditional),
+                                    chunkSize, hasher)
+        return self._pdfSaved(path, numBytes, validators)
+
+    async def savePdfAsync(self, path, chunkSize=PDF_CHUNK_SIZE,
+                                            conditional=True, hasher=None):
+        """ savePdf() using an AsyncElsClient
+        """
+        if self._pdf:
+            return self._savePdfFromMemory(path, hasher)
+        numBytes, validators = await self._elsClient.downloadPdfIfChanged(
+                                    self._pdfUrl(), path,
+                                    self._savedPdfValidators(path, conditional),
+                                    chunkSize, hasher)
+        return self._pdfSaved(path, numBytes, validators)
+
+    def pdfChanged(self):
+        """ Return True if the last savePdf() wrote a new or changed pdf,
+            False if the API said the saved pdf is unchanged,
+            None if we don't know (savePdf() not called, or it saved a pdf
+            we already had in memory)
+        """
+        return self._pdfChanged
+
+    def _savePdfFromMemory(self, path, hasher=None):
+        writer = _PdfFileWriter(path, len(self._pdf),
+                                        self._elsClient.getMetrics(), hasher)
+        try:
+            writer.write(self._pdf)
+            numBytes = writer.finish()
+        except:
+            writer.abort()
+            raise
+        _writePdfValidators(path, None)     # we don't know them, rm stale ones
+        self._pdfChanged = None
+        return numBytes
+
+    def _savedPdfValidators(self, path, conditional):
+        """ Return the validators of the pdf already saved at path, or None
+        """
+        if conditional and os.path.exists(path):
+            return readPdfValidators(path)
+        return None
+
+    def _pdfSaved(self, path, numBytes, validators):
+        """ Record the results of a (conditional) pdf download to path.
+            Return the number of bytes written
+        """
+        if numBytes is None:            # unchanged
+            self._pdfChanged = False
+            self._elsClient.getMetrics().count('pdfs_unchanged')
+            return 0
+        _writePdfValidators(path, validators)
+        self._pdfChanged = True
+        self._elsClient.getMetrics().count('pdfs_saved')
+        return numBytes
 
 # end class SciDirectReference -------------------------
+
+def prefetchDetails(refs, workers=4):
+    """ Load the details (PMID, pubType, ...) for many SciDirectReferences
+            concurrently using a pool of 'workers' threads.
+        All requests go through the refs' ElsClients, so they stay within
+            the client's rate limit.
+        Returns dict {pii: exception} for the refs whose details could not
+            be loaded. Failures don't stop the other refs from loading.
+    """
+    return _prefetch(refs, lambda r: r._getDetails(), workers)
+
+def prefetchPdfs(refs, workers=4):
+    """ Load the PDFs for many SciDirectReferences concurrently.
+        Returns dict {pii: exception} for the refs whose PDF could not be
+            loaded. See prefetchDetails().
+    """
+    return _prefetch(refs, lambda r: r._getPdf(), workers)
+
+def savePdfs(refs, pathFunc, workers=4):
+    """ Stream the PDFs for many SciDirectReferences to disk concurrently.
+        pathFunc(ref) returns the file path to save ref's pdf in.
+        Returns dict {pii: exception} for the refs whose PDF could not be
+            saved. See prefetchDetails().
+    """
+    return _prefetch(refs, lambda r: r.savePdf(pathFunc(r)), workers)
+
+def _prefetch(refs, loader, workers):
+    """ Run loader(ref) for each ref in a thread pool.
+        Return dict {pii: exception} for the refs where loader() raised.
+    """
+    failures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(loader, r): r for r in refs}
+        for future in as_completed(futures):
+            exc = future.exception()
+            if exc is not None:
+                pii = futures[future].getPii()
+                logger.info('prefetch failed for pii %s: %s', pii, exc)
+                failures[pii] = exc
+    return failures
+
+async def prefetchDetailsAsync(refs, concurrency=100):
+    """ asyncio version of prefetchDetails() for refs w/ an AsyncElsClient.
+        At most 'concurrency' requests are in flight at once (they all still
+            go through the client's rate limiter).
+        Returns dict {pii: exception} for the refs that failed.
+    """
+    return await _prefetchAsync(refs, lambda r: r.loadDetailsAsync(),
+                                                                concurrency)
+
+async def prefetchPdfsAsync(refs, concurrency=100):
+    """ asyncio version of prefetchPdfs(). See prefetchDetailsAsync()
+    """
+    return await _prefetchAsync(refs, lambda r: r.loadPdfAsync(), concurrency)
+
+async def _prefetchAsync(refs, loader, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = {}
+
+    async def load(r):
+        async with semaphore:
+            try:
+                await loader(r)
+            except Exception as e:
+                logger.info('prefetch failed for pii %s: %s', r.getPii(), e)
+                failures[r.getPii()] = e
+
+    await asyncio.gather(*[load(r) for r in refs])
+    return failures
@@ -0,0 +1,101 @@
+"""Logging setup for SciDirectLib and the harvest scripts, off the request
+    hot path.
+
+    Importing SciDirectLib doesn't touch the file system or add handlers: its
+    logger ('SciDirectLib') has no handlers until configureLogging() is
+    called (so, like any library logger, its records go wherever the
+    application's logging config sends them).
+
+    configureLogging() sends the records to a log file (& errors to the
+    console) through a queue: the threads sending requests just put each
+    record on an unbounded queue (never blocking on disk or on a handler
+    lock), and a background thread (a logging.handlers.QueueListener)
+    formats and writes them. Formatting the message (msg % args) is left to
+    the background thread too, so log calls should pass their args:
+        logger.info('Sending GET request to %s', URL)
+    Calling it again replaces the earlier configuration (no duplicate
+    handlers). shutdownLogging() (also run at exit) flushes the queue.
+
+Functions
+    configureLogging(logDir, level, consoleLevel, loggerNames)
+    shutdownLogging()
+    getListener() - the running QueueListener, or None
+"""
+
+import os, time, queue, atexit, logging, threading
+import logging.handlers
+
+LOGGER_NAMES = ('SciDirectLib',)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_lock = threading.Lock()
+_listener = None        # the running QueueListener
+_handlers = {}          # logger name -> the QueueHandler we added to it
+_atexitRegistered = False
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that leaves the formatting to the listener.
+        (QueueHandler.prepare() formats the message in the logging thread so
+        the record can be pickled. Our queue is in-process, it needn't be.)
+    """
+    def prepare(self, record):
+        return record
+
+def configureLogging(logDir='logs',     # None = no log file
+                level=logging.DEBUG,    # level of the records to log
+                consoleLevel=logging.ERROR, # ... & to write to stderr
+                                        #  (None = no console)
+                loggerNames=LOGGER_NAMES,
+                ):
+    """ Log the loggerNames' records to logDir/SciDirectLib-<date>.log (and
+        stderr) via a queue and a background writer thread.
+        Return the QueueListener.
+    """
+    global _listener, _atexitRegistered
+    handlers = []
+    formatter = logging.Formatter(LOG_FORMAT)
+    if logDir is not None:
+        os.makedirs(logDir, exist_ok=True)
+        fileName = 'SciDirectLib-%s.log' % time.strftime('%Y%m%d')
+        fh = logging.FileHandler(os.path.join(logDir, fileName))
+        fh.setLevel(level)
+        fh.setFormatter(formatter)
+        handlers.append(fh)
+    if consoleLevel is not None:
+        ch = logging.StreamHandler()
+        ch.setLevel(consoleLevel)
+        ch.setFormatter(formatter)
+        handlers.append(ch)
+
+    shutdownLogging()           # replace any earlier configuration
+    with _lock:
+        recordQueue = queue.SimpleQueue()   # unbounded, put() never blocks
+        _listener = logging.handlers.QueueListener(recordQueue, *handlers,
+                                                respect_handler_level=True)
+        for name in loggerNames:
+            logger = logging.getLogger(name)
+            logger.setLevel(level)
+            handler = _DeferredQueueHandler(recordQueue)
+            logger.addHandler(handler)
+            _handlers[name] = handler
+        _listener.start()
+        if not _atexitRegistered:
+            atexit.register(shutdownLogging)
+            _atexitRegistered = True
+    return _listener
+
+def shutdownLogging():
+    """ Stop logging to the queue, write out what's on it, close the files
+    """
+    global _listener
+    with _lock:
+        for name, handler in _handlers.items():
+            logging.getLogger(name).removeHandler(handler)
+        _handlers.clear()
+        if _listener is not None:
+            _listener.stop()        # processes the records still queued
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+def getListener():  return _listener
@@ -0,0 +1,266 @@
+"""Request level metrics for ElsClients: where does the time of a harvest go?
+
+    An ElsClient records into its ElsMetrics object (see
+    ElsClient.getMetrics()), per endpoint (search, META, PDF, other):
+        - a histogram of request latencies (secs until the response arrived;
+            for streamed pdfs the body download is the 'pdf_body' phase)
+        - counts of responses by HTTP status code
+        - bytes received
+        - num of retries
+    and overall:
+        - secs slept by the rate limiter (throttle)
+        - secs spent in other phases: 'backoff' (waiting to retry),
+            'json_decode', 'pdf_body', 'disk_write'
+        - event counters from SciDirectSearch & SciDirectReference, e.g.,
+            search_pages, details_from_cache, pdfs_unchanged
+
+    ElsClients made by sharingClient() share their metrics.
+
+Class Overview
+    class Histogram
+    - counts of observations in cumulative buckets, w/ their sum & count
+
+    class ElsMetrics
+    - thread safe recording of the above
+    - snapshot() - everything as a dict, toJson(), toPrometheus() (the
+        Prometheus text exposition format), summary() - text for people
+
+Functions
+    endpointOf(url) - which endpoint (search, META, PDF, other) a URL is for
+"""
+
+import json, time, threading, contextlib
+
+# latency histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ENDPOINTS = ('search', 'META', 'PDF', 'other')
+
+def endpointOf(url):
+    """ Return which API endpoint url is for: search, META, PDF, or other
+    """
+    if 'content/search/sciencedirect' in url:
+        return 'search'
+    if 'content/article/' in url:
+        if 'view=META' in url:
+            return 'META'
+        return 'PDF'
+    return 'other'
+
+class Histogram(object):
+    """
+    IS:   a histogram of observed values
+    HAS:  bucket upper bounds, count per bucket, sum & count of the values
+    DOES: observe(value), quantile(q) (upper bound of the bucket it's in)
+          Not thread safe by itself, ElsMetrics locks around it.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._bounds = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._bounds) + 1)    # last is +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self._bounds) and value > self._bounds[i]:
+            i += 1
+        self._counts[i] += 1
+        self._sum += value
+        self._count += 1
+
+    def quantile(self, q):
+        """ Return the upper bound of the bucket holding the q quantile
+            (float('inf') if it's past the last bound), None if empty
+        """
+        if self._count == 0:
+            return None
+        target = q * self._count
+        cumulative = 0
+        for bound, n in zip(self._bounds + (float('inf'),), self._counts):
+            cumulative += n
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        """ Return {'buckets': [[upper bound, cumulative count], ...],
+                    'sum': .., 'count': ..}  (the last bound is '+Inf')
+        """
+        buckets = []
+        cumulative = 0
+        for bound, n in zip(self._bounds + ('+Inf',), self._counts):
+            cumulative += n
+            buckets.append([bound, cumulative])
+        return {'buckets': buckets, 'sum': self._sum, 'count': self._count}
+
+    def getCount(self): return self._count
+    def getSum(self):   return self._sum
+# end class Histogram -------------------------
+
+class ElsMetrics(object):
+    """
+    IS:   the metrics for one or more ElsClients
+    HAS:  per endpoint latency histograms, status/byte/retry counts,
+          throttle & phase times, event counts
+    DOES: records them (thread safe), exports them
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._clock = time.monotonic
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latency = {}      # endpoint -> Histogram
+            self._statuses = {}     # endpoint -> {status code: count}
+            self._bytes = {}        # endpoint -> bytes received
+            self._retries = {}      # endpoint -> num of retries
+            self._throttle = 0.0    # secs slept by the rate limiter
+            self._phases = {}       # phase -> secs
+            self._events = {}       # event name -> count
+            self._started = self._clock()
+
+    def observeRequest(self, endpoint, seconds, status=None, numBytes=0):
+        """ Record a request to endpoint that took 'seconds' and got HTTP
+            'status' and numBytes of body
+        """
+        with self._lock:
+            hist = self._latency.get(endpoint)
+            if hist is None:
+                hist = self._latency[endpoint] = Histogram(self._buckets)
+            hist.observe(seconds)
+            if status is not None:
+                statuses = self._statuses.setdefault(endpoint, {})
+                statuses[status] = statuses.get(status, 0) + 1
+            self._bytes[endpoint] = self._bytes.get(endpoint, 0) + numBytes
+
+    def addBytes(self, endpoint, numBytes):
+        with self._lock:
+            self._bytes[endpoint] = self._bytes.get(endpoint, 0) + numBytes
+
+    def addRetry(self, endpoint):
+        with self._lock:
+            self._retries[endpoint] = self._retries.get(endpoint, 0) + 1
+
+    def addThrottle(self, seconds):
+        if seconds:
+            with self._lock:
+                self._throttle += seconds
+
+    def addTime(self, phase, seconds):
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """ Context manager: add the time spent in the block to phase
+        """
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.addTime(phase, self._clock() - start)
+
+    def count(self, event, n=1):
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + n
+
+    def snapshot(self):
+        """ Return all the metrics as a dict (json serializable)
+        """
+        with self._lock:
+            endpoints = {}
+            for ep in sorted(set(self._latency) | set(self._bytes) |
+                                                        set(self._retries)):
+                hist = self._latency.get(ep)
+                endpoints[ep] = {
+                    'latency' : hist.snapshot() if hist else None,
+                    'statuses': {str(k): v for k, v in
+                                sorted(self._statuses.get(ep, {}).items())},
+                    'bytes'   : self._bytes.get(ep, 0),
+                    'retries' : self._retries.get(ep, 0),
+                    }
+            return {'endpoints'     : endpoints,
+                    'throttleSecs'  : self._throttle,
+                    'phaseSecs'     : dict(self._phases),
+                    'events'        : dict(self._events),
+                    'elapsedSecs'   : self._clock() - self._started,
+                    }
+
+    def toJson(self, **kwargs):
+        """ Return the snapshot() as a json string
+        """
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def toPrometheus(self, prefix='elsclient'):
+        """ Return the metrics in the Prometheus text exposition format
+        """
+        snap = self.snapshot()
+        lines = []
+        def add(name, mtype, samples):
+            lines.append('# TYPE %s_%s %s' % (prefix, name, mtype))
+            for suffix, labels, value in samples:
+                labelText = ','.join('%s="%s"' % kv for kv in labels)
+                if labelText:
+                    labelText = '{%s}' % labelText
+                lines.append('%s_%s%s%s %s' % (prefix, name, suffix,
+                                                        labelText, value))
+        endpoints = snap['endpoints']
+        samples = []
+        for ep, m in endpoints.items():
+            if m['latency'] is None:
+                continue
+            for bound, n in m['latency']['buckets']:
+                samples.append(('_bucket',
+                                [('endpoint', ep), ('le', bound)], n))
+            samples.append(('_sum', [('endpoint', ep)], m['latency']['sum']))
+            samples.append(('_count', [('endpoint', ep)],
+                                                    m['latency']['count']))
+        add('request_seconds', 'histogram', samples)
+        add('responses_total', 'counter',
+                [('', [('endpoint', ep), ('status', status)], n)
+                    for ep, m in endpoints.items()
+                    for status, n in m['statuses'].items()])
+        add('received_bytes_total', 'counter',
+                [('', [('endpoint', ep)], m['bytes'])
+                    for ep, m in endpoints.items()])
+        add('retries_total', 'counter',
+                [('', [('endpoint', ep)], m['retries'])
+                    for ep, m in endpoints.items()])
+        add('throttle_seconds_total', 'counter',
+                [('', [], snap['throttleSecs'])])
+        add('phase_seconds_total', 'counter',
+                [('', [('phase', p)], secs)
+                    for p, secs in sorted(snap['phaseSecs'].items())])
+        add('events_total', 'counter',
+                [('', [('event', e)], n)
+                    for e, n in sorted(snap['events'].items())])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ Return a few lines of text summarizing the metrics
+        """
+        snap = self.snapshot()
+        lines = ['API requests (%.1fs elapsed):' % snap['elapsedSecs']]
+        for ep, m in snap['endpoints'].items():
+            with self._lock:
+                hist = self._latency.get(ep)
+                p50 = hist.quantile(0.5) if hist else None
+                p95 = hist.quantile(0.95) if hist else None
+            count = m['latency']['count'] if m['latency'] else 0
+            avg = m['latency']['sum'] / count if count else 0.0
+            statuses = ' '.join('%s:%d' % kv for kv in m['statuses'].items())
+            lines.append('  %s: %d requests, avg %.3fs, p50 <= %ss, '
+                        'p95 <= %ss, %.1f MB, %d retries, statuses %s' % \
+                        (ep, count, avg, p50, p95, m['bytes']/1e6,
+                        m['retries'], statuses or '-'))
+        lines.append('Throttle sleep: %.1fs' % snap['throttleSecs'])
+        if snap['phaseSecs']:
+            lines.append('Other time: ' + ', '.join('%s %.1fs' % kv
+                                for kv in sorted(snap['phaseSecs'].items())))
+        if snap['events']:
+            lines.append('Events: ' + ', '.join('%s=%d' % kv
+                                for kv in sorted(snap['events'].items())))
+        return '\n'.join(lines)
+# end class ElsMetrics -------------------------
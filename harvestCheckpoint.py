@@ -0,0 +1,153 @@
+"""Checkpoints for incremental, resumable harvests from the Elsevier API.
+
+    A harvest (e.g., journalSearch.py) runs one search query per journal and
+    then fetches the details & PDF of each matching article.
+    A HarvestCheckpoint remembers, for each query:
+        - the newest loadDate of the articles seen by the last completed run
+            so the next run can ask for articles loadedAfter that date
+        - which PIIs have been fully processed (details fetched, PDF written)
+            so a run that crashed part way through (or overlaps the previous
+            window) doesn't redo them.
+
+    So nightly runs cost time in proportion to the new articles, not to the
+    size of the loadedAfter window.
+
+    Queries are identified by a key string, see queryKey().
+
+Class Overview
+    class HarvestCheckpoint
+    - getLoadedAfter(key, default)  - loadedAfter date for the next run
+    - isDone(key, pii), getDonePiis(key)
+    - markDone(key, pii, loadDate)  - the article is fully processed
+    - finishRun(key, newestLoadDate, oldestFailedLoadDate)
+                                    - the run for this query completed,
+                                        advance its loadDate checkpoint
+
+Functions
+    queryKey(query) - a stable key for a SciDirectSearch query dict
+"""
+
+import json, time, datetime, threading, sqlite3
+
+# query params that don't change which articles a query is about
+NON_KEY_PARAMS = ('loadedAfter', 'display')
+
+def queryKey(query):
+    """ Return a stable key string for a SciDirectSearch query dict,
+        ignoring its loadedAfter date and display options.
+    """
+    params = {k: v for k, v in query.items() if k not in NON_KEY_PARAMS}
+    return json.dumps(params, sort_keys=True)
+
+class HarvestCheckpoint(object):
+    """
+    IS:   a checkpoint store in an SQLite database file.
+    HAS:  one row per query key w/ the newest loadDate of its last completed
+          run, and one row per (key, PII) that has been fully processed.
+    DOES: tells a harvest what loadedAfter date to use and which PIIs it can
+          skip. Safe to share between threads.
+    """
+    def __init__(self, dbPath,
+                overlapDays=1,  # start the next run this many days before the
+                                #  newest loadDate, in case the API indexes
+                                #  articles late. (PIIs already done are
+                                #  skipped anyway.)
+                lockTimeout=30):  # seconds to wait for the sqlite lock
+        self._dbPath = dbPath
+        self._overlapDays = overlapDays
+        self._clock = time.time
+        self._conn = sqlite3.connect(dbPath, timeout=lockTimeout,
+                                                    check_same_thread=False)
+        self._dbLock = threading.Lock()     # one connection, many threads
+        with self._dbLock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS checkpoints (
+                                    key       TEXT PRIMARY KEY,
+                                    loadDate  TEXT NOT NULL,
+                                    updated   REAL NOT NULL)''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS done (
+                                    key       TEXT NOT NULL,
+                                    pii       TEXT NOT NULL,
+                                    loadDate  TEXT,
+                                    PRIMARY KEY (key, pii))''')
+
+    def getLoadDate(self, key):
+        """ Return the newest loadDate seen by the last completed run of the
+            query 'key', or None if it has never completed.
+        """
+        with self._dbLock:
+            row = self._conn.execute('SELECT loadDate FROM checkpoints ' +
+                                        'WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def getLoadedAfter(self, key, default=None):
+        """ Return the loadedAfter date ('YYYY-MM-DD') the next run of the
+            query 'key' should use, or default if it has never completed.
+        """
+        loadDate = self.getLoadDate(key)
+        if loadDate is None:
+            return default
+        day = datetime.date.fromisoformat(loadDate[:10])
+        return (day - datetime.timedelta(days=self._overlapDays)).isoformat()
+
+    def isDone(self, key, pii):
+        with self._dbLock:
+            return self._conn.execute('SELECT 1 FROM done ' +
+                    'WHERE key = ? AND pii = ?', (key, pii)).fetchone() \
+                                                                is not None
+
+    def getDonePiis(self, key):
+        """ Return the set of PIIs that are fully processed for query 'key'
+        """
+        with self._dbLock:
+            rows = self._conn.execute('SELECT pii FROM done WHERE key = ?',
+                                                            (key,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def markDone(self, key, pii, loadDate=None):
+        """ The article 'pii' (loaded at loadDate) from query 'key' is fully
+            processed. Committed right away so a crash doesn't lose it.
+        """
+        with self._dbLock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO done ' +
+                        '(key, pii, loadDate) VALUES (?, ?, ?)',
+                        (key, pii, loadDate))
+
+    def finishRun(self, key, newestLoadDate, oldestFailedLoadDate=None):
+        """ A run of query 'key' completed.
+            newestLoadDate = the newest loadDate of the articles it saw.
+            oldestFailedLoadDate = the oldest loadDate of the articles it
+                couldn't process (if any). The checkpoint won't move past it
+                so the next run tries them again.
+            The checkpoint never moves backward. PIIs loaded before the next
+            run's window are forgotten since it won't see them again.
+            Return the new checkpoint loadDate (or None).
+        """
+        loadDate = newestLoadDate
+        if oldestFailedLoadDate is not None and loadDate is not None:
+            loadDate = min(loadDate, oldestFailedLoadDate)
+        old = self.getLoadDate(key)
+        if loadDate is None or (old is not None and loadDate <= old):
+            return old
+        with self._dbLock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO checkpoints ' +
+                        '(key, loadDate, updated) VALUES (?, ?, ?)',
+                        (key, loadDate, self._clock()))
+        loadedAfter = self.getLoadedAfter(key)
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM done WHERE key = ? AND ' +
+                        'loadDate < ?', (key, loadedAfter))
+        return loadDate
+
+    def reset(self, key):
+        """ Forget everything about query 'key' (start from scratch)
+        """
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM checkpoints WHERE key = ?', (key,))
+            self._conn.execute('DELETE FROM done WHERE key = ?', (key,))
+
+    def close(self):
+        with self._dbLock:
+            self._conn.close()
+
+    def getDbPath(self):   return self._dbPath
+# end class HarvestCheckpoint -------------------------
@@ -0,0 +1,240 @@
+"""Run the searches & downloads for many journals concurrently, within one
+    request budget.
+
+    A harvest runs one SciDirectSearch per journal and then processes the
+    matching references (details, PDFs). Doing the journals one after another
+    means a slow one (e.g., Journal of Biological Chemistry) holds up all the
+    others, and the run takes the sum of their latencies.
+
+    HarvestDriver runs the journals in a thread pool. Each journal gets its
+    own ElsClient that shares the base client's session and rate limiter, but
+    throttles through a FairShareLimiter that hands out the limiter's slots
+    round robin among the journals that are waiting. So the run goes as fast
+    as the quota allows, and a journal w/ lots of requests queued can't
+    starve the small ones.
+
+Class Overview
+    class FairShareLimiter
+    - wraps a rate limiter from rateLimiter.py, getTenant(name) returns a
+        limiter for one tenant (journal). Tenants take turns.
+
+    class HarvestTask
+    - a journal (task name) and its SciDirectSearch query, or its already
+        executed search (e.g., its share of a batched search, see
+        journalBatch.py)
+
+    class TaskProgress
+    - the state of one task: queued, searching, processing, done, failed;
+        num of results & requests, time spent throttled, elapsed time,
+        what processFunc returned, or the exception that stopped it
+
+    class HarvestDriver
+    - run(tasks) - run the tasks concurrently, return {name: TaskProgress}
+"""
+
+import time, threading, collections
+from concurrent.futures import ThreadPoolExecutor
+from SciDirectLib import SciDirectSearch
+
+class FairShareLimiter(object):
+    """
+    IS:   a rate limiter shared fairly by named tenants
+    HAS:  the underlying limiter, the number of requests each tenant has
+          waiting, in round robin order
+    DOES: lets one waiting request at a time take a slot from the underlying
+          limiter: the next one from the tenant that was served longest ago.
+          Thread safe. (Not for use w/ AsyncRateLimiter)
+    """
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._cond = threading.Condition()
+        self._waiting = collections.OrderedDict()   # tenant -> num waiting
+        self._busy = False      # a request is taking a slot from the limiter
+
+    def getTenant(self, name):
+        """ Return a TenantLimiter for tenant 'name'
+        """
+        return TenantLimiter(self, name)
+
+    def acquire(self, tenant, tokens=1):
+        """ Wait for tenant's turn, then take 'tokens' tokens from the
+            underlying limiter. Return the number of seconds slept there.
+        """
+        with self._cond:
+            self._waiting[tenant] = self._waiting.get(tenant, 0) + 1
+            while self._busy or next(iter(self._waiting)) != tenant:
+                self._cond.wait()
+            self._busy = True
+            self._waiting[tenant] -= 1
+            if self._waiting[tenant] == 0:
+                del self._waiting[tenant]
+            else:
+                self._waiting.move_to_end(tenant)   # back of the line
+        try:
+            return self._limiter.acquire(tokens)
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def getLimiter(self):   return self._limiter
+# end class FairShareLimiter -------------------------
+
+class TenantLimiter(object):
+    """
+    IS:   one tenant's view of a FairShareLimiter, usable as an ElsClient's
+          rateLimiter
+    HAS:  num of requests it has let through & the secs they were throttled
+    DOES: acquire() waits for our turn. Adaptive feedback (onThrottled(), etc.)
+          goes to the underlying limiter if it supports it.
+    """
+    _FORWARDED = ('onThrottled', 'onSuccess', 'onQuota', 'pause')
+
+    def __init__(self, fairLimiter, name):
+        self._fairLimiter = fairLimiter
+        self._name = name
+        self._lock = threading.Lock()
+        self._numRequests = 0
+        self._secsThrottled = 0.0
+
+    def acquire(self, tokens=1):
+        start = time.monotonic()
+        self._fairLimiter.acquire(self._name, tokens)
+        waited = time.monotonic() - start
+        with self._lock:
+            self._numRequests += 1
+            self._secsThrottled += waited
+        return waited
+
+    def __getattr__(self, name):
+        if name in TenantLimiter._FORWARDED:
+            return getattr(self._fairLimiter.getLimiter(), name)
+        raise AttributeError(name)
+
+    def getRate(self):          return self._fairLimiter.getLimiter().getRate()
+    def getName(self):          return self._name
+    def getNumRequests(self):   return self._numRequests
+    def getSecsThrottled(self): return self._secsThrottled
+# end class TenantLimiter -------------------------
+
+class HarvestTask(object):  # simple task struct
+    def __init__(self, name, query, search=None):
+        self.name = name        # e.g., the journal name, must be unique
+        self.query = query      # SciDirectSearch query dict
+        self.search = search    # if set, the executed search (w/
+                                #  setElsClient()) to process, not run one
+# end class HarvestTask -------------------------
+
+class TaskProgress(object):
+    """ The progress of one HarvestTask (see module docstring)
+    """
+    QUEUED, SEARCHING, PROCESSING, DONE, FAILED = \
+                        'queued', 'searching', 'processing', 'done', 'failed'
+
+    def __init__(self, name):
+        self.name = name
+        self.state = TaskProgress.QUEUED
+        self.numResults = None  # total num of search results
+        self.result = None      # what processFunc returned
+        self.error = None       # exception that stopped the task
+        self.startTime = None
+        self.endTime = None
+        self.limiter = None     # the task's TenantLimiter
+
+    def getNumRequests(self):
+        return self.limiter.getNumRequests() if self.limiter else 0
+
+    def getSecsThrottled(self):
+        return self.limiter.getSecsThrottled() if self.limiter else 0.0
+
+    def getElapsed(self):
+        """ Return secs since the task started (until it ended)
+        """
+        if self.startTime is None:
+            return 0.0
+        return (self.endTime or time.monotonic()) - self.startTime
+
+    def __str__(self):
+        text = "%s: %s, %s results, %d requests, %.1fs throttled, %.1fs" % \
+                    (self.name, self.state, self.numResults,
+                    self.getNumRequests(), self.getSecsThrottled(),
+                    self.getElapsed())
+        if self.error is not None:
+            text += ", error: %s" % self.error
+        return text
+# end class TaskProgress -------------------------
+
+class HarvestDriver(object):
+    """
+    IS:   a driver that runs HarvestTasks concurrently
+    HAS:  the base ElsClient, the processing function, a FairShareLimiter
+          over the base client's rate limiter
+    DOES: for each task: runs its SciDirectSearch (unless the task has its
+          search already), then calls
+              processFunc(task, search, elsClient)
+          (elsClient is the task's own client, use it for any other requests
+          so they draw from the task's fair share). Reports progress.
+    """
+    def __init__(self, elsClient, processFunc,
+                maxConcurrent=4,    # max num of tasks to run at once
+                progressFunc=None,  # progressFunc(taskProgress) is called
+                                    #  when a task changes state
+                **searchArgs,       # for SciDirectSearch, e.g., getAll=True
+                ):
+        self._elsClient = elsClient
+        self._processFunc = processFunc
+        self._maxConcurrent = maxConcurrent
+        self._progressFunc = progressFunc
+        self._searchArgs = searchArgs
+        self._fairLimiter = FairShareLimiter(elsClient.getRateLimiter())
+        self._progressLock = threading.Lock()   # report one at a time
+
+    def run(self, tasks):
+        """ Run the tasks, return {task name: TaskProgress} in task order.
+            A task that raises an exception is marked failed (w/ the
+            exception in its progress), the others carry on.
+        """
+        progress = collections.OrderedDict()
+        for task in tasks:
+            if task.name in progress:
+                raise ValueError('duplicate task name: %s' % task.name)
+            progress[task.name] = TaskProgress(task.name)
+        with ThreadPoolExecutor(max_workers=self._maxConcurrent) as pool:
+            futures = [pool.submit(self._runTask, task, progress[task.name])
+                                                            for task in tasks]
+            for f in futures:
+                f.result()
+        return progress
+
+    def _runTask(self, task, progress):
+        progress.limiter = self._fairLimiter.getTenant(task.name)
+        progress.startTime = time.monotonic()
+        client = self._elsClient.sharingClient(progress.limiter)
+        try:
+            self._setState(progress, TaskProgress.SEARCHING)
+            if task.search is not None:
+                search = task.search
+                search.setElsClient(client)
+            else:
+                search = SciDirectSearch(client, task.query,
+                                                **self._searchArgs).execute()
+            progress.numResults = search.getTotalNumResults()
+            self._setState(progress, TaskProgress.PROCESSING)
+            progress.result = self._processFunc(task, search, client)
+            progress.endTime = time.monotonic()
+            self._setState(progress, TaskProgress.DONE)
+        except Exception as e:
+            progress.error = e
+            progress.endTime = time.monotonic()
+            self._setState(progress, TaskProgress.FAILED)
+        finally:
+            client.close()
+
+    def _setState(self, progress, state):
+        progress.state = state
+        if self._progressFunc is not None:
+            with self._progressLock:
+                self._progressFunc(progress)
+
+    def getFairLimiter(self):   return self._fairLimiter
+# end class HarvestDriver -------------------------
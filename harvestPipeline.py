@@ -0,0 +1,488 @@
+"""A staged producer/consumer pipeline for harvests:
+        search -> filter -> details -> pdf -> store
+
+    Each stage has its own worker threads and reads its items from a bounded
+    queue that the stage before it fills. When a queue is full the stage
+    feeding it waits, so a slow stage (e.g., pdf downloads, or a slow disk)
+    holds the stages before it back (backpressure) instead of search
+    results piling up in memory. A streaming search only fetches its next
+    page when the filter stage has room for it.
+
+    An item a stage fails on (it raises an exception) is quarantined: it is
+    set aside w/ the exception, and the pipeline carries on w/ the other
+    items.
+
+Class Overview
+    class Stage
+    - a name, a function that processes one item, the num of workers, the
+        size of the stage's input queue
+
+    class Pipeline
+    - run(inputs) runs the inputs through the stages, returns the StageStats
+        of each stage. Quarantined items go to the quarantineFunc.
+
+    class StageStats
+    - items in, out, dropped & quarantined, secs busy & blocked on a full
+        queue
+
+    class Quarantined
+    - a stage name, the item it failed on, the exception
+
+    class JournalHarvest
+    - the journal harvest (see journalSearch.py) as a Pipeline:
+        search  - runs each journal's SciDirectSearch (streaming, unless it
+                    has splitters or parallel pages), or w/ batchSize, each
+                    batch of journals' search (see journalBatch.py)
+        filter  - drops refs done by earlier runs, waiting for PMIDs, or
+                    w/ DOIs we have
+        details - gets the details (PMID, etc.), queues the refs w/o PMIDs
+                    (see pendingPmids.py), drops PMIDs we have
+        pdf     - streams each pdf to its file (or into a PdfStore)
+        store   - marks the ref done in the HarvestCheckpoint
+      run(tasks) returns a JournalReport per journal.
+      The journals take turns at the client's request budget (a
+      FairShareLimiter, see harvestDriver.py): each journal's details & pdf
+      requests, and each search's requests, are throttled as its own tenant,
+      so a big journal can't starve the others.
+
+    class JournalReport
+    - the counts, pubTypes, failures for one journal
+"""
+
+import time, queue, logging, threading, collections
+from SciDirectLib import SciDirectSearch
+from harvestCheckpoint import queryKey
+from harvestDriver import FairShareLimiter
+from journalBatch import BatchedJournalSearch
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()        # end of input marker on the queues
+
+class Stage(object):
+    """
+    IS:   a stage of a Pipeline
+    HAS:  name, func, num of workers, input queue size
+    DOES: func(item) processes an item and returns the item for the next
+          stage, or None to drop it. If fanOut, func returns an iterable of
+          items for the next stage (e.g., a search's references).
+    """
+    def __init__(self, name, func, workers=1, queueSize=100, fanOut=False):
+        if workers < 1:
+            raise ValueError('stage %s needs at least 1 worker' % name)
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queueSize = queueSize
+        self.fanOut = fanOut
+# end class Stage -------------------------
+
+class StageStats(object):
+    """ The counts for one Stage of a Pipeline run
+    """
+    def __init__(self, name):
+        self.name = name
+        self.numIn = 0          # items it got
+        self.numOut = 0         # items it passed on
+        self.numDropped = 0     # items func returned None for
+        self.numQuarantined = 0 # items func raised an exception on
+        self.busySecs = 0.0     # secs its workers spent in func
+        self.blockedSecs = 0.0  # secs its workers waited for room downstream
+
+    def __str__(self):
+        return "%s: %d in, %d out, %d dropped, %d quarantined, " \
+                "%.1fs busy, %.1fs blocked" % (self.name, self.numIn,
+                self.numOut, self.numDropped, self.numQuarantined,
+                self.busySecs, self.blockedSecs)
+# end class StageStats -------------------------
+
+class Quarantined(object):  # simple struct
+    def __init__(self, stage, item, error):
+        self.stage = stage      # name of the stage that failed
+        self.item = item        # the item it failed on
+        self.error = error      # the exception
+# end class Quarantined -------------------------
+
+class Pipeline(object):
+    """
+    IS:   a sequence of Stages connected by bounded queues
+    HAS:  the stages, the quarantine function
+    DOES: run(inputs) - feeds the inputs to the 1st stage, runs all the
+          stages' workers until every item is through, returns
+          [StageStats per stage]. quarantineFunc(Quarantined) is called
+          (one at a time) for each item a stage fails on.
+    """
+    def __init__(self, stages, quarantineFunc=None):
+        if not stages:
+            raise ValueError('a pipeline needs at least one stage')
+        self._stages = stages
+        self._quarantineFunc = quarantineFunc
+        self._lock = threading.Lock()
+        self._quarantineLock = threading.Lock()  # one quarantineFunc at a time
+
+    def run(self, inputs):
+        queues = [queue.Queue(maxsize=s.queueSize) for s in self._stages]
+        stats = [StageStats(s.name) for s in self._stages]
+        finished = [0] * len(self._stages)  # num of workers done, per stage
+        threads = []
+        for i, stage in enumerate(self._stages):
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._work, name='%s-%d' % \
+                                    (stage.name, n),
+                                    args=(i, queues, stats, finished))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        for item in inputs:
+            queues[0].put(item)
+        for n in range(self._stages[0].workers):
+            queues[0].put(_DONE)
+        for t in threads:
+            t.join()
+        return stats
+
+    def _work(self, i, queues, stats, finished):
+        """ A worker of stage i
+        """
+        stage = self._stages[i]
+        outQueue = queues[i+1] if i+1 < len(queues) else None
+        try:
+            while True:
+                item = queues[i].get()
+                if item is _DONE:
+                    break
+                self._process(stage, stats[i], item, outQueue)
+        finally:
+            with self._lock:        # the last worker out tells the next stage
+                finished[i] += 1
+                lastOut = finished[i] == stage.workers
+            if lastOut and outQueue is not None:
+                for n in range(self._stages[i+1].workers):
+                    outQueue.put(_DONE)
+
+    def _process(self, stage, stat, item, outQueue):
+        """ Run stage.func on item, pass its result(s) on to outQueue
+        """
+        with self._lock:
+            stat.numIn += 1
+        busy = time.monotonic()
+        blocked = 0.0
+        numOut = 0
+        try:
+            results = stage.func(item)
+            if not stage.fanOut:
+                results = () if results is None else (results,)
+            for result in results:
+                blocked += self._put(outQueue, result)
+                numOut += 1
+            if numOut == 0:
+                with self._lock:
+                    stat.numDropped += 1
+        except Exception as e:
+            with self._lock:
+                stat.numQuarantined += 1
+            self._quarantine(Quarantined(stage.name, item, e))
+        with self._lock:
+            stat.numOut += numOut
+            stat.blockedSecs += blocked
+            stat.busySecs += time.monotonic() - busy - blocked
+
+    def _quarantine(self, quarantined):
+        """ Pass quarantined to the quarantineFunc (if any). If that fails
+            (e.g., can't write its file), log it and carry on: the worker
+            must keep draining its queue or the stages before it block.
+        """
+        if self._quarantineFunc is None:
+            return
+        try:
+            with self._quarantineLock:
+                self._quarantineFunc(quarantined)
+        except Exception:
+            logger.exception('quarantineFunc failed for %s item %r',
+                                        quarantined.stage, quarantined.item)
+
+    def _put(self, outQueue, item):
+        """ Put item on outQueue (if any), return the secs we waited for room
+        """
+        if outQueue is None:
+            return 0.0
+        start = time.monotonic()
+        outQueue.put(item)
+        return time.monotonic() - start
+
+    def getStages(self):    return self._stages
+# end class Pipeline -------------------------
+
+class JournalReport(object):
+    """
+    IS:   the results of harvesting one journal
+    HAS:  its HarvestTask & query key, counts, pubTypes, the newest loadDate
+          seen, the refs that failed (quarantined), the search error (if its
+          search failed), if its search was truncated, formatted lines about
+          its refs
+    DOES: count(what), thread safe
+    """
+    COUNTS = ('results', 'done', 'pending', 'known', 'noPmid', 'pmids',
+                'pdfs', 'unchanged', 'stored')
+
+    def __init__(self, task):
+        self.task = task
+        self.name = task.name
+        self.key = queryKey(task.query)
+        self.counts = collections.OrderedDict((c, 0) for c in self.COUNTS)
+        self.pubTypes = {}          # pubType -> num of refs
+        self.newestLoadDate = None
+        self.failures = []          # Quarantined refs: (stage, pii, error)
+        self.failedLoadDates = []
+        self.error = None           # exception that stopped its search
+        self.truncated = False      # its search couldn't get all its results
+        self.lines = []             # formatFunc(ref) for the refs w/ PMIDs
+        self.donePiis = set()       # PIIs done in earlier runs
+        self._lock = threading.Lock()
+
+    def count(self, what, n=1):
+        with self._lock:
+            self.counts[what] += n
+
+    def _sawRef(self, ref):
+        with self._lock:
+            self.counts['results'] += 1
+            self.newestLoadDate = max(self.newestLoadDate or '',
+                                                            ref.getLoadDate())
+
+    def _addPubType(self, pubType, line):
+        with self._lock:
+            self.pubTypes[pubType] = self.pubTypes.get(pubType, 0) + 1
+            if line is not None:
+                self.lines.append(line)
+
+    def _addFailure(self, stage, ref, error):
+        with self._lock:
+            self.failures.append((stage, ref.getPii(), error))
+            self.failedLoadDates.append(ref.getLoadDate())
+
+    def getOldestFailedLoadDate(self):
+        return min(self.failedLoadDates, default=None)
+
+    def __str__(self):
+        if self.error is not None:
+            return "%s: search failed: %s" % (self.name, self.error)
+        return "%s: %d matching references, %d w/ PMIDs, %d PDFs written, " \
+                "%d unchanged, %d done in earlier runs, %d already known, " \
+                "%d waiting for PMIDs, %d failed" % (self.name,
+                self.counts['results'], self.counts['pmids'],
+                self.counts['pdfs'], self.counts['unchanged'],
+                self.counts['done'], self.counts['known'],
+                self.counts['pending'], len(self.failures)) + \
+                (", search truncated" if self.truncated else "")
+# end class JournalReport -------------------------
+
+class JournalHarvest(object):
+    """
+    IS:   a harvest of a set of journals, as a Pipeline
+    HAS:  the ElsClient, HarvestCheckpoint, optional KnownIdFilter and
+          PendingPmidQueue, where to write the pdfs, stage worker counts
+    DOES: run(tasks) - harvest the HarvestTasks (a journal name & its query,
+          or its already executed search w/ setElsClient()), return
+          {journal name: JournalReport}. When the pdfs are written, each
+          journal's checkpoint is advanced (not past its failed refs, not
+          at all if its search was truncated: the results it couldn't get
+          would be before the next run's loadedAfter).
+          W/ batchSize, the tasks' queries are searched in batches (see
+          journalBatch.py), each batch by a search stage worker, so later
+          batches are searched while the refs of earlier ones are processed.
+    """
+    def __init__(self, elsClient, checkpoints,
+                pdfPathFunc=None,   # pdfPathFunc(ref) -> path to write its pdf
+                                    #  None = don't get the pdfs (debugging)
+                pdfStore=None,      # or, a PdfStore to put the pdfs in
+                knownIds=None,      # KnownIdFilter of the papers we have
+                pending=None,       # PendingPmidQueue for refs w/o PMIDs
+                searchWorkers=2,    # num of journals searched at once
+                batchSize=0,        # max num of journals OR'ed into one
+                                    #  search, 0 = a search per journal
+                detailsWorkers=4,   # num of concurrent details requests
+                pdfWorkers=4,       # num of concurrent pdf downloads
+                queueSize=100,      # max num of refs waiting for each stage
+                formatFunc=None,    # formatFunc(ref) -> text for the report
+                quarantineFunc=None,# also called w/ each Quarantined
+                **searchArgs,       # for SciDirectSearch, e.g., resultSink
+                ):
+        self._elsClient = elsClient
+        self._checkpoints = checkpoints
+        self._pdfPathFunc = pdfPathFunc
+        self._pdfStore = pdfStore
+        self._writePdfs = pdfPathFunc is not None or pdfStore is not None
+        self._knownIds = knownIds
+        self._pending = pending
+        self._formatFunc = formatFunc
+        self._quarantineFunc = quarantineFunc
+        self._searchArgs = searchArgs
+        self._batchSize = batchSize
+        self._batch = None          # the BatchedJournalSearch of a run
+        self._fairLimiter = FairShareLimiter(elsClient.getRateLimiter())
+        self._clients = {}          # tenant name -> its (sharing) ElsClient
+        self._clientsLock = threading.Lock()
+        self._pendingPiis = set()
+        self._stats = []
+        self._pipeline = Pipeline([
+                Stage('search',  self._search,  searchWorkers, queueSize,
+                                                                fanOut=True),
+                Stage('filter',  self._filter,  1,              queueSize),
+                Stage('details', self._details, detailsWorkers, queueSize),
+                Stage('pdf',     self._pdf,     pdfWorkers,     queueSize),
+                Stage('store',   self._store,   1,              queueSize),
+                ], quarantineFunc=self._quarantine)
+
+    def run(self, tasks):
+        reports = collections.OrderedDict()
+        for task in tasks:
+            if task.name in reports:
+                raise ValueError('duplicate task name: %s' % task.name)
+            reports[task.name] = JournalReport(task)
+        if self._pending is not None:
+            self._pendingPiis = self._pending.getPendingPiis()
+        try:
+            self._stats = self._pipeline.run(self._searchUnits(reports))
+        finally:
+            for client in self._clients.values():
+                client.close()      # (doesn't close the shared session)
+            self._clients = {}
+
+        if self._writePdfs:                 # advance the checkpoints
+            for report in reports.values():
+                if report.error is None and not report.truncated:
+                    self._checkpoints.finishRun(report.key,
+                                                report.newestLoadDate,
+                                                report.getOldestFailedLoadDate())
+        return reports
+
+    def _searchUnits(self, reports):
+        """ Return the search stage's items: lists of the JournalReports that
+            are searched together (one, or a batch)
+        """
+        self._batch = None
+        units = [[r] for r in reports.values() if r.task.search is not None]
+        toSearch = [r for r in reports.values() if r.task.search is None]
+        if self._batchSize > 0 and toSearch:
+            args = dict(getAll=True)
+            args.update(self._searchArgs)
+            resultSink = args.pop('resultSink', None)
+            args.pop('stream', None)
+            self._batch = BatchedJournalSearch(self._elsClient,
+                                [(r.name, r.task.query) for r in toSearch],
+                                batchSize=self._batchSize,
+                                resultSink=resultSink, compact=True, **args)
+            units += [[reports[n] for n in names]
+                                        for names in self._batch.getBatches()]
+        else:
+            units += [[r] for r in toSearch]
+        return units
+
+    def _client(self, tenant):
+        """ Return the ElsClient for tenant's requests
+        """
+        with self._clientsLock:
+            client = self._clients.get(tenant)
+            if client is None:
+                client = self._elsClient.sharingClient(
+                                        self._fairLimiter.getTenant(tenant))
+                self._clients[tenant] = client
+        return client
+
+    # the stages. Items after the search are (JournalReport, ref) pairs
+    def _search(self, reports):
+        for report in reports:
+            report.donePiis = self._checkpoints.getDonePiis(report.key)
+        if reports[0].task.search is not None:
+            searches = [(reports[0], reports[0].task.search)]
+            searches[0][1].setElsClient(self._client(reports[0].name))
+        elif self._batch is not None:
+            names = [r.name for r in reports]
+            self._batch.executeBatch(names,
+                                self._client('batch: ' + ' OR '.join(names)))
+            results = self._batch.getResults()
+            searches = []
+            for report in reports:
+                results[report.name].setElsClient(self._client(report.name))
+                searches.append((report, results[report.name]))
+        else:
+            report = reports[0]
+            # a search that may split, or gets its pages in parallel, gets
+            #  all its results 1st
+            stream = not (self._searchArgs.get('splitters') or
+                            self._searchArgs.get('parallelPages', 1) > 1)
+            args = dict(getAll=True, stream=stream, compact=True)
+            args.update(self._searchArgs)
+            search = SciDirectSearch(self._client(report.name),
+                                        report.task.query, **args).execute()
+            searches = [(report, search)]
+        for report, search in searches:
+            report.truncated = search.isTruncated()
+            for ref in search.getIterator():
+                report._sawRef(ref)
+                yield report, ref
+
+    def _filter(self, item):
+        report, ref = item
+        if ref.getPii() in report.donePiis:
+            report.count('done')
+        elif ref.getPii() in self._pendingPiis:
+            report.count('pending')
+        elif self._knownIds is not None and self._knownIds.skipByDoi(ref):
+            report.count('known')
+        else:
+            return item
+        return None
+
+    def _details(self, item):
+        report, ref = item
+        pmid = ref.getPmid()            # loads the details
+        pubType = ref.getPubType()
+        line = self._formatFunc(ref) if self._formatFunc else None
+        report._addPubType(pubType, line)
+        if pmid == 'no PMID':
+            if self._pending is not None and self._pending.add(ref, report.key):
+                report.count('pending')
+            else:
+                report.count('noPmid')
+            return None
+        report.count('pmids')
+        if self._knownIds is not None and self._knownIds.skipByPmid(ref):
+            report.count('known')
+            return None
+        return item
+
+    def _pdf(self, item):
+        report, ref = item
+        if self._pdfStore is not None:      # unchanged = in the store already
+            report.count('pdfs' if self._pdfStore.savePdf(ref) else 'unchanged')
+        elif self._pdfPathFunc is not None:
+            ref.savePdf(self._pdfPathFunc(ref))
+            report.count('unchanged' if ref.pdfChanged() == False else 'pdfs')
+        return item
+
+    def _store(self, item):
+        report, ref = item
+        if self._writePdfs:
+            self._checkpoints.markDone(report.key, ref.getPii(),
+                                                            ref.getLoadDate())
+        report.count('stored')
+        ref.release()
+        return item
+
+    def _quarantine(self, quarantined):
+        if quarantined.stage == 'search':
+            for report in quarantined.item:
+                report.error = quarantined.error
+        else:
+            report, ref = quarantined.item
+            report._addFailure(quarantined.stage, ref, quarantined.error)
+        if self._quarantineFunc is not None:
+            self._quarantineFunc(quarantined)
+
+    def getStageStats(self):    return self._stats
+    def getPipeline(self):      return self._pipeline
+    def getBatch(self):         return self._batch
+    def getFairLimiter(self):   return self._fairLimiter
+# end class JournalHarvest -------------------------
@@ -0,0 +1,298 @@
+"""Batched journal searches: one SciDirectSearch for several journals.
+
+    The search API's "pub" field doesn't do exact matches (see the notes in
+    journalSearch.py), and a harvest makes at least one search request per
+    journal even if most journals only have a handful of new papers.
+    A batched search ORs several journal names into one "pub" query:
+        "Bone" OR "Neuron" OR "Developmental Biology"
+    and routes each result record back to its journal by the record's
+    sourceTitle, matched exactly (after normalizing case, punctuation, "&" vs
+    "and" and whitespace). Results from look-alike journals (e.g., "Current
+    Topics in Developmental Biology"), and from journals of other batches,
+    are dropped and counted before any details or PDF requests are made for
+    them.
+
+    Journals are batched together if their queries are the same except for
+    "pub" and "loadedAfter". A batch asks for the oldest loadedAfter of its
+    journals, and each journal drops the results loaded before its own.
+
+    maxResults and the API's max offset apply to a whole batch search, not
+    to each of its journals. So a batch that finds more results than it can
+    page through falls back to one search per journal (its 1st page tells
+    us, see SciDirectSearch splitters), each w/ the usual limits. Any other
+    splitters (e.g., by year, querySplit.py) then split those.
+
+Class Overview
+    class JournalIndex
+    - exact journal name index: lookup(sourceTitle) -> journal name or None
+
+    class JournalResults
+    - one journal's share of a batched search. Has the getters of an executed
+        SciDirectSearch (getIterator(), getTotalNumResults(), getQuery(), ...)
+        so it can be processed like one (e.g., as a HarvestTask's search)
+
+    class BatchedJournalSearch
+    - runs the batched searches for {journal name: query} (all of them, or
+        one batch at a time, e.g., from several threads), getResults()
+        returns {journal name: JournalResults}
+
+Functions
+    normalizeJournalName(name) - the form journal names are matched in
+    batchPubQuery(names) - the OR'ed "pub" query text for the journal names
+"""
+
+import re, json, threading, collections
+from copy import deepcopy
+from SciDirectLib import SciDirectSearch, SciDirectReference
+
+_NON_WORD = re.compile(r'[^\w\s]')
+
+def normalizeJournalName(name):
+    """ Return journal name normalized for exact matching: case folded,
+        '&' spelled 'and', punctuation dropped, whitespace collapsed
+    """
+    name = name.casefold().replace('&', ' and ')
+    return ' '.join(_NON_WORD.sub(' ', name).split())
+
+def batchPubQuery(names):
+    """ Return the "pub" query text that matches any of the journal names
+    """
+    return ' OR '.join('"%s"' % name.replace('"', '') for name in names)
+
+class JournalIndex(object):
+    """
+    IS:   an index of journal names
+    HAS:  normalized name -> journal name
+    DOES: lookup(sourceTitle) finds the journal a search result is from
+    """
+    def __init__(self, names=()):
+        self._index = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        key = normalizeJournalName(name)
+        other = self._index.get(key)
+        if other is not None and other != name:
+            raise ValueError('journal names "%s" and "%s" are the same' % \
+                                                                (other, name))
+        self._index[key] = name
+
+    def lookup(self, sourceTitle):
+        """ Return the journal name sourceTitle matches, None if none
+        """
+        return self._index.get(normalizeJournalName(sourceTitle or ''))
+
+    def getNames(self):     return list(self._index.values())
+# end class JournalIndex -------------------------
+
+class JournalResults(object):
+    """
+    IS:   the search results for one journal from a batched search
+    HAS:  the journal name, its own query, its raw result records, if its
+          batch search was truncated
+    DOES: getIterator() returns SciDirectReferences like
+          SciDirectSearch.getIterator()
+    """
+    def __init__(self, elsClient, name, query,
+                resultSink=None,    # resultSink(self, records) gets the
+                                    #  journal's records as they're routed
+                compact=False,      # as for SciDirectSearch
+                ):
+        self._elsClient = elsClient
+        self._name = name
+        self._query = query
+        self._resultSink = resultSink
+        self._compact = compact
+        self._results = []
+        self._truncated = False
+        self._streamStarted = False
+
+    def _addRecords(self, records):
+        self._results += records
+        if self._resultSink is not None and records:
+            self._resultSink(self, records)
+
+    def getName(self):            return self._name
+    def getQuery(self):           return self._query
+    def getElsClient(self):       return self._elsClient
+    def getTotalNumResults(self): return len(self._results)
+    def getNumResults(self):      return len(self._results)
+    def getResults(self):         return self._results
+    def isTruncated(self):
+        """ Return True if the batch search matched results it couldn't
+            page to (so this journal may not have all of its results)
+        """
+        return self._truncated
+
+    def setElsClient(self, elsClient):
+        """ Make the references w/ elsClient (e.g., a HarvestDriver task's
+            client)
+        """
+        self._elsClient = elsClient
+
+    def getIterator(self):
+        """ Return iterator of SciDirectReference objects from the results.
+            If compact, the raw records are dropped as they are iterated, so
+            they can only be iterated once.
+        """
+        if not self._compact:
+            return (SciDirectReference(self._elsClient, r)
+                                                        for r in self._results)
+        if self._streamStarted:
+            raise ValueError('compact search results can only be iterated once')
+        self._streamStarted = True
+        return self._consumingIterator()
+
+    def _consumingIterator(self):
+        records = self._results
+        for i in range(len(records)):
+            record = records[i]
+            records[i] = None
+            yield SciDirectReference(self._elsClient, record, compact=True)
+        del records[:]
+# end class JournalResults -------------------------
+
+class BatchedJournalSearch(object):
+    """
+    IS:   the searches for a set of journals, batched
+    HAS:  {journal name: query}, the batch size, the JournalIndex,
+          the JournalResults per journal, counts of unmatched sourceTitles
+    DOES: execute() runs one SciDirectSearch per batch of journals and routes
+          each page of results to the journals as it arrives.
+          executeBatch(names) runs one batch's search. Thread safe.
+    """
+    def __init__(self, elsClient,
+                queries,            # {journal name: SciDirectSearch query}
+                                    #  w/ 'pub' = the (quoted) journal name
+                batchSize=8,        # max num of journals per search
+                resultSink=None,    # resultSink(journalResults, records)
+                compact=False,      # as for SciDirectSearch
+                **searchArgs,       # for SciDirectSearch, e.g., getAll=True
+                ):
+        if searchArgs.get('stream'):
+            raise ValueError('batched searches can not stream')
+        if batchSize < 1:
+            raise ValueError('batchSize must be at least 1')
+        self._elsClient = elsClient
+        self._queries = collections.OrderedDict(queries)
+        self._batchSize = batchSize
+        self._searchArgs = dict(searchArgs)
+        self._searchArgs['splitters'] = [self._splitBatch] + \
+                                        list(searchArgs.get('splitters') or [])
+        self._batchNames = {}   # batch query's "pub" -> its journal names
+        self._index = JournalIndex(self._queries.keys())
+        self._results = collections.OrderedDict(
+                    (name, JournalResults(elsClient, name, query,
+                                    resultSink=resultSink, compact=compact))
+                    for name, query in self._queries.items())
+        self._unmatched = {}    # sourceTitle -> num of results dropped
+        self._numBefore = 0     # num dropped as older than their loadedAfter
+        self._searches = []     # the (executed) batch SciDirectSearches
+        self._lock = threading.Lock()
+
+    def getBatches(self):
+        """ Return the list of batches: lists of journal names that are
+            searched together
+        """
+        groups = collections.OrderedDict()  # query w/o pub -> journal names
+        for name, query in self._queries.items():
+            rest = {k: v for k, v in query.items()
+                                        if k not in ('pub', 'loadedAfter')}
+            groups.setdefault(json.dumps(rest, sort_keys=True), []).append(name)
+        batches = []
+        for names in groups.values():
+            for i in range(0, len(names), self._batchSize):
+                batches.append(names[i:i+self._batchSize])
+        return batches
+
+    def _batchQuery(self, names):
+        query = deepcopy(self._queries[names[0]])
+        query['pub'] = batchPubQuery(names)
+        with self._lock:
+            self._batchNames[query['pub']] = names
+        afterDates = [self._queries[n]['loadedAfter'] for n in names
+                                        if self._queries[n].get('loadedAfter')]
+        if len(afterDates) < len(names):    # some journal wants all dates
+            query.pop('loadedAfter', None)
+        else:
+            query['loadedAfter'] = min(afterDates)
+        return query
+
+    def execute(self):
+        """ Run the batched searches. Return self.
+        """
+        for names in self.getBatches():
+            self.executeBatch(names)
+        return self
+
+    def executeBatch(self, names, elsClient=None):
+        """ Run the search for one batch of journal names (from
+            getBatches()) w/ elsClient (default: ours), routing its results
+            to the journals. Return the executed SciDirectSearch.
+        """
+        client = elsClient or self._elsClient
+        search = SciDirectSearch(client, self._batchQuery(names),
+                                    resultSink=self._routePage,
+                                    **self._searchArgs).execute()
+        del search.getResults()[:]          # the journals have the records
+        with self._lock:
+            self._searches.append(search)
+            for name in names:
+                self._results[name]._truncated = search.isTruncated()
+        client.getMetrics().count('batch_searches')
+        return search
+
+    def _splitBatch(self, query):
+        """ Splitter for the batch searches: a batch that has too many results
+            to page through becomes one query per journal
+        """
+        with self._lock:
+            names = self._batchNames.get(query.get('pub'))
+        if names is None or len(names) < 2:
+            return None
+        self._elsClient.getMetrics().count('batch_fallbacks')
+        return [deepcopy(self._queries[name]) for name in names]
+
+    def _routePage(self, search, records):
+        """ resultSink for the batch searches: give each record to its
+            journal, if the journal is in the search's batch (another batch's
+            search gets that journal's records itself)
+        """
+        routed = collections.OrderedDict()
+        with self._lock:
+            names = self._batchNames[search.getQuery()['pub']]
+            for r in records:
+                name = self._index.lookup(r.get('sourceTitle'))
+                if name not in names:
+                    title = r.get('sourceTitle')
+                    self._unmatched[title] = self._unmatched.get(title, 0) + 1
+                    continue
+                loadedAfter = self._queries[name].get('loadedAfter')
+                if loadedAfter and r['loadDate'][:19] < loadedAfter[:19]:
+                    self._numBefore += 1
+                    continue
+                routed.setdefault(name, []).append(r)
+            for name, journalRecords in routed.items():
+                self._results[name]._addRecords(journalRecords)
+        numDropped = len(records) - sum(map(len, routed.values()))
+        if numDropped:
+            self._elsClient.getMetrics().count('batch_results_dropped',
+                                                                    numDropped)
+
+    def getResults(self):
+        """ Return {journal name: JournalResults} in the order of queries
+        """
+        return self._results
+
+    def getUnmatchedCounts(self):
+        """ Return {sourceTitle: num of results} for the results from
+            journals their batch didn't ask for
+        """
+        with self._lock:
+            return dict(self._unmatched)
+
+    def getNumBeforeLoadedAfter(self):  return self._numBefore
+    def getSearches(self):              return self._searches
+    def getIndex(self):                 return self._index
+# end class BatchedJournalSearch -------------------------
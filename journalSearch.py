@@ -1,16 +1,46 @@
-"""Playing with the Elsevier API and SciDirectClient.py client library.
+"""Harvest papers from a set of Elsevier journals w/ the SciDirectLib client.
 
 What is implemented here:
     query for set of journals, for a specific "loadedAfter" date,
-    get all papers that contain "mice" in title, abstract or full text
-    (omitting reference section)
+    get all papers that contain "mice" (or the --qs text) in title, abstract
+    or full text (omitting reference section)
     and
     download the PDFs for those papers named by PMID_nnnn.pdf.
-    Currently writes them into a subdirectory named "pdfs/"
-    (this code doesn't check the db to see if we already have the PMID. The
-    production downloader will want to do this.)
+    Writes them into a subdirectory named "pdfs/" (--pdf-dir), or w/
+    --pdf-store into a content-addressed store (see pdfStore.py): each
+    distinct PDF once, by its sha256, w/ an index by PMID, PII and DOI
+    Each journal's query is checkpointed (see harvestCheckpoint.py): the
+    next run only asks for papers loaded after the newest one we've seen,
+    and skips papers that are already done (e.g., after a crash).
+    Delete the checkpoint db to start over from --loaded-after.
+    The journals are searched in batches, several journal names OR'ed into
+    one query, and each result is routed back to its journal by its exact
+    journal name (see journalBatch.py). --batch-size 0 does one streaming
+    search per journal instead.
+    The refs go through a pipeline of stages (see harvestPipeline.py):
+        search -> filter -> details -> pdf -> store
+    each w/ its own num of workers, connected by bounded queues, so the
+    later searches (or batches) run while earlier journals' refs are
+    processed. The journals take turns at the request budget (see
+    harvestDriver.FairShareLimiter). A ref that
+    fails is quarantined (reported, and written to --quarantine) and the
+    run carries on. Its journal's checkpoint doesn't move past it.
+    Papers we already have are skipped if --known-ids is given: an export
+    of the PMIDs/DOIs we have (e.g., from the db, see knownIds.py). Known
+    DOIs are skipped right after the search (no details or PDF requests),
+    known PMIDs once the details are loaded (no PDF request).
+    Sharded: w/ --shard-db, several worker hosts (each running this script
+    w/ the same --shard-db on shared storage) split the journals and their
+    papers between them, each writing PDFs to its own --pdf-dir. They share
+    --total-rate requests/sec: one token bucket in the shard db, each worker
+    also throttling itself to its share (see shardCoordinator.py). Sharded
+    runs search from --loaded-after (no checkpoints); papers in the shard db
+    aren't done twice. Papers w/o a PMID yet wait in the shard db (not in
+    --pending) and are rechecked by the first run after they are due.
 
-Usage: python journalSearch.py
+Usage: python journalSearch.py [options] [journal name ...]
+    (python journalSearch.py -h lists the options. With no journal names,
+    the MGI journals below are harvested)
 
 What I've learned about the API:
 0) IMPORTANT: we have an apikey and institutional token (for Jax) that we
@@ -31,11 +61,19 @@ What I've learned about the API:
     The SciDirectReference class does a separate API call to get the PMID,
     other bits of metadata, and the PDF.
     NOTE papers can appear in ScienceDirect before they have their PMID.
-    So this downloader may want to skip papers UNTIL their PMID appears here.
+    So this downloader skips papers UNTIL their PMID appears here: they go in
+    a queue (see pendingPmids.py) whose entries are rechecked (one META
+    request each) on an exponential schedule, and the searches skip them.
+    Each run starts w/ the rechecks that are due. Use --recheck-only to just
+    do those.
     (do we ever get papers from Elsevier journals that don't eventually appear
     in pubmed?)
 
 4) Date ranges: API only supports "loadedAfter date" - cannot specify ranges
+    of load dates. It does have a publication 'date' (year or year range)
+    field though: w/ --split, a search that finds more results than can be
+    paged through (the API won't go past offset 6000) is split by
+    publication year (and then by --split-terms), see querySplit.py
 
 5) JOURNAL Searching: "pub" field is where you specify the journal name.
     It does not support an exact match, it searches for matching words (or
@@ -47,6 +85,8 @@ What I've learned about the API:
     I don't think it does stemming, but it appears to handle plurals, e.g.,
         searching for "Cells" returns the "Cell" journal.
     This is kind of annoying for us when we want to search by exact journals.
+    (journalBatch.py drops results whose sourceTitle isn't exactly one of the
+    journals we asked for)
 
     We need to use the exact journal names instead of MGI journal abbreviations.
     I.e., "Dev Biol" doesn't match anything.
@@ -58,34 +98,29 @@ What I've learned about the API:
     I haven't determined if it does stemming or not.
 """
 
-from SciDirectLib import ElsClient, SciDirectSearch, SciDirectReference
+from SciDirectLib import ElsClient, savePdfs
+from metadataCache import SqliteMetadataCache
+from harvestCheckpoint import HarvestCheckpoint, queryKey
+from harvestDriver import HarvestTask
+from harvestPipeline import JournalHarvest
+from knownIds import KnownIdFilter, loadKnownIds
+from pendingPmids import PendingPmidQueue, recheckDue
+from resultSink import JsonlResultSink
+from elsLogging import configureLogging
+from shardCoordinator import ShardCoordinator, ShardWorker, runShard, \
+                                downloadPdfs
+from rateLimiter import AdaptiveRateLimiter
+from querySplit import splitByYear, splitByTerms
+from pdfStore import PdfStore
 import os
 import json
+import argparse
+import datetime
+import threading
+import socket
     
 FIELDSEP = '|'
 
-# ------------------------------
-def formatResult(r):
-    """ Return formatted text from a SciDirectReference object.
-    """
-    text = FIELDSEP.join([
-                    r.getPmid(),
-                    #r.getPii(),
-                    r.getDoi(),
-                    r.getPubType(),
-                    r.getVolume(),
-                    r.getLoadDate()[:10],
-                    r.getPublicationDate()[:10],
-                    r.getTitle()[:10],
-                    ])
-    return text
-# ------------------------------
-
-### Main
-
-ACTUALLY_WRITE_PDFS = True     # skip writing if debugging
-AFTER_DATE = '2021-05-15'       # get articles added after this date
-
 # The MGI journals that are available at SciDirect
 # These are taken from Harold's list of journals searched via Quosa.
 # Are there any other MGI monitored journals that are at Elsevier/SciDirect?
@@ -94,7 +129,7 @@ class Journal(object):  # simple journal struct
         self.mgiName = mgiName
         self.elsevierName = elsevierName
 
-journals = [
+MGI_JOURNALS = [
     Journal('Arch Biochem Biophys', 'Archives of Biochemistry and Biophysics'),
     Journal('Dev Biol', 'Developmental Biology'),
     Journal('J Mol Cell Cardiol','Journal of Molecular and Cellular Cardiology'),
@@ -114,70 +149,347 @@ journals = [
     Journal('J Bio Chem', 'Journal of Biological Chemistry'),
    ]
 
-# Would like to understand what the SciDirect pubTypes are. Collect them
-pubTypes = {}       # pubTypes['type'] = num of refs with that type
-
-print("Looking for Papers after %s" % AFTER_DATE)
-
-## Load API key and Jax institution token from config file
-apikey = os.environ['ELSEVIER_APIKEY']
-insttoken = os.environ['ELSEVIER_INSTTOKEN']
-
-## Initialize Elsevier API client
-elsClient = ElsClient(apikey, inst_token=insttoken)
-
-for journal in journals[:]:
-    jName = journal.elsevierName
-    query = {'pub'        : '"%s"' % jName,
-             'qs'         : 'mice',
-             'loadedAfter': AFTER_DATE + 'T00:00:00Z',
-             'display'    : { 'sortBy': 'date' }
-             }
-    search = SciDirectSearch(elsClient, query, getAll=True).execute()
-
-    print("%s: %d total search results" % (jName, search.getTotalNumResults()))
-
-    # keep track of matching journal names. The search may match journals
-    #  that are not the ones we want
-    articleCounts = {}      # articleCounts[jName] is num of articles 
-    numJournalResults = 0   # num of refs from the journal we're looking for 
-
-    numPMIDs = 0            # num of refs w/ PMIDs
-    numPDFs = 0             # num of PDFs written for this journal
-
-    if search.getTotalNumResults() == 0: continue
-
-    for r in search.getIterator():
-        try:
-            journal = r.getJournal()
-            articleCounts[journal] = articleCounts.get(journal, 0) +1
-            if journal == jName:       # skip if not the right journal name
-                numJournalResults += 1
-                print(formatResult(r))
-
-                # gather pubtypes
-                pubType = r.getPubType()
-                pubTypes[pubType] = pubTypes.get(pubType, 0) +1
-
-                # write pdf if we have PMID
-                if r.getPmid() != 'no PMID':
-                    numPMIDs += 1 
-                    if ACTUALLY_WRITE_PDFS:
-                        numPDFs += 1 
-                        fname = 'pdfs/PMID_%s.pdf' % r.getPmid()
-                        with open(fname, 'wb') as f:
-                            f.write(r.getPdf())
-        except: # in case we get any exceptions working w/ this r, let's see it
-            print("Reference exception\n")
-            print(json.dumps(r.getDetails(), sort_keys=True, indent=2))
-            raise
-
-    print("%s: %d matching references, %d w/ PMIDs, %d PDFs written" % \
-                            (jName, numJournalResults, numPMIDs, numPDFs))
-    print("Summary of matching journal names:")
-    print(articleCounts)
-
-print()
-print("Summary of pubTypes across all journals:")
-for k in sorted(pubTypes.keys()):
-    print("%s: %d" % (k, pubTypes[k]))
+# ------------------------------
+def formatResult(r):
+    """ Return formatted text from a SciDirectReference object.
+    """
+    text = FIELDSEP.join([
+                    r.getPmid(),
+                    #r.getPii(),
+                    r.getDoi(),
+                    r.getPubType(),
+                    r.getVolume(),
+                    r.getLoadDate()[:10],
+                    r.getPublicationDate()[:10],
+                    r.getTitle()[:10],
+                    ])
+    return text
+# ------------------------------
+
+def parseArgs(argv=None):
+    defaultAfter = (datetime.date.today() - datetime.timedelta(days=30)
+                                                                ).isoformat()
+    parser = argparse.ArgumentParser(
+                description='Harvest papers & PDFs from Elsevier journals')
+    parser.add_argument('journals', nargs='*', metavar='journal',
+            help='Elsevier journal names (default: the MGI journals)')
+    parser.add_argument('--journals-file', metavar='FILE',
+            help='file of Elsevier journal names, one per line')
+    parser.add_argument('--qs', default='mice',
+            help='full text query (default: %(default)s)')
+    parser.add_argument('--loaded-after', default=defaultAfter,
+            metavar='YYYY-MM-DD', help="get papers loaded after this date, "
+            "for journals w/o a checkpoint (default: %(default)s)")
+    parser.add_argument('--no-pdfs', dest='writePdfs', action='store_false',
+            help="don't download PDFs (or advance checkpoints), debugging")
+    parser.add_argument('--pdf-dir', default='pdfs',
+            help='directory to write PDFs to (default: %(default)s)')
+    parser.add_argument('--pdf-store', metavar='DIR',
+            help='put the PDFs in a content-addressed store in DIR instead '
+            'of --pdf-dir')
+    parser.add_argument('--batch-size', type=int, default=8,
+            help="max num of journals OR'ed in one search, 0 = one streaming "
+            "search per journal (default: %(default)s)")
+    parser.add_argument('--search-workers', type=int, default=2,
+            help='num of journals (or batches) searched at once (default: '
+            '%(default)s)')
+    parser.add_argument('--details-workers', type=int, default=4,
+            help='num of concurrent details requests (default: %(default)s)')
+    parser.add_argument('--pdf-workers', type=int, default=4,
+            help='num of concurrent PDF downloads (default: %(default)s)')
+    parser.add_argument('--parallel-pages', type=int, default=1,
+            help="num of a search's result pages to fetch at once, after the "
+            "1st (default: %(default)s)")
+    parser.add_argument('--split', action='store_true',
+            help='split searches that find too many results to page through '
+            'by publication year')
+    parser.add_argument('--split-terms', metavar='TERM,...',
+            help='... then by these terms (e.g., brain,heart,bone)')
+    parser.add_argument('--queue-size', type=int, default=100,
+            help='max num of refs waiting for each stage (default: '
+            '%(default)s)')
+    parser.add_argument('--checkpoints', default='harvestCheckpoint.db',
+            help='per journal query harvest progress (default: %(default)s)')
+    parser.add_argument('--metadata-cache', default='metadataCache.db',
+            help='cache of article details (default: %(default)s)')
+    parser.add_argument('--metadata-cache-ttl', type=int, default=90,
+            metavar='DAYS', help='days to keep cached details (default: '
+            '%(default)s)')
+    parser.add_argument('--known-ids', metavar='FILE',
+            help='export file of the PMIDs/DOIs we already have, their '
+            'papers are skipped')
+    parser.add_argument('--known-ids-compact', action='store_true',
+            help='keep the known IDs in Bloom filters')
+    parser.add_argument('--pending', default='pendingPmids.db',
+            help='refs waiting for PMIDs, to recheck (default: %(default)s)')
+    parser.add_argument('--recheck-only', action='store_true',
+            help='just recheck the refs waiting for PMIDs')
+    parser.add_argument('--quarantine', metavar='FILE',
+            help='append the refs that failed to FILE (JSON Lines)')
+    parser.add_argument('--results-dir',
+            help="save each journal's raw search results to "
+            "RESULTS_DIR/<journal>.jsonl")
+    parser.add_argument('--metrics-file',
+            help='write the request metrics (json) to this file')
+    parser.add_argument('--shard-db', metavar='FILE',
+            help='sharded harvest: the work queue shared by the worker hosts')
+    parser.add_argument('--worker-name',
+            default='%s-%d' % (socket.gethostname(), os.getpid()),
+            help='this worker, in the shard db (default: %(default)s)')
+    parser.add_argument('--total-rate', type=float, default=1.0,
+            help='requests/sec for all the workers together (default: '
+            '%(default)s)')
+    parser.add_argument('--lease-secs', type=int, default=300,
+            help="a dead worker's items go to others after this many secs "
+            "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    names = list(args.journals)
+    if args.journals_file:
+        with open(args.journals_file) as f:
+            names += [line.strip() for line in f if line.strip()]
+    args.journalNames = names or [j.elsevierName for j in MGI_JOURNALS]
+    args.splitters = None
+    if args.split:
+        args.splitters = [splitByYear]
+        if args.split_terms:
+            args.splitters.append(splitByTerms(args.split_terms.split(',')))
+    return args
+# ------------------------------
+
+def recheckPending(args, elsClient, checkpoints, knownIds, pending,
+                                                                pdfStore=None):
+    """ Recheck the refs waiting for PMIDs that are due, get the PDFs of the
+        ones that have PMIDs now
+    """
+    found, failures = recheckDue(pending, elsClient,
+                                                workers=args.details_workers)
+    for pii, e in failures.items():
+        print("Recheck exception for pii %s: %s" % (pii, e))
+    refs = [(r, key) for r, key in found if not knownIds.skipByPmid(r)]
+    numPDFs = 0
+    if args.writePdfs:
+        if pdfStore is not None:
+            failures = pdfStore.savePdfs([r for r, key in refs],
+                                                    workers=args.pdf_workers)
+        else:
+            failures = savePdfs([r for r, key in refs], pdfPathFunc(args),
+                                                    workers=args.pdf_workers)
+        for pii, e in failures.items():
+            print("PDF exception for pii %s: %s" % (pii, e))
+        for r, key in refs:
+            if r.getPii() in failures:
+                pending.add(r, key)     # try again later
+            else:
+                numPDFs += 1
+                if key is not None:
+                    checkpoints.markDone(key, r.getPii(), r.getLoadDate())
+    print("Rechecked refs waiting for PMIDs: %d now have PMIDs, " \
+            "%d PDFs written, %d still waiting" % \
+            (len(found), numPDFs, pending.getNumPending()))
+# ------------------------------
+
+def pdfPathFunc(args):
+    """ Return function: ref -> the path to write its pdf to
+    """
+    return lambda r: os.path.join(args.pdf_dir, 'PMID_%s.pdf' % r.getPmid())
+# ------------------------------
+
+def quarantineWriter(path):
+    """ Return a JournalHarvest quarantineFunc that appends each failed ref
+        (or journal search) to the JSON Lines file 'path'
+    """
+    lock = threading.Lock()
+    def quarantine(q):
+        if q.stage == 'search':     # q.item is the reports searched together
+            records = [{'stage': q.stage, 'journal': report.name}
+                                                        for report in q.item]
+        else:
+            report, ref = q.item
+            records = [{'stage': q.stage, 'journal': report.name,
+                        'pii': ref.getPii(), 'doi': ref.getDoi()}]
+        with lock, open(path, 'a') as f:
+            for record in records:
+                record['error'] = str(q.error)
+                f.write(json.dumps(record) + '\n')
+    return quarantine
+# ------------------------------
+
+def runSharded(args, elsClient, knownIds, pdfStore=None):
+    """ Be one worker of a sharded harvest: add our journals to the shard db
+        (the ones already there are skipped), then do work items until there
+        are none left.
+    """
+    heartbeatSecs = max(1, args.lease_secs // 10)
+    coordinator = ShardCoordinator(args.shard_db, leaseSecs=args.lease_secs,
+                                        heartbeatTimeout=3*heartbeatSecs)
+    journals = []
+    for jName in args.journalNames:
+        query = {'pub'        : '"%s"' % jName,
+                 'qs'         : args.qs,
+                 'loadedAfter': args.loaded_after + 'T00:00:00Z',
+                 'display'    : { 'sortBy': 'date' }
+                 }
+        journals.append((queryKey(query), {'query': query}))
+    print("%d journals added to the shard db" % \
+                                    coordinator.addItems('journal', journals))
+
+    def processRefs(refs):
+        refs = [r for r in refs if not knownIds.skipByDoi(r)]
+        return downloadPdfs(refs, pdfPathFunc(args),
+                                workers=args.pdf_workers, knownIds=knownIds,
+                                pdfStore=pdfStore)
+
+    worker = ShardWorker(coordinator, args.worker_name,
+                            totalRate=args.total_rate,
+                            heartbeatSecs=heartbeatSecs,
+                            limiter=elsClient.getRateLimiter())
+    shardClient = elsClient.sharingClient(worker.getBudgetLimiter())
+    with worker:        # w/o pdfs, just search: leave the articles to others
+        counts = runShard(worker, shardClient,
+                                processRefs if args.writePdfs else None,
+                                batchSize=20,
+                                splitters=args.splitters,
+                                parallelPages=args.parallel_pages)
+    shardClient.close()
+    print("Worker %s: %s" % (args.worker_name, counts))
+    print("Shard db: %s" % coordinator.getCounts())
+    for kind in ('journal', 'pii'):
+        for key, error in coordinator.getFailed(kind):
+            print("Failed %s %s: %s" % (kind, key, error))
+    print("Known IDs: %s" % knownIds.getStats())
+    print()
+    print(elsClient.getMetrics().summary())
+    elsClient.close()
+    coordinator.close()
+# ------------------------------
+
+def main(argv=None):
+    args = parseArgs(argv)
+    configureLogging('logs')    # requests are logged to logs/, off-thread
+    workers = args.details_workers + args.pdf_workers + \
+                                args.search_workers * args.parallel_pages
+
+    ## Load API key and Jax institution token from config file
+    apikey = os.environ['ELSEVIER_APIKEY']
+    insttoken = os.environ['ELSEVIER_INSTTOKEN']
+
+    ## Initialize Elsevier API client
+    metadataCache = SqliteMetadataCache(args.metadata_cache,
+                                        ttl=args.metadata_cache_ttl*24*60*60)
+    limiter = None      # the default: this process' shared limiter
+    if args.shard_db:   # our share of the total rate
+        limiter = AdaptiveRateLimiter(rate=args.total_rate)
+    elsClient = ElsClient(apikey, inst_token=insttoken, poolSize=workers,
+                            rateLimiter=limiter, metadataCache=metadataCache)
+    checkpoints = HarvestCheckpoint(args.checkpoints)
+    if args.known_ids:
+        knownIds = loadKnownIds(args.known_ids, compact=args.known_ids_compact)
+        print("%d known PMIDs, %d known DOIs" % \
+                                (knownIds.getNumPmids(), knownIds.getNumDois()))
+    else:
+        knownIds = KnownIdFilter()      # nothing is known
+    pending = PendingPmidQueue(args.pending)
+    pdfStore = None
+    if args.pdf_store and args.writePdfs:
+        pdfStore = PdfStore(args.pdf_store)
+
+    if args.shard_db:
+        runSharded(args, elsClient, knownIds, pdfStore)
+        return
+    recheckPending(args, elsClient, checkpoints, knownIds, pending, pdfStore)
+    if args.recheck_only:
+        return
+
+    print("Looking for Papers after %s (or each journal's checkpoint)" % \
+                                                            args.loaded_after)
+    queries = {}        # queries[jName] is the journal's own query
+    for jName in args.journalNames:
+        query = {'pub'        : '"%s"' % jName,
+                 'qs'         : args.qs,
+                 'display'    : { 'sortBy': 'date' }
+                 }
+        afterDate = checkpoints.getLoadedAfter(queryKey(query),
+                                                            args.loaded_after)
+        query['loadedAfter'] = afterDate + 'T00:00:00Z'
+        queries[jName] = query
+
+    resultSink = None
+    if args.results_dir:
+        resultSink = JsonlResultSink(args.results_dir, nameFunc=lambda search:
+                            search.getQuery()['pub'].strip('"') + '.jsonl')
+
+    # w/ --batch-size, the search stage searches the journals in batches,
+    #  each journal gets its own results
+    tasks = [HarvestTask(jName, query) for jName, query in queries.items()]
+    harvest = JournalHarvest(elsClient, checkpoints,
+                        pdfPathFunc=pdfPathFunc(args)
+                                if args.writePdfs and pdfStore is None else None,
+                        pdfStore=pdfStore,
+                        knownIds=knownIds, pending=pending,
+                        searchWorkers=args.search_workers,
+                        batchSize=args.batch_size,
+                        detailsWorkers=args.details_workers,
+                        pdfWorkers=args.pdf_workers,
+                        queueSize=args.queue_size,
+                        formatFunc=formatResult,
+                        quarantineFunc=quarantineWriter(args.quarantine)
+                                                if args.quarantine else None,
+                        resultSink=resultSink, splitters=args.splitters,
+                        parallelPages=args.parallel_pages)
+    reports = harvest.run(tasks)
+
+    for report in reports.values():
+        print()
+        print('\n'.join(report.lines))
+        for stage, pii, e in report.failures:
+            print("%s exception for pii %s: %s" % (stage, pii, e))
+        print(report)
+
+    # Would like to understand what the SciDirect pubTypes are. Collect them
+    pubTypes = {}       # pubTypes['type'] = num of refs with that type
+    for report in reports.values():
+        for pubType, n in report.pubTypes.items():
+            pubTypes[pubType] = pubTypes.get(pubType, 0) + n
+
+    print()
+    print("Summary of journals:")
+    for report in reports.values():
+        print(report)
+
+    print()
+    print("Summary of pubTypes across all journals:")
+    for k in sorted(pubTypes.keys()):
+        print("%s: %d" % (k, pubTypes[k]))
+
+    batch = harvest.getBatch()
+    if batch is not None:
+        print()
+        print("%d batched searches for %d journals" % \
+                                    (len(batch.getSearches()), len(queries)))
+        print("Look-alike journals dropped from the search results:")
+        print(batch.getUnmatchedCounts())
+
+    print()
+    print("Pipeline stages:")
+    for stats in harvest.getStageStats():
+        print(stats)
+
+    print()
+    print("Metadata cache: %s" % metadataCache.getStats())
+    print("Known IDs: %s" % knownIds.getStats())
+    if pdfStore is not None:
+        print("PDF store: %s" % pdfStore.getStats())
+
+    # where did the time go? (throttling, network, json parsing, disk writes)
+    metrics = elsClient.getMetrics()
+    print()
+    print(metrics.summary())
+    if args.metrics_file:
+        with open(args.metrics_file, 'w') as f:
+            f.write(metrics.toJson(indent=2))
+    elsClient.close()
+# ------------------------------
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Fast json decoding/encoding for API responses and cached payloads.
+
+    Responses are decoded straight from their body bytes (no r.text: no
+    charset detection, no extra str copy).
+    If the orjson package is installed, it is used (several times faster than
+    the json module), else we fall back to the standard json module.
+
+Functions
+    loads(data)  - unserialize json from bytes or str
+    dumps(obj)   - serialize to a (compact) json str
+    getParser()  - name of the parser in use: 'orjson' or 'json'
+"""
+
+import json
+try:
+    import orjson           # optional, faster
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """ Return the object encoded in the json bytes (or str) data.
+        Raises ValueError if data isn't valid json.
+    """
+    if orjson is not None:
+        return orjson.loads(data)   # orjson.JSONDecodeError is a ValueError
+    return json.loads(data)         # detects utf-8/16/32 bytes
+
+def dumps(obj):
+    """ Return obj serialized to a json str
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+def getParser():
+    return 'orjson' if orjson is not None else 'json'
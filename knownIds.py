@@ -0,0 +1,205 @@
+"""Filters of the articles we already have, by PMID or DOI, so a harvest
+    doesn't download their PDFs (or even their metadata) again.
+
+    A KnownIdFilter is loaded from an export file of the PMIDs and DOIs we
+    already have (e.g., exported from the MGI db). A harvest asks it:
+    - right after the search, by DOI (it's in the search results, so no
+        request is needed): a known DOI saves the META and the PDF requests
+    - after the details are loaded, by PMID: a known PMID saves the PDF
+        request
+    and it counts how many downloads and requests it saved.
+
+    The export file is text w/ one or more IDs per line, separated by tabs,
+    commas, '|' or spaces. IDs that are all digits are PMIDs, IDs that start
+    w/ "10." are DOIs. "PMID:" and "DOI:" prefixes and doi.org URLs are OK,
+    anything else on a line is ignored. DOIs are matched case insensitively.
+
+    The IDs are kept in sets (exact), or w/ compact=True in Bloom filters
+    (about 1.8 MB per million IDs at the default 0.1% false positive rate).
+    A false positive skips a paper we don't actually have, so only use the
+    compact filter if there are too many IDs for the sets.
+
+Class Overview
+    class BloomFilter
+    - a compact, probabilistic set of strings: no false negatives, false
+        positives at (about) the rate it was sized for
+
+    class KnownIdFilter
+    - the PMIDs & DOIs we have: skipByDoi(ref), skipByPmid(ref), getStats()
+
+Functions
+    loadKnownIds(path, compact, errorRate) - KnownIdFilter from an export file
+    parseIds(line) - the (kind, id) pairs in a line of an export file
+"""
+
+import re, math, hashlib, threading
+
+_SEPARATORS = re.compile(r'[\s,|;]+')
+_DOI_PREFIXES = ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/',
+                                        'http://dx.doi.org/', 'doi:')
+
+def normalizeDoi(doi):
+    """ Return doi in the form DOIs are matched in: lowercase, w/o prefix
+    """
+    doi = doi.strip().lower()
+    for prefix in _DOI_PREFIXES:
+        if doi.startswith(prefix):
+            return doi[len(prefix):]
+    return doi
+
+def parseIds(line):
+    """ Return the list of ('pmid', id) & ('doi', id) pairs in a line of
+        an export file
+    """
+    ids = []
+    for token in _SEPARATORS.split(line.strip()):
+        lowered = token.lower()
+        if lowered.startswith('pmid:'):
+            token = token[5:]
+        if token.isdigit():
+            ids.append(('pmid', str(int(token))))   # no leading zeros
+        elif normalizeDoi(token).startswith('10.'):
+            ids.append(('doi', normalizeDoi(token)))
+    return ids
+
+class BloomFilter(object):
+    """
+    IS:   a Bloom filter of strings
+    HAS:  a bit array sized for capacity strings at errorRate false positives
+    DOES: add(s), s in filter. Not thread safe for add()s.
+    """
+    def __init__(self, capacity, errorRate=0.001):
+        capacity = max(capacity, 1)
+        self._numBits = max(8, int(math.ceil(
+                    -capacity * math.log(errorRate) / (math.log(2) ** 2))))
+        self._numHashes = max(1, int(round(
+                                    self._numBits / capacity * math.log(2))))
+        self._bits = bytearray((self._numBits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, s):
+        digest = hashlib.blake2b(s.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self._numBits for i in range(self._numHashes)]
+
+    def add(self, s):
+        for p in self._positions(s):
+            self._bits[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+
+    def __contains__(self, s):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(s))
+
+    def __len__(self):          return self._count
+    def getNumBytes(self):      return len(self._bits)
+    def getNumHashes(self):     return self._numHashes
+# end class BloomFilter -------------------------
+
+class KnownIdFilter(object):
+    """
+    IS:   the set of articles we already have
+    HAS:  their PMIDs and DOIs (sets, or BloomFilters if compact), counts of
+          the refs it skipped
+    DOES: skipByDoi(ref) - before the details are loaded
+          skipByPmid(ref) - after the details are loaded (getPmid())
+          Both return True if we have the article (& count it). Thread safe.
+    """
+    def __init__(self, pmids=(), dois=(),
+                compact=False,      # if True, use BloomFilters
+                errorRate=0.001,    # BloomFilter false positive rate
+                capacity=None,      # (num PMIDs, num DOIs) to size the
+                                    #  BloomFilters for (default: as many as
+                                    #  pmids, dois)
+                ):
+        pmids = list(pmids)
+        dois = list(dois)
+        if compact:
+            numPmids, numDois = capacity or (len(pmids), len(dois))
+            self._pmids = BloomFilter(numPmids, errorRate)
+            self._dois = BloomFilter(numDois, errorRate)
+        else:
+            self._pmids = set()
+            self._dois = set()
+        for p in pmids: self.addPmid(p)
+        for d in dois:  self.addDoi(d)
+        self._compact = compact
+        self._lock = threading.Lock()
+        self._stats = {'checked': 0, 'skippedByDoi': 0, 'skippedByPmid': 0}
+
+    def addPmid(self, pmid):    self._pmids.add(str(pmid))
+    def addDoi(self, doi):      self._dois.add(normalizeDoi(doi))
+
+    def hasPmid(self, pmid):
+        return str(pmid) in self._pmids
+
+    def hasDoi(self, doi):
+        return bool(doi) and normalizeDoi(doi) in self._dois
+
+    def skipByDoi(self, ref):
+        """ Return True if we have ref's DOI (so don't get its details/pdf)
+        """
+        known = self.hasDoi(ref.getDoi())
+        with self._lock:
+            self._stats['checked'] += 1
+            if known:
+                self._stats['skippedByDoi'] += 1
+        return known
+
+    def skipByPmid(self, ref):
+        """ Return True if we have ref's PMID (so don't get its pdf).
+            Loads ref's details if they aren't loaded yet.
+        """
+        known = self.hasPmid(ref.getPmid())
+        if known:
+            with self._lock:
+                self._stats['skippedByPmid'] += 1
+        return known
+
+    def getStats(self):
+        """ Return dict of counts:
+                checked       - refs checked by DOI
+                skippedByDoi  - refs skipped before their details were loaded
+                skippedByPmid - refs skipped after their details were loaded
+                pdfsSaved     - pdf downloads skipped
+                requestsSaved - API requests skipped (at most: details may
+                                have come from the metadata cache)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pdfsSaved'] = stats['skippedByDoi'] + stats['skippedByPmid']
+        stats['requestsSaved'] = 2*stats['skippedByDoi'] + \
+                                                    stats['skippedByPmid']
+        return stats
+
+    def getNumPmids(self):  return len(self._pmids)
+    def getNumDois(self):   return len(self._dois)
+    def isCompact(self):    return self._compact
+# end class KnownIdFilter -------------------------
+
+def loadKnownIds(path, compact=False, errorRate=0.001):
+    """ Return a KnownIdFilter w/ the PMIDs and DOIs in the export file.
+        If compact, the file is read twice: to count the IDs (to size the
+        BloomFilters) and to add them, so they're never all in memory.
+    """
+    capacity = None
+    if compact:
+        counts = {'pmid': 0, 'doi': 0}
+        for kind, id in _readIds(path):
+            counts[kind] += 1
+        capacity = (counts['pmid'], counts['doi'])
+    known = KnownIdFilter(compact=compact, errorRate=errorRate,
+                                                            capacity=capacity)
+    for kind, id in _readIds(path):
+        if kind == 'pmid':
+            known.addPmid(id)
+        else:
+            known.addDoi(id)
+    return known
+
+def _readIds(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            for kind, id in parseIds(line):
+                yield kind, id
@@ -0,0 +1,386 @@
+"""Persistent caches for article metadata from the Elsevier API.
+
+    SciDirectReference asks its ElsClient's metadata cache (if it has one)
+    for the reference details before sending a content/article/pii/<pii>
+    ?view=META request, and stores what it gets from the API in the cache.
+    So repeat harvests over overlapping loadedAfter windows don't re-fetch
+    the metadata of articles we looked up before.
+
+    Entries are keyed by (PII, view) and hold the unserialized json payload
+    and the response's validators (ETag, Last-Modified headers).
+    Each entry can expire after a time-to-live (ttl, in seconds). An expired
+    entry that has validators can be revalidated w/ a conditional GET: if the
+    API says it is unchanged (HTTP 304), refresh() makes it fresh again.
+    When the cache gets bigger than maxEntries or maxBytes, the least
+    recently used entries are evicted.
+
+Class Overview
+    class SqliteMetadataCache
+    - entries in an SQLite database file, safe to share between threads and
+        processes
+
+    class DirectoryMetadataCache
+    - entries as json files in a directory tree (one file per entry), easy
+        to inspect/delete by hand
+
+    Both support:
+        get(pii, view)      - payload, or None if not cached (or expired)
+        getEntry(pii, view) - CacheEntry (even if expired), or None
+        put(pii, view, payload, ttl, validators)
+                            - ttl overrides the cache's default
+        refresh(pii, view, ttl) - restart an entry's ttl (after a 304)
+        delete(pii, view), clear(), close()
+        getStats()  - dict of counts:
+                        hits        - fresh entries found
+                        misses      - not found (get() includes expired)
+                        expired     - expired entries found
+                        revalidated - expired entries refreshed after a 304
+                        puts, evictions
+"""
+
+import os, json, time, threading, sqlite3
+import jsonCodec
+
+class CacheEntry(object):
+    """ A cached payload w/ its validators and whether it has expired
+    """
+    def __init__(self, payload, validators, expired):
+        self.payload = payload
+        self.validators = validators or {}  # {'ETag': .., 'Last-Modified': ..}
+        self.expired = expired
+# end class CacheEntry -------------------------
+
+class _MetadataCacheBase(object):
+    """ Hit/miss counters, the default ttl & size limits, and the get/put
+        logic. Subclasses implement the storage:
+            _read(pii, view) -> (payload, expiresAt, validators) or None
+                                (and mark the entry as recently used)
+            _write(pii, view, payload, expiresAt, validators)
+            _setExpiresAt(pii, view, expiresAt)
+    """
+    def __init__(self, ttl=None, maxEntries=None, maxBytes=None):
+        self._ttl = ttl                 # default seconds to keep entries
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+        self._clock = time.time
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0,
+                            'revalidated': 0, 'puts': 0, 'evictions': 0}
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def _expiresAt(self, ttl):
+        if ttl is None:
+            ttl = self._ttl
+        if ttl is None:
+            return None
+        return self._clock() + ttl
+
+    def _isExpired(self, expiresAt):
+        return expiresAt is not None and expiresAt <= self._clock()
+
+    def get(self, pii, view):
+        """ Return the cached payload for (pii, view), or None if it is not
+            cached or has expired.
+        """
+        entry = self.getEntry(pii, view)
+        if entry is None:
+            return None
+        if entry.expired:
+            self._count('misses')
+            return None
+        return entry.payload
+
+    def getEntry(self, pii, view):
+        """ Return the CacheEntry for (pii, view), or None if not cached.
+            Expired entries are returned (w/ entry.expired = True) so they
+            can be revalidated.
+        """
+        found = self._read(pii, view)
+        if found is None:
+            self._count('misses')
+            return None
+        payload, expiresAt, validators = found
+        expired = self._isExpired(expiresAt)
+        self._count('expired' if expired else 'hits')
+        return CacheEntry(payload, validators, expired)
+
+    def put(self, pii, view, payload, ttl=None, validators=None):
+        """ Cache payload for (pii, view). ttl overrides the default ttl.
+            validators = the response's {'ETag': .., 'Last-Modified': ..}
+        """
+        self._write(pii, view, payload, self._expiresAt(ttl), validators or {})
+        self._count('puts')
+
+    def refresh(self, pii, view, ttl=None):
+        """ The API says the (expired) entry for (pii, view) is unchanged,
+            restart its ttl.
+        """
+        self._setExpiresAt(pii, view, self._expiresAt(ttl))
+        self._count('revalidated')
+
+    def getStats(self):
+        """ Return dict of counters (see module docstring)
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def getTtl(self):   return self._ttl
+# end class _MetadataCacheBase -------------------------
+
+class SqliteMetadataCache(_MetadataCacheBase):
+    """
+    IS:   a metadata cache in an SQLite database file.
+    HAS:  one row per (pii, view) w/ the json payload, its size, when it
+          expires and when it was last used.
+    DOES: get/put entries, evicts least recently used entries when over
+          maxEntries or maxBytes.
+    """
+    def __init__(self, dbPath, ttl=None, maxEntries=None, maxBytes=None,
+                lockTimeout=30):  # seconds to wait for the sqlite lock
+        super().__init__(ttl, maxEntries, maxBytes)
+        self._dbPath = dbPath
+        self._conn = sqlite3.connect(dbPath, timeout=lockTimeout,
+                                                    check_same_thread=False)
+        self._dbLock = threading.Lock()     # one connection, many threads
+        with self._dbLock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                                    pii       TEXT NOT NULL,
+                                    view      TEXT NOT NULL,
+                                    payload   TEXT NOT NULL,
+                                    size      INTEGER NOT NULL,
+                                    expiresAt REAL,
+                                    lastUsed  REAL NOT NULL,
+                                    validators TEXT,
+                                    PRIMARY KEY (pii, view))''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS
+                                    metadata_lastUsed ON metadata (lastUsed)''')
+            columns = [row[1] for row in
+                    self._conn.execute('PRAGMA table_info(metadata)')]
+            if 'validators' not in columns:     # db from an older version
+                self._conn.execute('ALTER TABLE metadata ' +
+                                            'ADD COLUMN validators TEXT')
+
+    def _read(self, pii, view):
+        with self._dbLock, self._conn:
+            row = self._conn.execute('SELECT payload, expiresAt, validators ' +
+                            'FROM metadata WHERE pii = ? AND view = ?',
+                            (pii, view)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE metadata SET lastUsed = ? ' +
+                            'WHERE pii = ? AND view = ?',
+                            (self._clock(), pii, view))
+        payload, expiresAt, validators = row
+        return jsonCodec.loads(payload), expiresAt, \
+                                            json.loads(validators or '{}')
+
+    def _write(self, pii, view, payload, expiresAt, validators):
+        text = jsonCodec.dumps(payload)
+        with self._dbLock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO metadata ' +
+                    '(pii, view, payload, size, expiresAt, lastUsed, ' +
+                    'validators) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (pii, view, text, len(text), expiresAt, self._clock(),
+                                                    json.dumps(validators)))
+            numEvicted = self._evict()
+        self._count('evictions', numEvicted)
+
+    def _setExpiresAt(self, pii, view, expiresAt):
+        with self._dbLock, self._conn:
+            self._conn.execute('UPDATE metadata SET expiresAt = ? ' +
+                        'WHERE pii = ? AND view = ?', (expiresAt, pii, view))
+
+    def _evict(self):
+        """ Delete least recently used entries until we are within limits.
+            Call with the db lock held, inside a transaction.
+            Return the number of entries evicted.
+        """
+        numEntries = self._conn.execute('SELECT COUNT(*) FROM metadata'
+                                                            ).fetchone()[0]
+        numEvicted = 0
+        if self._maxEntries is not None and numEntries > self._maxEntries:
+            n = numEntries - self._maxEntries
+            numEvicted += self._conn.execute('DELETE FROM metadata WHERE ' +
+                    'rowid IN (SELECT rowid FROM metadata ' +
+                    'ORDER BY lastUsed LIMIT ?)', (n,)).rowcount
+        if self._maxBytes is not None:
+            numBytes = self._conn.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+            if numBytes <= self._maxBytes:
+                return numEvicted
+            rows = self._conn.execute('SELECT rowid, size FROM metadata ' +
+                                        'ORDER BY lastUsed').fetchall()
+            for rowid, size in rows:
+                if numBytes <= self._maxBytes:
+                    break
+                self._conn.execute('DELETE FROM metadata WHERE rowid = ?',
+                                                                    (rowid,))
+                numBytes -= size
+                numEvicted += 1
+        return numEvicted
+
+    def delete(self, pii, view):
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM metadata ' +
+                        'WHERE pii = ? AND view = ?', (pii, view))
+
+    def clear(self):
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM metadata')
+
+    def getNumEntries(self):
+        with self._dbLock:
+            return self._conn.execute('SELECT COUNT(*) FROM metadata'
+                                                            ).fetchone()[0]
+
+    def close(self):
+        with self._dbLock:
+            self._conn.close()
+
+    def getDbPath(self):   return self._dbPath
+# end class SqliteMetadataCache -------------------------
+
+class DirectoryMetadataCache(_MetadataCacheBase):
+    """
+    IS:   a metadata cache in a directory tree.
+    HAS:  one json file per (pii, view): <dir>/<view>/<last 2 chars of pii>/
+          <pii>.json holding the payload, its validators and when it expires.
+          The file's modification time is when it was last used.
+    DOES: get/put entries, evicts least recently used entries when over
+          maxEntries or maxBytes.
+          The entry count & size are tallied when the cache is opened and
+          then tracked by this object, so other processes writing to the
+          same directory can make them (temporarily) inaccurate.
+    """
+    def __init__(self, dirPath, ttl=None, maxEntries=None, maxBytes=None):
+        super().__init__(ttl, maxEntries, maxBytes)
+        self._dirPath = dirPath
+        os.makedirs(dirPath, exist_ok=True)
+        self._numEntries = 0
+        self._numBytes = 0
+        for path in self._allPaths():
+            self._numEntries += 1
+            self._numBytes += os.path.getsize(path)
+
+    def _path(self, pii, view):
+        return os.path.join(self._dirPath, view, pii[-2:], pii + '.json')
+
+    def _allPaths(self):
+        for dirPath, dirNames, fileNames in os.walk(self._dirPath):
+            for f in fileNames:
+                if f.endswith('.json'):
+                    yield os.path.join(dirPath, f)
+
+    def _readFile(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _writeFile(self, path, entry):
+        """ Write entry to path atomically, return its size.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        text = json.dumps(entry)
+        tmpPath = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmpPath, 'w') as f:
+            f.write(text)
+        os.replace(tmpPath, path)       # readers never see partial files
+        now = self._clock()             # mark as recently used
+        os.utime(path, (now, now))
+        return len(text)
+
+    def _read(self, pii, view):
+        path = self._path(pii, view)
+        entry = self._readFile(path)
+        if entry is None:
+            return None
+        try:
+            now = self._clock()     # mark as recently used
+            os.utime(path, (now, now))
+        except FileNotFoundError:   # evicted by someone else
+            pass
+        return entry['payload'], entry['expiresAt'], \
+                                                entry.get('validators', {})
+
+    def _write(self, pii, view, payload, expiresAt, validators):
+        path = self._path(pii, view)
+        entry = {'expiresAt' : expiresAt,
+                 'validators': validators,
+                 'payload'   : payload}
+        with self._lock:
+            oldSize = os.path.getsize(path) if os.path.exists(path) else None
+            size = self._writeFile(path, entry)
+            if oldSize is None:
+                self._numEntries += 1
+            else:
+                self._numBytes -= oldSize
+            self._numBytes += size
+            self._evict()
+
+    def _setExpiresAt(self, pii, view, expiresAt):
+        path = self._path(pii, view)
+        with self._lock:
+            entry = self._readFile(path)
+            if entry is None:
+                return
+            oldSize = os.path.getsize(path)
+            entry['expiresAt'] = expiresAt
+            self._numBytes += self._writeFile(path, entry) - oldSize
+
+    def _overLimits(self):
+        return (self._maxEntries is not None and \
+                                        self._numEntries > self._maxEntries) \
+            or (self._maxBytes is not None and self._numBytes > self._maxBytes)
+
+    def _evict(self):
+        """ Delete least recently used files until we are within limits.
+            Call with self._lock held.
+        """
+        if not self._overLimits():
+            return
+        entries = []
+        for path in self._allPaths():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        for mtime, size, path in entries:
+            if not self._overLimits():
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._numEntries -= 1
+            self._numBytes -= size
+            self._stats['evictions'] += 1
+
+    def delete(self, pii, view):
+        path = self._path(pii, view)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self._numEntries -= 1
+            self._numBytes -= size
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._allPaths()):
+                os.remove(path)
+            self._numEntries = 0
+            self._numBytes = 0
+
+    def getNumEntries(self):    return self._numEntries
+    def close(self):            pass
+    def getDirPath(self):       return self._dirPath
+# end class DirectoryMetadataCache -------------------------
@@ -0,0 +1,266 @@
+"""A content-addressed store of the harvested PDFs.
+
+    Instead of one flat directory of PMID_nnnn.pdf files, a PdfStore keeps
+    each distinct PDF once, named by the sha256 of its content, in a sharded
+    directory tree (so no directory gets too big):
+        rootDir/objects/ab/cd/abcd....pdf
+    and an index (an SQLite db, rootDir/index.db) from each article's PMID,
+    PII and DOI to the sha256 of its PDF.
+
+    The sha256 is computed while the PDF streams to disk (no 2nd read).
+    PDFs are written to rootDir/tmp/ and renamed into place once complete
+    and fsync'ed, and indexed only after that, so the index never points to
+    a partial or missing file (a crash can only leave a temp file, removed
+    by a later PdfStore once it is old, or an unindexed object that is
+    reused if the same PDF is stored again).
+    A PDF whose content is already in the store (e.g., the same article
+    under two PMIDs, or a re-download) isn't stored again, just indexed.
+
+    "Do we have this PDF" is an index lookup (hasPmid(), hasPii(), ...):
+    no directory scan, no request. savePdf(ref) checks the index before it
+    downloads anything.
+
+Class Overview
+    class PdfStore
+    - savePdf(ref), savePdfs(refs, workers) - download & store refs' pdfs
+    - importPdf(path, pmid, pii, doi) - add a pdf file (e.g., from pdfs/)
+    - lookup(kind, id), hasPmid(pmid), hasPii(pii), hasDoi(doi)
+    - getPdfPath(kind, id), getObjectPath(sha256)
+"""
+
+import os, time, hashlib, tempfile, threading, sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from SciDirectLib import VALIDATORS_SUFFIX, PDF_MAGIC, PDF_CHUNK_SIZE
+from knownIds import normalizeDoi
+
+KINDS = ('pmid', 'pii', 'doi')
+TMP_MAX_AGE = 24*60*60      # secs before a temp file is a crash leftover
+
+def normalizeId(kind, id):
+    """ Return id in the form it is indexed in
+    """
+    if kind == 'pmid':
+        return str(int(id))
+    if kind == 'doi':
+        return normalizeDoi(id)
+    if kind == 'pii':
+        return id
+    raise ValueError('unknown id kind: %r' % kind)
+
+def refIds(ref):
+    """ Return [(kind, id), ...] of a SciDirectReference. Loads its details
+        (for the PMID) if they aren't loaded yet.
+    """
+    ids = [('pii', ref.getPii())]
+    if ref.getDoi():
+        ids.append(('doi', ref.getDoi()))
+    if ref.getPmid() != 'no PMID':
+        ids.append(('pmid', ref.getPmid()))
+    return ids
+
+class PdfStore(object):
+    """
+    IS:   a content-addressed store of pdfs in a directory
+    HAS:  the pdfs, one file per distinct content (by sha256), and an index
+          of PMIDs, PIIs & DOIs -> sha256
+    DOES: stores pdfs atomically w/o duplicates, answers "do we have it" from
+          the index. Safe to share between threads (and processes).
+    """
+    def __init__(self, rootDir,
+                lockTimeout=30,         # seconds to wait for the sqlite lock
+                tmpMaxAge=TMP_MAX_AGE,  # remove older temp files
+                ):
+        self._rootDir = rootDir
+        self._objectsDir = os.path.join(rootDir, 'objects')
+        self._tmpDir = os.path.join(rootDir, 'tmp')
+        os.makedirs(self._objectsDir, exist_ok=True)
+        os.makedirs(self._tmpDir, exist_ok=True)
+        self._removeOldTmpFiles(tmpMaxAge)
+        self._stats = {'downloaded': 0, 'imported': 0, 'deduped': 0,
+                                                                'skipped': 0}
+        self._conn = sqlite3.connect(os.path.join(rootDir, 'index.db'),
+                            timeout=lockTimeout, check_same_thread=False)
+        self._dbLock = threading.Lock()     # one connection, many threads
+        with self._dbLock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS objects (
+                                    sha256  TEXT PRIMARY KEY,
+                                    size    INTEGER NOT NULL,
+                                    added   REAL NOT NULL)''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS ids (
+                                    kind    TEXT NOT NULL,
+                                    id      TEXT NOT NULL,
+                                    sha256  TEXT NOT NULL,
+                                    PRIMARY KEY (kind, id))''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS ids_sha256
+                                    ON ids (sha256)''')
+
+    def _removeOldTmpFiles(self, maxAge):
+        """ Remove temp files left by crashed writers. (Newer ones may belong
+            to other processes writing now)
+        """
+        cutoff = time.time() - maxAge
+        for entry in os.scandir(self._tmpDir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _count(self, stat, n=1):
+        with self._dbLock:
+            self._stats[stat] += n
+
+    # lookups
+    def lookup(self, kind, id):
+        """ Return the sha256 of the pdf indexed by (kind, id), or None
+        """
+        with self._dbLock:
+            row = self._conn.execute('SELECT sha256 FROM ids WHERE kind = ? ' +
+                        'AND id = ?', (kind, normalizeId(kind, id))).fetchone()
+        return row[0] if row else None
+
+    def hasPmid(self, pmid):    return self.lookup('pmid', pmid) is not None
+    def hasPii(self, pii):      return self.lookup('pii', pii) is not None
+    def hasDoi(self, doi):      return self.lookup('doi', doi) is not None
+
+    def getObjectPath(self, sha256):
+        """ Return the path of the pdf w/ this sha256 (whether it's there)
+        """
+        return os.path.join(self._objectsDir, sha256[:2], sha256[2:4],
+                                                            sha256 + '.pdf')
+
+    def getPdfPath(self, kind, id):
+        """ Return the path of the pdf indexed by (kind, id), or None
+        """
+        sha256 = self.lookup(kind, id)
+        return None if sha256 is None else self.getObjectPath(sha256)
+
+    def _lookupRef(self, ref):
+        """ Look for ref's pdf by its PII, DOI (no request needed) and then
+            its PMID (may load ref's details).
+            Return (sha256 or None, [(kind, id) looked up])
+        """
+        ids = []
+        for kind, get in [('pii', ref.getPii), ('doi', ref.getDoi),
+                                                        ('pmid', ref.getPmid)]:
+            id = get()
+            if id and id != 'no PMID':
+                ids.append((kind, id))
+                sha256 = self.lookup(kind, id)
+                if sha256 is not None:
+                    return sha256, ids
+        return None, ids
+
+    # adding pdfs
+    def savePdf(self, ref):
+        """ Store the pdf of SciDirectReference ref, unless we have it already
+            (by any of its IDs). Index it by its PMID, PII and DOI.
+            Return True if the pdf was downloaded, False if we had it.
+        """
+        sha256, ids = self._lookupRef(ref)
+        if sha256 is not None:
+            self._index(sha256, ids)    # add the aliases we looked up 1st
+            self._count('skipped')
+            return False
+        tmpPath = self._newTmpPath()
+        try:
+            hasher = hashlib.sha256()
+            numBytes = ref.savePdf(tmpPath, conditional=False, hasher=hasher)
+            self._add(tmpPath, hasher.hexdigest(), numBytes, refIds(ref))
+        finally:
+            for path in [tmpPath, tmpPath + VALIDATORS_SUFFIX]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._count('downloaded')
+        return True
+
+    def savePdfs(self, refs, workers=4):
+        """ savePdf() for many refs concurrently.
+            Return dict {pii: exception} for the refs that failed
+        """
+        failures = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.savePdf, r): r for r in refs}
+            for future in as_completed(futures):
+                exc = future.exception()
+                if exc is not None:
+                    failures[futures[future].getPii()] = exc
+        return failures
+
+    def importPdf(self, path, pmid=None, pii=None, doi=None):
+        """ Copy the pdf file 'path' into the store, index it by the given
+            IDs. Return its sha256.
+        """
+        ids = [(kind, id) for kind, id in zip(KINDS, (pmid, pii, doi)) if id]
+        tmpPath = self._newTmpPath()
+        try:
+            hasher = hashlib.sha256()
+            numBytes = 0
+            with open(path, 'rb') as src, open(tmpPath, 'wb') as dst:
+                head = src.read(len(PDF_MAGIC))
+                if head != PDF_MAGIC:
+                    raise ValueError("'%s' is not a pdf, starts w/ %s" % \
+                                                                (path, head))
+                chunk = head
+                while chunk:
+                    hasher.update(chunk)
+                    dst.write(chunk)
+                    numBytes += len(chunk)
+                    chunk = src.read(PDF_CHUNK_SIZE)
+                dst.flush()
+                os.fsync(dst.fileno())
+            sha256 = hasher.hexdigest()
+            self._add(tmpPath, sha256, numBytes, ids)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        self._count('imported')
+        return sha256
+
+    def _newTmpPath(self):
+        fd, tmpPath = tempfile.mkstemp(dir=self._tmpDir, suffix='.pdf')
+        os.close(fd)
+        return tmpPath
+
+    def _add(self, tmpPath, sha256, size, ids):
+        """ Move the complete pdf at tmpPath into place (unless we have its
+            content already), then index it
+        """
+        path = self.getObjectPath(sha256)
+        if os.path.exists(path):
+            self._count('deduped')      # tmpPath is removed by the caller
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmpPath, path)   # atomic, same file system
+        with self._dbLock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO objects ' +
+                    '(sha256, size, added) VALUES (?, ?, ?)',
+                    (sha256, size, time.time()))
+        self._index(sha256, ids)
+
+    def _index(self, sha256, ids):
+        """ Point the (kind, id)s at sha256 (the latest pdf of an ID wins)
+        """
+        with self._dbLock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO ids ' +
+                    '(kind, id, sha256) VALUES (?, ?, ?)',
+                    [(kind, normalizeId(kind, id), sha256) for kind, id in ids])
+
+    def getNumObjects(self):
+        with self._dbLock:
+            return self._conn.execute('SELECT COUNT(*) FROM objects'
+                                                            ).fetchone()[0]
+
+    def getStats(self):
+        """ Return dict of counts: downloaded, imported, deduped (content we
+            had already), skipped (IDs we had already, no download)
+        """
+        with self._dbLock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._dbLock:
+            self._conn.close()
+
+    def getRootDir(self):   return self._rootDir
+# end class PdfStore -------------------------
@@ -0,0 +1,236 @@
+"""A persistent queue of articles that are waiting for their PMID.
+
+    Articles can show up at ScienceDirect before PubMed has indexed them, so
+    their details (?view=META) don't have a PMID yet and a harvest can't
+    name/keep their PDFs. Instead of re-searching and re-fetching the details
+    of everything in a wide loadedAfter window to find them again, a harvest
+    adds them to a PendingPmidQueue (w/ the search result fields it needs to
+    rebuild the SciDirectReference) and the searches skip them.
+
+    recheckDue() then looks at just the entries that are due: it gets their
+    details again and returns the ones that have a PMID now (they leave the
+    queue, on to the PDF download). The others are rescheduled, each time
+    waiting twice as long (up to maxDelay), so an article that takes weeks
+    to be indexed costs a handful of META requests, not one per run. After
+    maxChecks checks an article is dropped from the queue.
+
+    The first recheck waits a couple of days, longer than the metadata cache
+    keeps details w/o a PMID (see SciDirectReference), so the recheck asks
+    the API (a conditional GET) instead of getting the cached details.
+
+Class Overview
+    class PendingPmidQueue
+    - add(ref, key), isPending(pii), getPendingPiis(key)
+    - getDue(limit) - the entries due for a recheck, as PendingEntry objects
+    - reschedule(pii), remove(pii)
+
+    class PendingEntry
+    - a queued article: its PII, query key, search result record, counts
+
+Functions
+    recheckDue(queue, elsClient, workers, limit)
+        - recheck the due entries, return ([(ref w/ a PMID now, its query
+            key), ...], {pii: exception})
+"""
+
+import json, time, threading, sqlite3
+from SciDirectLib import SciDirectReference, prefetchDetails
+
+DAY = 24*60*60
+
+class PendingEntry(object):
+    """ An article in the PendingPmidQueue
+    """
+    def __init__(self, pii, key, record, added, lastChecked, nextCheck,
+                                                                    numChecks):
+        self.pii = pii
+        self.key = key              # the query key it was found by, or None
+        self.record = record        # its search result fields (dict)
+        self.added = added          # when it was queued (epoch secs)
+        self.lastChecked = lastChecked  # when we last looked for its PMID
+        self.nextCheck = nextCheck      # when it is due for a recheck
+        self.numChecks = numChecks      # num of rechecks so far
+
+    def getReference(self, elsClient):
+        """ Return a SciDirectReference for the article
+        """
+        return SciDirectReference(elsClient, self.record)
+# end class PendingEntry -------------------------
+
+class PendingPmidQueue(object):
+    """
+    IS:   a queue of articles waiting for a PMID, in an SQLite database file
+    HAS:  one row per PII w/ its search result fields and recheck schedule
+    DOES: tells a harvest which articles to skip and which are due for a
+          recheck. Safe to share between threads.
+    """
+    def __init__(self, dbPath,
+                firstDelay=2*DAY,   # secs until the 1st recheck
+                backoff=2.0,        # each recheck waits this many times longer
+                maxDelay=30*DAY,    # ... up to this
+                maxChecks=12,       # drop an article after this many rechecks
+                lockTimeout=30):    # seconds to wait for the sqlite lock
+        self._dbPath = dbPath
+        self._firstDelay = firstDelay
+        self._backoff = backoff
+        self._maxDelay = maxDelay
+        self._maxChecks = maxChecks
+        self._clock = time.time
+        self._stats = {'added': 0, 'rechecked': 0, 'found': 0, 'dropped': 0}
+        self._conn = sqlite3.connect(dbPath, timeout=lockTimeout,
+                                                    check_same_thread=False)
+        self._dbLock = threading.Lock()     # one connection, many threads
+        with self._dbLock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS pending (
+                                    pii         TEXT PRIMARY KEY,
+                                    key         TEXT,
+                                    record      TEXT NOT NULL,
+                                    added       REAL NOT NULL,
+                                    lastChecked REAL NOT NULL,
+                                    nextCheck   REAL NOT NULL,
+                                    numChecks   INTEGER NOT NULL)''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS pending_due
+                                    ON pending (nextCheck)''')
+
+    def _count(self, stat, n=1):
+        with self._dbLock:
+            self._stats[stat] += n
+
+    def _delay(self, numChecks):
+        """ Return secs to wait before the recheck after numChecks rechecks
+        """
+        return min(self._maxDelay,
+                        self._firstDelay * self._backoff ** numChecks)
+
+    def add(self, ref, key=None):
+        """ Queue the article of SciDirectReference ref (found by the query
+            'key'), if it isn't queued already.
+            Return True if it was added.
+        """
+        record = {'pii'            : ref.getPii(),
+                  'doi'            : ref.getDoi(),
+                  'sourceTitle'    : ref.getJournal(),
+                  'title'          : ref.getTitle(),
+                  'loadDate'       : ref.getLoadDate(),
+                  'publicationDate': ref.getPublicationDate()}
+        now = self._clock()
+        with self._dbLock, self._conn:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO pending ' +
+                    '(pii, key, record, added, lastChecked, nextCheck, ' +
+                    'numChecks) VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (ref.getPii(), key, json.dumps(record), now, now,
+                                                    now + self._delay(0)))
+            added = cursor.rowcount == 1
+        if added:
+            self._count('added')
+        return added
+
+    def isPending(self, pii):
+        with self._dbLock:
+            return self._conn.execute('SELECT 1 FROM pending WHERE pii = ?',
+                                                (pii,)).fetchone() is not None
+
+    def getPendingPiis(self, key=None):
+        """ Return the set of queued PIIs (found by query 'key', if given)
+        """
+        with self._dbLock:
+            if key is None:
+                rows = self._conn.execute('SELECT pii FROM pending').fetchall()
+            else:
+                rows = self._conn.execute('SELECT pii FROM pending ' +
+                                    'WHERE key = ?', (key,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def getDue(self, limit=None):
+        """ Return the list of PendingEntry objects due for a recheck, the
+            longest overdue first (at most limit of them)
+        """
+        sql = 'SELECT pii, key, record, added, lastChecked, nextCheck, ' + \
+                'numChecks FROM pending WHERE nextCheck <= ? ' + \
+                'ORDER BY nextCheck, pii'
+        params = (self._clock(),)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        with self._dbLock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [PendingEntry(pii, key, json.loads(record), added, lastChecked,
+                                nextCheck, numChecks)
+                for pii, key, record, added, lastChecked, nextCheck, numChecks
+                in rows]
+
+    def reschedule(self, pii):
+        """ The article 'pii' was rechecked and still has no PMID: schedule
+            the next recheck, or drop it if it has had maxChecks of them.
+            Return the time of the next recheck, or None if dropped.
+        """
+        with self._dbLock:
+            row = self._conn.execute('SELECT numChecks FROM pending ' +
+                                    'WHERE pii = ?', (pii,)).fetchone()
+        if row is None:
+            return None
+        numChecks = row[0] + 1
+        self._count('rechecked')
+        if self._maxChecks is not None and numChecks >= self._maxChecks:
+            self.remove(pii)
+            self._count('dropped')
+            return None
+        now = self._clock()
+        nextCheck = now + self._delay(numChecks)
+        with self._dbLock, self._conn:
+            self._conn.execute('UPDATE pending SET lastChecked = ?, ' +
+                    'nextCheck = ?, numChecks = ? WHERE pii = ?',
+                    (now, nextCheck, numChecks, pii))
+        return nextCheck
+
+    def found(self, pii):
+        """ The article 'pii' has a PMID now: remove it from the queue
+        """
+        self._count('rechecked')
+        self._count('found')
+        self.remove(pii)
+
+    def remove(self, pii):
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM pending WHERE pii = ?', (pii,))
+
+    def getNumPending(self):
+        with self._dbLock:
+            return self._conn.execute('SELECT COUNT(*) FROM pending'
+                                                            ).fetchone()[0]
+
+    def getStats(self):
+        """ Return dict of counts: added, rechecked, found (got a PMID),
+            dropped (gave up after maxChecks)
+        """
+        with self._dbLock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._dbLock:
+            self._conn.close()
+
+    def getDbPath(self):   return self._dbPath
+# end class PendingPmidQueue -------------------------
+
+def recheckDue(queue, elsClient, workers=4, limit=None):
+    """ Get the details of the articles in queue that are due for a recheck
+        (one META request each, or a 304 if the cached details are unchanged)
+        Return ([(SciDirectReference that has a PMID now, its query key),...],
+                {pii: exception})
+        The ones w/ a PMID are removed from the queue, the others are
+        rescheduled. The ones that failed stay due.
+    """
+    entries = queue.getDue(limit)
+    refs = [e.getReference(elsClient) for e in entries]
+    failures = prefetchDetails(refs, workers=workers)
+    withPmids = []
+    for e, r in zip(entries, refs):
+        if r.getPii() in failures:
+            continue
+        if r.getPmid() != 'no PMID':
+            queue.found(r.getPii())
+            withPmids.append((r, e.key))
+        else:
+            queue.reschedule(r.getPii())
+    return withPmids, failures
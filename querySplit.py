@@ -0,0 +1,107 @@
+"""Splitters for SciDirectSearch queries that match more results than the
+    API lets us page through.
+
+    The search API pages by 'offset' and won't go past offset 6000 (see
+    SciDirectLib.SEARCH_MAX_OFFSET), and SciDirectSearch stops at its
+    maxResults. When a search w/ splitters finds more than it can page
+    through (resultsFound), it asks its splitters, in
+    order, to partition the query into narrower queries, runs those (which
+    split again if they are still too big) and merges their results,
+    dropping duplicate PIIs. See SciDirectSearch.
+
+    A splitter is a function: query dict -> list of sub-query dicts that
+    together match what the query matches, or None if it can't split the
+    query (any further). It must return None eventually, or the splitting
+    never stops.
+
+    The API has no date ranges for loadedAfter, but it does have a
+    publication 'date' field: a year or a range of years, "2015-2020".
+    A query w/o a 'date' matches every year ScienceDirect has. Its 1st split
+    is into the last RECENT_YEARS years and the years before them: the
+    articles of an incremental (loadedAfter) harvest are nearly all recent,
+    so the old range is one small search, not several levels of bisecting
+    two centuries.
+
+Functions
+    splitByYear(query) - bisect the query's publication year range
+    splitByTerms(terms) - a splitter that partitions the query's 'qs' by the
+        given terms
+    DEFAULT_SPLITTERS - (splitByYear,)
+"""
+
+import re, datetime
+
+FIRST_YEAR = 1823       # for queries w/o a 'date', split from here (the
+                        #  oldest ScienceDirect content, The Lancet vol. 1)
+                        #  ... to next year (articles in press)
+RECENT_YEARS = 8        # a query w/o a 'date' splits off this many years
+                        #  up to next year 1st
+
+_YEARS = re.compile(r'^\s*(\d{4})\s*(?:-\s*(\d{4})\s*)?$')
+
+def parseYears(date):
+    """ Return (first year, last year) of a query 'date' ("2015" or
+        "2015-2020"), or the default range if date is None
+    """
+    if date is None:
+        return FIRST_YEAR, datetime.date.today().year + 1
+    m = _YEARS.match(str(date))
+    if m is None:
+        raise ValueError('bad query date: %r' % date)
+    first = int(m.group(1))
+    last = int(m.group(2) or first)
+    if last < first:
+        raise ValueError('bad query date: %r' % date)
+    return first, last
+
+def formatYears(first, last):
+    """ Return the query 'date' for the years first..last
+    """
+    return str(first) if first == last else '%d-%d' % (first, last)
+
+def splitByYear(query):
+    """ Split query's publication years in two (the newer half 1st, like
+        sortBy date). W/o a 'date', the newer part is the last RECENT_YEARS
+        years. Return None if it is a single year.
+    """
+    first, last = parseYears(query.get('date'))
+    if first == last:
+        return None
+    mid = (first + last) // 2
+    if query.get('date') is None:
+        mid = max(first, last - RECENT_YEARS)
+    newer = dict(query, date=formatYears(mid + 1, last))
+    older = dict(query, date=formatYears(first, mid))
+    return [newer, older]
+
+def splitByTerms(terms):
+    """ Return a splitter that partitions the query's 'qs' by terms:
+            (qs) AND (t1)
+            (qs) AND (t2) AND NOT (t1)
+            ...
+            (qs) AND NOT (t1 OR t2 ...)
+        so every result matches exactly one sub-query. E.g., for "mice" in a
+        single year: splitByTerms(['brain', 'heart', 'bone']).
+        The splitter returns None for queries that already have one of the
+        terms in their 'qs' (its own sub-queries).
+    """
+    terms = list(terms)
+    if not terms:
+        raise ValueError('no terms to split by')
+    def split(query):
+        qs = query.get('qs')
+        if not qs or '(%s)' % ' OR '.join(terms) in qs or \
+                                    any('(%s)' % t in qs for t in terms):
+            return None
+        subQueries = []
+        for i, term in enumerate(terms):
+            subQs = '(%s) AND (%s)' % (qs, term)
+            if i > 0:
+                subQs += ' AND NOT (%s)' % ' OR '.join(terms[:i])
+            subQueries.append(dict(query, qs=subQs))
+        subQueries.append(dict(query,
+                            qs='(%s) AND NOT (%s)' % (qs, ' OR '.join(terms))))
+        return subQueries
+    return split
+
+DEFAULT_SPLITTERS = (splitByYear,)
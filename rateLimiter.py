@@ -0,0 +1,401 @@
+"""Rate limiters for throttling requests to the Elsevier API.
+
+    Our API key has a quota of requests/sec (we got RATE_LIMIT_EXCEEDED
+    when we went faster than 1 req/sec). Every request an ElsClient sends
+    first calls acquire() on its rate limiter, which sleeps as needed to
+    stay within the rate.
+
+    All limiters here are thread safe. Several ElsClients (in one process)
+    using the same API key share one limiter by default (see
+    getSharedLimiter()). To coordinate several processes on one host, give
+    each of their ElsClients a SqliteRateLimiter pointing at the same file.
+
+Class Overview
+    class TokenBucketLimiter
+    - allows bursts of up to 'burst' requests, refills at 'rate' req/sec
+
+    class AdaptiveRateLimiter
+    - a token bucket whose rate adapts to what the API tells us: it backs
+        off when we get HTTP 429 (RATE_LIMIT_EXCEEDED), slows down to stretch
+        the remaining quota (X-RateLimit-Remaining/-Reset headers) and
+        creeps back up to maxRate as requests succeed.
+        This is the default limiter ElsClients share (see getSharedLimiter())
+
+    class SlidingWindowLimiter
+    - allows at most 'maxRequests' requests in any 'window' seconds
+
+    class SqliteRateLimiter
+    - a token bucket whose state lives in an SQLite database file so it is
+        shared by all processes (& threads) that use that file
+
+    class NullRateLimiter
+    - does no throttling (for tests, replaying recorded responses, etc.)
+
+    All limiters support:
+        acquire()  - block until a request may be sent.
+                     Returns the number of seconds slept.
+        reserve()  - reserve the next slot w/o sleeping.
+                     Returns the number of seconds the caller must wait
+                     before sending. (so asyncio code can asyncio.sleep())
+        getRate()  - the (average) number of requests/sec allowed
+
+    class AsyncRateLimiter
+    - wraps any of the above limiters for use by asyncio code, so async and
+        threaded clients can share one request budget
+"""
+
+import time, threading, sqlite3, collections, asyncio
+
+class NullRateLimiter(object):
+    """
+    IS:   a rate limiter that never throttles
+    """
+    def acquire(self, tokens=1):    return 0.0
+    def reserve(self, tokens=1):    return 0.0
+    def getRate(self):              return None
+# end class NullRateLimiter -------------------------
+
+class TokenBucketLimiter(object):
+    """
+    IS:   a thread safe token bucket rate limiter.
+    HAS:  a bucket of up to 'burst' tokens that refills at 'rate' tokens/sec
+    DOES: acquire() takes a token, sleeping until one is available.
+          Callers that have to wait reserve their token up front (the bucket
+          goes negative), so waiting threads are served in the order they
+          arrived and nobody busy-waits.
+    """
+    def __init__(self, rate=1.0, burst=1):
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        if burst < 1:
+            raise ValueError('burst must be >= 1')
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._clock = time.monotonic
+        self._sleep = time.sleep
+        self._ts_last = self._clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._ts_last
+        if elapsed > 0:
+            self._tokens = min(self._burst, self._tokens + elapsed*self._rate)
+            self._ts_last = now
+
+    def acquire(self, tokens=1):
+        """ Take 'tokens' tokens from the bucket, sleeping if need be.
+            Return the number of seconds slept.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def reserve(self, tokens=1):
+        """ Take 'tokens' tokens from the bucket w/o sleeping.
+            Return the number of seconds until they are really available.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def setRate(self, rate):
+        """ Change the refill rate (tokens/sec) from now on
+        """
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        with self._lock:
+            self._setRate(rate)
+
+    def _setRate(self, rate):
+        # caller holds self._lock
+        self._refill(self._clock())
+        self._rate = float(rate)
+
+    def pause(self, seconds):
+        """ Make sure no tokens are handed out for 'seconds' from now
+            (e.g., the API sent Retry-After). Tokens already reserved by
+            waiting callers are not moved earlier.
+        """
+        with self._lock:
+            self._pause(seconds)
+
+    def _pause(self, seconds):
+        # caller holds self._lock
+        self._refill(self._clock())
+        # the next token becomes available exactly 'seconds' from now
+        self._tokens = min(self._tokens, 1 - seconds*self._rate)
+
+    def getRate(self):     return self._rate
+    def getBurst(self):    return self._burst
+# end class TokenBucketLimiter -------------------------
+
+class AdaptiveRateLimiter(TokenBucketLimiter):
+    """
+    IS:   a token bucket rate limiter that adapts its rate to the API.
+    HAS:  the current rate, which stays between minRate and maxRate
+    DOES: additive increase/multiplicative decrease:
+          onThrottled(delay) - we got a 429. Pause everyone for 'delay' secs
+                                and multiply the rate by 'decrease'
+          onSuccess()        - add 'increase' req/sec, up to maxRate
+          onQuota(remaining, resetIn) - we have 'remaining' requests until
+                                the quota resets in 'resetIn' secs. Pause
+                                until then if there are none. If the reset
+                                is within quotaWindow secs, cap the rate so
+                                they last.
+          (Elsevier's X-RateLimit-* headers are the key's weekly quota: a
+          reset days away says nothing about our req/sec, so capping to
+          remaining/resetIn would crawl at minRate.)
+    """
+    def __init__(self, rate=1.0, burst=1,
+                minRate=None,       # default rate/20
+                maxRate=None,       # default: rate
+                decrease=0.5,       # multiply rate by this on a 429
+                increase=0.02,      # add this to the rate on each success
+                quotaWindow=60.0,   # only a quota that resets within this
+                                    #  many secs caps the rate
+                ):
+        super().__init__(rate=rate, burst=burst)
+        self._maxRate = float(maxRate if maxRate is not None else rate)
+        self._minRate = float(minRate if minRate is not None else rate/20.0)
+        self._decrease = decrease
+        self._increase = increase
+        self._quotaWindow = quotaWindow
+        self._quotaRate = None      # max rate allowed by the quota headers
+
+    def _ceiling(self):
+        if self._quotaRate is None:
+            return self._maxRate
+        return max(self._minRate, min(self._maxRate, self._quotaRate))
+
+    # These read-modify-write the rate under the bucket's lock, so feedback
+    #  from concurrent requests (e.g., several 429s at once) isn't lost or
+    #  applied to a stale rate.
+    def onThrottled(self, delay=0.0):
+        """ The API said we're going too fast (HTTP 429)
+        """
+        with self._lock:
+            self._setRate(max(self._minRate, self._rate * self._decrease))
+            if delay > 0:
+                self._pause(delay)
+
+    def onSuccess(self):
+        """ A request succeeded, speed up a little (up to the ceiling)
+        """
+        with self._lock:
+            newRate = min(self._ceiling(), self._rate + self._increase)
+            if newRate != self._rate:
+                self._setRate(newRate)
+
+    def onQuota(self, remaining, resetIn):
+        """ The API says we have 'remaining' requests for the next 'resetIn'
+            secs. Either may be None if we don't know.
+        """
+        if remaining is None or resetIn is None:
+            return
+        with self._lock:
+            if remaining <= 0:
+                self._pause(resetIn)
+                return
+            if resetIn > self._quotaWindow:     # e.g., the weekly quota
+                self._quotaRate = None
+                return
+            self._quotaRate = remaining / max(resetIn, 1.0)
+            if self._rate > self._ceiling():
+                self._setRate(self._ceiling())
+
+    def setMaxRate(self, maxRate):
+        """ Change the max rate (e.g., our share of a budget shared w/
+            other hosts changed). The rate drops to it right away if it is
+            over, and creeps up to it (onSuccess()) if under.
+        """
+        if maxRate <= 0:
+            raise ValueError('maxRate must be > 0')
+        with self._lock:
+            self._maxRate = float(maxRate)
+            self._minRate = min(self._minRate, self._maxRate)
+            if self._rate > self._ceiling():
+                self._setRate(self._ceiling())
+
+    def getMinRate(self):  return self._minRate
+    def getMaxRate(self):  return self._maxRate
+# end class AdaptiveRateLimiter -------------------------
+
+class SlidingWindowLimiter(object):
+    """
+    IS:   a thread safe sliding window rate limiter.
+    HAS:  the send times of the requests in the current window
+    DOES: acquire() sleeps until there have been fewer than 'maxRequests'
+          requests in the previous 'window' seconds.
+    """
+    def __init__(self, maxRequests=1, window=1.0):
+        if maxRequests < 1:
+            raise ValueError('maxRequests must be >= 1')
+        if window <= 0:
+            raise ValueError('window must be > 0')
+        self._maxRequests = maxRequests
+        self._window = float(window)
+        self._sendTimes = collections.deque()  # reserved send times, sorted
+        self._clock = time.monotonic
+        self._sleep = time.sleep
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """ Reserve the next send time(s) in the window, sleeping until then.
+            Return the number of seconds slept.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def reserve(self, tokens=1):
+        """ Reserve the next send time(s) in the window w/o sleeping.
+            Return the number of seconds until the (last) reserved send time.
+        """
+        with self._lock:
+            now = self._clock()
+            while self._sendTimes and self._sendTimes[0] <= now-self._window:
+                self._sendTimes.popleft()
+            sendTime = now
+            for i in range(tokens):
+                if len(self._sendTimes) >= self._maxRequests:
+                    earliest = self._sendTimes[-self._maxRequests]
+                    sendTime = max(sendTime, earliest + self._window)
+                self._sendTimes.append(sendTime)
+        return max(sendTime - now, 0.0)
+
+    def getRate(self):     return self._maxRequests / self._window
+# end class SlidingWindowLimiter -------------------------
+
+class SqliteRateLimiter(object):
+    """
+    IS:   a token bucket rate limiter shared across processes on one host.
+    HAS:  the path to an SQLite database file that holds the bucket state.
+          Several buckets can live in one file, each identified by 'name'.
+    DOES: acquire() reserves a token inside an immediate (write locking)
+          transaction so concurrent processes never hand out the same token.
+          Uses wall clock time since monotonic clocks aren't comparable
+          across processes.
+    """
+    def __init__(self, dbPath, rate=1.0, burst=1, name='default',
+                lockTimeout=30):  # seconds to wait for the sqlite lock
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        if burst < 1:
+            raise ValueError('burst must be >= 1')
+        self._dbPath = dbPath
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._name = name
+        self._lockTimeout = lockTimeout
+        self._clock = time.time
+        self._sleep = time.sleep
+
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS rate_buckets (
+                                name   TEXT PRIMARY KEY,
+                                tokens REAL NOT NULL,
+                                ts     REAL NOT NULL)''')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # isolation_level=None so we control the transactions ourselves
+        return sqlite3.connect(self._dbPath, timeout=self._lockTimeout,
+                                                        isolation_level=None)
+
+    def acquire(self, tokens=1):
+        """ Take 'tokens' tokens from the shared bucket, sleeping if need be.
+            Return the number of seconds slept.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def reserve(self, tokens=1):
+        """ Take 'tokens' tokens from the shared bucket w/o sleeping.
+            Return the number of seconds until they are really available.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            now = self._clock()
+            row = conn.execute('SELECT tokens, ts FROM rate_buckets ' +
+                                'WHERE name = ?', (self._name,)).fetchone()
+            if row is None:
+                available = self._burst
+            else:
+                available, ts_last = row
+                if now > ts_last:
+                    available = min(self._burst,
+                                        available + (now-ts_last)*self._rate)
+                else:       # another process' clock is ahead of ours
+                    now = ts_last
+            available -= tokens
+            conn.execute('INSERT OR REPLACE INTO rate_buckets ' +
+                            '(name, tokens, ts) VALUES (?, ?, ?)',
+                            (self._name, available, now))
+            conn.execute('COMMIT')
+        except:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if available < 0:
+            return -available / self._rate
+        return 0.0
+
+    def getRate(self):     return self._rate
+    def getBurst(self):    return self._burst
+    def getDbPath(self):   return self._dbPath
+# end class SqliteRateLimiter -------------------------
+
+class AsyncRateLimiter(object):
+    """
+    IS:   an asyncio front end to one of the limiters above.
+    DOES: acquire() reserves a slot from the wrapped limiter and
+          asyncio.sleep()s until then, so it doesn't block the event loop.
+          Wrapping the limiter a threaded ElsClient uses makes the two share
+          one request budget.
+    """
+    def __init__(self, limiter):
+        self._limiter = limiter
+
+    async def acquire(self, tokens=1):
+        """ Wait (asynchronously) until a request may be sent.
+            Return the number of seconds waited.
+        """
+        wait = self._limiter.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def getRate(self):     return self._limiter.getRate()
+    def getLimiter(self):  return self._limiter
+# end class AsyncRateLimiter -------------------------
+
+## Limiters shared by all ElsClients in this process, keyed by API key
+_sharedLimiters = {}
+_sharedLimitersLock = threading.Lock()
+
+def getSharedLimiter(key, rate=1.0, burst=1):
+    """ Return the AdaptiveRateLimiter shared by everyone in this process that
+        asks for 'key' (typically the API key), creating it if need be.
+        rate & burst are only used if the limiter is created. rate is also
+        the max rate the limiter will adapt up to.
+    """
+    with _sharedLimitersLock:
+        limiter = _sharedLimiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(rate=rate, burst=burst)
+            _sharedLimiters[key] = limiter
+        return limiter
@@ -0,0 +1,289 @@
+"""Record/replay transport for ElsClient, so tests & benchmarks can run w/o
+    network access or API credentials.
+
+    An ElsClient sends its requests through a requests.Session (its
+    transport). These classes can stand in for that session:
+
+    RecordingSession sends the requests on a real session and saves each
+    request/response pair (status, response headers, json or pdf body, how
+    long it took) to a cassette: a directory of files.
+    ReplaySession serves the saved responses from a cassette w/o touching the
+    network.
+
+    Requests are matched by method, URL, body (the PUT query json) and
+    Accept header (the json details and the pdf of an article have the same
+    URL). Request headers are never saved, and the API key & institutional
+    token are scrubbed from the recorded responses (the API echoes them in
+    response headers), so cassettes can be committed. If the same request
+    was recorded several times
+    (e.g., a retry), the responses are replayed in the order they were
+    recorded, the last one repeating.
+
+    Replay is fast by default: replayClient() doesn't throttle and doesn't
+    wait. Pass throttle=True to use the normal rate limiter, and latency=True
+    to sleep as long as each recorded response took (to simulate the API in
+    benchmarks).
+
+Class Overview
+    class Cassette          - the directory of recorded interactions
+    class RecordingSession  - a requests.Session that records to a cassette
+    class ReplaySession     - a requests.Session that replays from a cassette
+    class CassetteResponse  - just enough of a requests.Response for ElsClient
+    class CassetteMiss      - raised when a request isn't in the cassette
+
+Functions
+    recordingClient(api_key, inst_token, cassetteDir, ...) - ElsClient that
+        talks to the API and records
+    replayClient(cassetteDir, throttle, latency, ...) - ElsClient that
+        replays
+"""
+
+import os, json, time, hashlib, threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from rateLimiter import NullRateLimiter
+from SciDirectLib import ElsClient, PDF_MAGIC
+
+SCRUBBED = 'SCRUBBED'      # replaces credentials in recorded responses
+
+class CassetteMiss(LookupError):
+    """ A request that isn't in the cassette """
+
+class CassetteResponse(object):
+    """
+    IS:   a recorded (or replayed) response
+    HAS:  status_code, headers, content (bytes), elapsed secs
+    DOES: the parts of a requests.Response that ElsClient uses
+    """
+    def __init__(self, status_code, headers, content, elapsed=0.0):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+    def close(self):
+        pass
+# end class CassetteResponse -------------------------
+
+class Cassette(object):
+    """
+    IS:   a directory of recorded request/response pairs
+    HAS:  one <key>.json file per distinct request (method, URL, body) w/ its
+          list of responses. Text (json) bodies are stored in the json file,
+          binary (pdf) bodies in <key>.<n>.bin files.
+    DOES: finds and saves recorded responses. Thread safe.
+    """
+    def __init__(self, dirPath):
+        self._dirPath = dirPath
+        self._lock = threading.Lock()
+
+    def _key(self, method, url, data, accept=None):
+        h = hashlib.sha256()
+        parts = [method.upper(), url, data or '']
+        if accept is not None:
+            parts.append(accept)
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            h.update(part + b'\0')
+        return h.hexdigest()[:24]
+
+    def _path(self, key):
+        return os.path.join(self._dirPath, key + '.json')
+
+    def _readRecord(self, key):
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def getResponses(self, method, url, data=None, accept=None):
+        """ Return the list of CassetteResponses recorded for the request
+            (empty if none)
+        """
+        key = self._key(method, url, data, accept)
+        with self._lock:
+            record = self._readRecord(key)
+        if record is None:
+            return []
+        responses = []
+        for rsp in record['responses']:
+            if rsp.get('bodyFile'):
+                with open(os.path.join(self._dirPath, rsp['bodyFile']),
+                                                                    'rb') as f:
+                    content = f.read()
+            else:
+                content = rsp['body'].encode('utf-8')
+            responses.append(CassetteResponse(rsp['status'], rsp['headers'],
+                                                content, rsp['elapsed']))
+        return responses
+
+    def addResponse(self, method, url, data, response, accept=None):
+        """ Save response (a CassetteResponse) as the next response to the
+            request
+        """
+        key = self._key(method, url, data, accept)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', errors='replace')
+        with self._lock:
+            os.makedirs(self._dirPath, exist_ok=True)
+            record = self._readRecord(key) or \
+                    {'method': method, 'url': url, 'data': data,
+                                            'accept': accept, 'responses': []}
+            rsp = {'status' : response.status_code,
+                   'headers': dict(response.headers),
+                   'elapsed': response.elapsed,
+                   'body'   : None,
+                   'bodyFile': None}
+            contentType = response.headers.get('Content-Type', '')
+            isText = 'json' in contentType or 'text' in contentType \
+                                                    or not response.content
+            if isText:
+                try:
+                    rsp['body'] = response.content.decode('utf-8')
+                except UnicodeDecodeError:
+                    isText = False
+            if not isText:
+                rsp['bodyFile'] = '%s.%d.bin' % (key, len(record['responses']))
+                with open(os.path.join(self._dirPath, rsp['bodyFile']),
+                                                                    'wb') as f:
+                    f.write(response.content)
+            record['responses'].append(rsp)
+            tmpPath = self._path(key) + '.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump(record, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, self._path(key))
+
+    def getDirPath(self):   return self._dirPath
+# end class Cassette -------------------------
+
+class RecordingSession(object):
+    """
+    IS:   a stand in for requests.Session that records
+    HAS:  a real requests.Session, a Cassette, the secrets to scrub
+    DOES: sends each request on the real session, saves the response to the
+          cassette (w/ the secrets replaced by SCRUBBED) and returns it (as a
+          CassetteResponse, already read, not scrubbed)
+    """
+    def __init__(self, cassetteDir, session=None,
+                secrets=(),         # strings (API key, ...) not to record
+                ):
+        self._cassette = Cassette(cassetteDir)
+        self._session = session if session is not None else requests.Session()
+        self._secrets = [s for s in secrets if s]
+        self.headers = self._session.headers
+
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        kwargs['stream'] = False        # we record the whole body
+        start = time.monotonic()
+        r = self._session.request(method, url, headers=headers, data=data,
+                                                                    **kwargs)
+        response = CassetteResponse(r.status_code, r.headers, r.content,
+                                                    time.monotonic() - start)
+        r.close()
+        self._cassette.addResponse(method, url, data, self._scrub(response),
+                                                        _accept(headers))
+        return response
+
+    def _scrub(self, response):
+        """ Return a copy of response w/o our secrets in its headers or (text)
+            body
+        """
+        if not self._secrets:
+            return response
+        headers = {name: self._scrubText(value)
+                                for name, value in response.headers.items()}
+        content = response.content
+        if not content.startswith(PDF_MAGIC):     # leave pdf bytes alone
+            for secret in self._secrets:
+                content = content.replace(secret.encode('utf-8'),
+                                                    SCRUBBED.encode('utf-8'))
+        return CassetteResponse(response.status_code, headers, content,
+                                                            response.elapsed)
+
+    def _scrubText(self, text):
+        for secret in self._secrets:
+            text = text.replace(secret, SCRUBBED)
+        return text
+
+    def close(self):
+        self._session.close()
+
+    def getCassette(self):  return self._cassette
+# end class RecordingSession -------------------------
+
+class ReplaySession(object):
+    """
+    IS:   a stand in for requests.Session that replays a cassette
+    HAS:  a Cassette, how many times each request has been replayed
+    DOES: returns the recorded responses, optionally sleeping for as long as
+          they took when they were recorded. Raises CassetteMiss for
+          requests that weren't recorded.
+    """
+    def __init__(self, cassetteDir, latency=False):
+        self._cassette = Cassette(cassetteDir)
+        self._latency = latency
+        self._counts = {}       # (method, url, data, accept) -> num times
+                                #  replayed
+        self._lock = threading.Lock()
+        self._sleep = time.sleep
+        self.headers = {}
+
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        responses = self._cassette.getResponses(method, url, data,
+                                                            _accept(headers))
+        if not responses:
+            raise CassetteMiss('no recorded response for %s %s %s' % \
+                                                    (method, url, data or ''))
+        requestId = (method, url, data, _accept(headers))
+        with self._lock:
+            n = self._counts.get(requestId, 0)
+            self._counts[requestId] = n + 1
+        response = responses[min(n, len(responses)-1)]
+        if self._latency and response.elapsed > 0:
+            self._sleep(response.elapsed)
+        return response
+
+    def close(self):
+        pass
+
+    def getCassette(self):  return self._cassette
+# end class ReplaySession -------------------------
+
+def _accept(headers):
+    """ Return the Accept header of request headers, None if none
+    """
+    return (headers or {}).get('Accept')
+
+def recordingClient(api_key, inst_token, cassetteDir, **kwargs):
+    """ Return an ElsClient that talks to the API and records every
+        request/response to the cassette in cassetteDir (w/o api_key &
+        inst_token). kwargs are passed to ElsClient()
+        (the client doesn't close the session, use getSession().close())
+    """
+    session = RecordingSession(cassetteDir, secrets=(api_key, inst_token))
+    return ElsClient(api_key, inst_token=inst_token, session=session, **kwargs)
+
+def replayClient(cassetteDir,
+                throttle=False,     # if True, use the normal rate limiter
+                latency=False,      # if True, take as long as the recording
+                api_key='replay', inst_token=None, **kwargs):
+    """ Return an ElsClient that replays the cassette in cassetteDir instead
+        of talking to the API. kwargs are passed to ElsClient()
+    """
+    if not throttle:
+        kwargs.setdefault('rateLimiter', NullRateLimiter())
+    session = ReplaySession(cassetteDir, latency=latency)
+    return ElsClient(api_key, inst_token=inst_token, session=session, **kwargs)
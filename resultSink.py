@@ -0,0 +1,64 @@
+"""Optional sinks for the raw search results a SciDirectSearch pulls down.
+
+    A SciDirectSearch w/ a resultSink passes each page of result records to
+    it as the page arrives from the API:
+        resultSink(search, records)
+    So a sink is just a callable, any function w/ that signature will do.
+    With no sink (the default) the results are not written anywhere.
+
+Class Overview
+    class JsonlResultSink
+    - appends each page's records, one json object per line, to a file per
+        search in a directory. Safe to share between concurrent searches.
+"""
+
+import os, json, itertools, threading, weakref
+
+class JsonlResultSink(object):
+    """
+    IS:   a result sink that writes JSON Lines files
+    HAS:  the directory to write to, a function that names each search's file
+    DOES: appends each page of records to its search's file.
+          The default file name is search_<process id>_<n>.jsonl, n counting
+          the searches this sink has seen.
+    """
+    def __init__(self, dirPath='.',
+                nameFunc=None,  # nameFunc(search) -> file name (in dirPath)
+                ):
+        self._dirPath = dirPath
+        self._nameFunc = nameFunc
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._paths = weakref.WeakKeyDictionary()   # search -> its file path
+
+    def __call__(self, search, records):
+        if not records:
+            return
+        text = ''.join(json.dumps(r) + '\n' for r in records)
+        with self._lock:
+            path = self._getPath(search)
+            with open(path, 'a') as f:
+                f.write(text)
+
+    def _getPath(self, search):
+        """ Return the file path for search. Call w/ self._lock held.
+        """
+        path = self._paths.get(search)
+        if path is None:
+            if self._nameFunc is not None:
+                name = self._nameFunc(search)
+            else:
+                name = 'search_%d_%d.jsonl' % (os.getpid(), next(self._counter))
+            os.makedirs(self._dirPath, exist_ok=True)
+            path = os.path.join(self._dirPath, name)
+            self._paths[search] = path
+        return path
+
+    def getPath(self, search):
+        """ Return the path of search's file (None if nothing written yet)
+        """
+        with self._lock:
+            return self._paths.get(search)
+
+    def getDirPath(self):   return self._dirPath
+# end class JsonlResultSink -------------------------
@@ -0,0 +1,124 @@
+"""Retry policies for requests to the Elsevier API.
+
+    An ElsClient asks its RetryPolicy what to do when a request fails with a
+    transient error (HTTP 429 RATE_LIMIT_EXCEEDED, 5xx, or a connection
+    error): whether to retry, and how long to wait first.
+
+    The wait is the server's Retry-After header if it sent one, otherwise an
+    exponential backoff (backoffBase * 2**attempt, capped at backoffMax) with
+    random jitter so concurrent workers don't all retry at the same moment.
+
+Class Overview
+    class RetryPolicy
+    - shouldRetry(attempt, statusCode, exception) - retry this failure?
+    - getDelay(attempt, headers)   - seconds to wait before the retry
+
+    NO_RETRIES - a RetryPolicy that never retries
+
+Functions
+    parseRetryAfter(value) - seconds to wait from a Retry-After header value
+    parseRateLimitHeaders(headers) - (remaining, seconds until reset) from
+        Elsevier's X-RateLimit-Remaining & X-RateLimit-Reset headers
+"""
+
+import time, random
+import email.utils
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class RetryPolicy(object):
+    """
+    IS:   a policy for retrying failed requests
+    HAS:  max number of retries, backoff params, which failures to retry
+    DOES: decides whether to retry and how long to wait
+    """
+    def __init__(self, maxRetries=3,
+                backoffBase=1.0,        # seconds to wait before 1st retry
+                backoffMax=60.0,        # max seconds of backoff
+                jitter=0.5,             # randomize backoff by +/- this frac
+                retryStatuses=RETRY_STATUSES,
+                retryExceptions=True,   # retry connection errors/timeouts
+                maxRetryAfter=600,      # don't wait longer than this for
+                ):                      #   a Retry-After, give up instead
+        self._maxRetries = maxRetries
+        self._backoffBase = backoffBase
+        self._backoffMax = backoffMax
+        self._jitter = jitter
+        self._retryStatuses = set(retryStatuses)
+        self._retryExceptions = retryExceptions
+        self._maxRetryAfter = maxRetryAfter
+        self._random = random.random
+
+    def shouldRetry(self, attempt, statusCode=None, exception=None,
+                                                                headers=None):
+        """ Return True if a request that failed on try number 'attempt'
+            (0 = the 1st try) w/ statusCode or exception should be retried.
+        """
+        if attempt >= self._maxRetries:
+            return False
+        if exception is not None:
+            return self._retryExceptions
+        if statusCode not in self._retryStatuses:
+            return False
+        retryAfter = parseRetryAfter((headers or {}).get('Retry-After'))
+        return retryAfter is None or retryAfter <= self._maxRetryAfter
+
+    def getDelay(self, attempt, headers=None):
+        """ Return the number of seconds to wait before retrying a request
+            that failed on try number 'attempt'
+        """
+        retryAfter = parseRetryAfter((headers or {}).get('Retry-After'))
+        if retryAfter is not None:
+            return retryAfter
+        delay = min(self._backoffMax, self._backoffBase * 2**attempt)
+        return delay * (1 + self._jitter * (2*self._random() - 1))
+
+    def getMaxRetries(self):    return self._maxRetries
+# end class RetryPolicy -------------------------
+
+NO_RETRIES = RetryPolicy(maxRetries=0)
+
+def parseRetryAfter(value, now=None):
+    """ Return the number of seconds to wait from a Retry-After header value
+        (either a number of seconds or an HTTP date), or None if there is
+        no (valid) value.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, when.timestamp() - now)
+
+def parseRateLimitHeaders(headers, now=None):
+    """ Return (remaining, resetIn) from Elsevier's X-RateLimit-Remaining
+        (num of requests left in the quota) & X-RateLimit-Reset (epoch secs
+        when the quota resets) response headers.
+        resetIn is the seconds from now until the reset.
+        Either is None if the header is missing or invalid.
+    """
+    remaining = resetIn = None
+    try:
+        remaining = int(headers.get('X-RateLimit-Remaining'))
+    except (TypeError, ValueError):
+        pass
+    try:
+        reset = float(headers.get('X-RateLimit-Reset'))
+        if reset > 1e11:            # in milliseconds
+            reset = reset / 1000.0
+        if now is None:
+            now = time.time()
+        resetIn = max(0.0, reset - now)
+    except (TypeError, ValueError):
+        pass
+    return remaining, resetIn
@@ -0,0 +1,491 @@
+"""Sharded harvests: several worker hosts share the work, and one API
+    request budget.
+
+    Our API key has one quota, but PDF downloads scale w/ more hosts (each
+    writing PDFs to its own local disk). A ShardCoordinator is a work queue
+    in an SQLite database file that all the workers can reach (on shared
+    storage, or on local disk for several processes on one box, e.g., in
+    tests). SQLite's file locking must work on that storage (it does on
+    local disks; on NFS it depends on the server and its lock daemon).
+
+    Work items are:
+        'journal' - a journal's search query. The worker that leases it runs
+                    the search and adds a 'pii' item per result
+        'pii'     - an article (its search result record). The worker that
+                    leases it gets its details & PDF
+    Items are unique by key (the query, the PII), so adding the same journal
+    from several hosts, or finding the same article again in a later run,
+    doesn't make more work.
+
+    Leases: lease() hands items to a worker for leaseSecs. The worker's
+    heartbeat() extends its leases, so a worker that dies loses its items
+    after leaseSecs and they are handed out again. An item that fails (or
+    whose lease runs out) maxAttempts times is marked failed.
+
+    Articles w/o a PMID yet: wait(item) puts a pii item aside (state
+    'waiting') instead of completing it, like a PendingPmidQueue but in the
+    shard db, so whichever worker runs after it is due rechecks it. Each
+    wait is twice as long as the last (from firstWait up to maxWait), and
+    after maxWaits the item fails. Waiting items don't keep a run from
+    finishing.
+
+    Budget: the workers take their requests from one token bucket in the
+    shard db (a SqliteRateLimiter at totalRate), so together they never go
+    over the key's rate, however many there are and whenever they join or
+    die. Within that, getBudgetShare(totalRate) is totalRate / the num of
+    live workers (those that have heartbeat within heartbeatTimeout secs),
+    and a ShardWorker keeps its AdaptiveRateLimiter's max rate at its share
+    so no worker hogs the bucket.
+
+Class Overview
+    class ShardCoordinator
+    - addItems(kind, [(key, payload), ...]), lease(worker, kind, limit),
+        complete(item), fail(item, error), wait(item), heartbeat(worker),
+        removeWorker(worker), getNumLiveWorkers(), getBudgetShare(totalRate),
+        isFinished(kind), getCounts()
+
+    class WorkItem
+    - a leased item: id, kind, key, payload, attempts, lease token
+
+    class ShardWorker
+    - one worker host: heartbeats in a background thread, adjusting its rate
+        limiter to its budget share. Use as a context manager.
+
+    class BudgetLimiter
+    - a worker's rate limiter for its ElsClient: its own adaptive limiter
+        and the shared token bucket
+
+Functions
+    runShard(worker, elsClient, processRefs, ...) - lease & do items until
+        there are none left
+    downloadPdfs(refs, pdfPathFunc, workers, knownIds, pdfStore) - a
+        processRefs that gets the refs' details and pdfs
+"""
+
+import json, time, uuid, threading, sqlite3
+from rateLimiter import AdaptiveRateLimiter, SqliteRateLimiter
+from pendingPmids import DAY
+from SciDirectLib import SciDirectSearch, SciDirectReference, \
+                            prefetchDetails, savePdfs
+
+READY, LEASED, WAITING, DONE, FAILED = \
+                            'ready', 'leased', 'waiting', 'done', 'failed'
+
+BUDGET_BUCKET = 'shard budget'  # the shared token bucket, in the shard db
+
+# the search result fields kept in a pii item (what SciDirectReference uses)
+RECORD_FIELDS = ('pii', 'doi', 'sourceTitle', 'title', 'loadDate',
+                                                            'publicationDate')
+
+class WorkItem(object):  # simple struct
+    def __init__(self, id, kind, key, payload, attempts, lease):
+        self.id = id
+        self.kind = kind            # 'journal' or 'pii'
+        self.key = key              # unique key (query key, PII)
+        self.payload = payload      # dict
+        self.attempts = attempts    # num of times leased (incl. this one)
+        self.lease = lease          # token of the lease we hold
+# end class WorkItem -------------------------
+
+class ShardCoordinator(object):
+    """
+    IS:   a work queue shared by worker hosts, in an SQLite database file
+    HAS:  work items w/ their state & leases, the workers' heartbeats
+    DOES: hands out items in leases, tracks the live workers and their
+          share of the request budget. Safe to share between threads and
+          processes.
+    """
+    def __init__(self, dbPath,
+                leaseSecs=300,          # how long a lease lasts w/o heartbeat
+                heartbeatTimeout=None,  # a worker is dead after this many
+                                        #  secs w/o a heartbeat (default:
+                                        #  leaseSecs)
+                maxAttempts=3,          # give up on an item after this many
+                firstWait=2*DAY,        # secs an item w/o a PMID first waits
+                backoff=2.0,            # each wait is this many times longer
+                maxWait=30*DAY,         # ... up to this
+                maxWaits=12,            # fail an item after this many waits
+                lockTimeout=60):        # seconds to wait for the sqlite lock
+        self._dbPath = dbPath
+        self._leaseSecs = leaseSecs
+        self._heartbeatTimeout = heartbeatTimeout or leaseSecs
+        self._maxAttempts = maxAttempts
+        self._firstWait = firstWait
+        self._backoff = backoff
+        self._maxWait = maxWait
+        self._maxWaits = maxWaits
+        self._clock = time.time
+        self._conn = sqlite3.connect(dbPath, timeout=lockTimeout,
+                                                    check_same_thread=False)
+        self._dbLock = threading.Lock()     # one connection, many threads
+        with self._dbLock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS items (
+                                    id          INTEGER PRIMARY KEY,
+                                    kind        TEXT NOT NULL,
+                                    key         TEXT NOT NULL,
+                                    payload     TEXT NOT NULL,
+                                    state       TEXT NOT NULL,
+                                    worker      TEXT,
+                                    lease       TEXT,
+                                    leaseUntil  REAL,
+                                    attempts    INTEGER NOT NULL,
+                                    waits       INTEGER NOT NULL DEFAULT 0,
+                                    notBefore   REAL,
+                                    error       TEXT,
+                                    UNIQUE (kind, key))''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS items_state
+                                    ON items (kind, state)''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS workers (
+                                    name          TEXT PRIMARY KEY,
+                                    lastHeartbeat REAL NOT NULL)''')
+
+    def addItems(self, kind, items):
+        """ Add work items: items = [(key, payload dict), ...]
+            Items whose key is already there (in any state) are skipped.
+            Return the num of items added.
+        """
+        rows = [(kind, key, json.dumps(payload), READY)
+                                                    for key, payload in items]
+        with self._dbLock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany('INSERT OR IGNORE INTO items ' +
+                    '(kind, key, payload, state, attempts) ' +
+                    'VALUES (?, ?, ?, ?, 0)', rows)
+            return self._conn.total_changes - before
+
+    def lease(self, worker, kind, limit=1):
+        """ Lease up to limit items of 'kind' to worker: ready items, items
+            whose lease ran out and waiting items that are due.
+            Return [WorkItem, ...]
+        """
+        now = self._clock()
+        token = uuid.uuid4().hex
+        with self._dbLock, self._conn:
+            # leases that ran out for the last time
+            self._conn.execute('UPDATE items SET state = ?, ' +
+                    "error = 'lease expired' WHERE kind = ? AND state = ? " +
+                    'AND leaseUntil < ? AND attempts >= ?',
+                    (FAILED, kind, LEASED, now, self._maxAttempts))
+            self._conn.execute('UPDATE items SET state = ?, worker = ?, ' +
+                    'lease = ?, leaseUntil = ?, attempts = attempts + 1 ' +
+                    'WHERE id IN (SELECT id FROM items WHERE kind = ? AND ' +
+                    '(state = ? OR (state = ? AND leaseUntil < ?) OR ' +
+                    '(state = ? AND notBefore <= ?)) ORDER BY id LIMIT ?)',
+                    (LEASED, worker, token, now + self._leaseSecs,
+                    kind, READY, LEASED, now, WAITING, now, limit))
+            rows = self._conn.execute('SELECT id, kind, key, payload, ' +
+                    'attempts FROM items WHERE lease = ? ORDER BY id',
+                    (token,)).fetchall()
+        return [WorkItem(id, kind, key, json.loads(payload), attempts, token)
+                            for id, kind, key, payload, attempts in rows]
+
+    def complete(self, item):
+        """ The leased item is done. Return False if we had lost its lease
+            (it ran out and someone else has the item now)
+        """
+        with self._dbLock, self._conn:
+            cursor = self._conn.execute('UPDATE items SET state = ?, ' +
+                    'leaseUntil = NULL WHERE id = ? AND lease = ? AND ' +
+                    'state = ?', (DONE, item.id, item.lease, LEASED))
+            return cursor.rowcount == 1
+
+    def fail(self, item, error):
+        """ The leased item failed w/ error. It is retried (by whoever leases
+            it next) unless it has had maxAttempts.
+            Return False if we had lost its lease.
+        """
+        state = FAILED if item.attempts >= self._maxAttempts else READY
+        with self._dbLock, self._conn:
+            cursor = self._conn.execute('UPDATE items SET state = ?, ' +
+                    'error = ?, worker = NULL, leaseUntil = NULL ' +
+                    'WHERE id = ? AND lease = ? AND state = ?',
+                    (state, str(error), item.id, item.lease, LEASED))
+            return cursor.rowcount == 1
+
+    def wait(self, item):
+        """ The leased item's article has no PMID yet: put it aside until
+            it is due for a recheck (it is leased again then, w/ fresh
+            attempts). After maxWaits it fails.
+            Return False if we had lost its lease.
+        """
+        with self._dbLock, self._conn:
+            row = self._conn.execute('SELECT waits FROM items WHERE id = ? ' +
+                    'AND lease = ? AND state = ?',
+                    (item.id, item.lease, LEASED)).fetchone()
+            if row is None:
+                return False
+            waits = row[0]
+            if waits >= self._maxWaits:
+                self._conn.execute('UPDATE items SET state = ?, ' +
+                    "error = 'no PMID', worker = NULL, leaseUntil = NULL " +
+                    'WHERE id = ?', (FAILED, item.id))
+            else:
+                delay = min(self._maxWait,
+                                    self._firstWait * self._backoff**waits)
+                self._conn.execute('UPDATE items SET state = ?, ' +
+                    'worker = NULL, leaseUntil = NULL, attempts = 0, ' +
+                    'waits = waits + 1, notBefore = ? WHERE id = ?',
+                    (WAITING, self._clock() + delay, item.id))
+            return True
+
+    def heartbeat(self, worker):
+        """ worker is alive: record it and extend its leases
+        """
+        now = self._clock()
+        with self._dbLock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO workers ' +
+                    '(name, lastHeartbeat) VALUES (?, ?)', (worker, now))
+            self._conn.execute('UPDATE items SET leaseUntil = ? ' +
+                    'WHERE worker = ? AND state = ?',
+                    (now + self._leaseSecs, worker, LEASED))
+
+    def removeWorker(self, worker):
+        """ worker is stopping: forget it and hand its leased items back
+        """
+        with self._dbLock, self._conn:
+            self._conn.execute('DELETE FROM workers WHERE name = ?',
+                                                                    (worker,))
+            self._conn.execute('UPDATE items SET state = ?, worker = NULL, ' +
+                    'leaseUntil = NULL, attempts = attempts - 1 ' +
+                    'WHERE worker = ? AND state = ?', (READY, worker, LEASED))
+
+    def getNumLiveWorkers(self):
+        since = self._clock() - self._heartbeatTimeout
+        with self._dbLock:
+            return self._conn.execute('SELECT COUNT(*) FROM workers ' +
+                            'WHERE lastHeartbeat >= ?', (since,)).fetchone()[0]
+
+    def getBudgetShare(self, totalRate):
+        """ Return one live worker's share of totalRate (requests/sec)
+        """
+        return totalRate / max(1, self.getNumLiveWorkers())
+
+    def isFinished(self, kind=None):
+        """ Return True if no items (of kind, if given) are ready or leased
+            (waiting items are for a later run)
+        """
+        sql = 'SELECT 1 FROM items WHERE state IN (?, ?)'
+        params = [READY, LEASED]
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        with self._dbLock:
+            return self._conn.execute(sql + ' LIMIT 1',
+                                                params).fetchone() is None
+
+    def getCounts(self):
+        """ Return {kind: {state: num of items}}
+        """
+        with self._dbLock:
+            rows = self._conn.execute('SELECT kind, state, COUNT(*) FROM ' +
+                                    'items GROUP BY kind, state').fetchall()
+        counts = {}
+        for kind, state, n in rows:
+            counts.setdefault(kind, {})[state] = n
+        return counts
+
+    def getFailed(self, kind):
+        """ Return [(key, error), ...] of the failed items of kind
+        """
+        with self._dbLock:
+            return self._conn.execute('SELECT key, error FROM items WHERE ' +
+                    'kind = ? AND state = ? ORDER BY id',
+                    (kind, FAILED)).fetchall()
+
+    def close(self):
+        with self._dbLock:
+            self._conn.close()
+
+    def getDbPath(self):    return self._dbPath
+# end class ShardCoordinator -------------------------
+
+class ShardWorker(object):
+    """
+    IS:   one worker (host/process) of a sharded harvest
+    HAS:  its name, the ShardCoordinator, the total request rate of the API
+          key, its AdaptiveRateLimiter, its BudgetLimiter (for its ElsClient)
+    DOES: heartbeats every heartbeatSecs in a background thread, keeping its
+          limiter's max rate at its share of totalRate.
+          start()/stop(), or use it in a "with" block.
+    """
+    def __init__(self, coordinator, name,
+                totalRate=1.0,      # requests/sec allowed for the API key
+                heartbeatSecs=30,   # should be well under the leaseSecs
+                limiter=None,       # default: a new AdaptiveRateLimiter
+                ):
+        self._coordinator = coordinator
+        self._name = name
+        self._totalRate = totalRate
+        self._heartbeatSecs = heartbeatSecs
+        self._limiter = limiter or AdaptiveRateLimiter(rate=totalRate)
+        self._budgetLimiter = BudgetLimiter(self._limiter,
+                        SqliteRateLimiter(coordinator.getDbPath(),
+                                        rate=totalRate, name=BUDGET_BUCKET))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.beat()
+        self._thread = threading.Thread(target=self._run,
+                                name='heartbeat-%s' % self._name, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self._heartbeatSecs):
+            self.beat()
+
+    def beat(self):
+        """ Heartbeat, update our share of the budget. Return the share.
+        """
+        self._coordinator.heartbeat(self._name)
+        share = self._coordinator.getBudgetShare(self._totalRate)
+        self._limiter.setMaxRate(share)
+        return share
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._coordinator.removeWorker(self._name)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def getName(self):          return self._name
+    def getLimiter(self):       return self._limiter
+    def getBudgetLimiter(self): return self._budgetLimiter
+    def getCoordinator(self):   return self._coordinator
+# end class ShardWorker -------------------------
+
+class BudgetLimiter(object):
+    """
+    IS:   a worker's rate limiter, usable as its ElsClient's rateLimiter
+    HAS:  the worker's own (adaptive) limiter, the token bucket all the
+          workers share
+    DOES: acquire() waits for both, so the workers together stay within the
+          total rate even before their shares catch up w/ a worker joining.
+          Adaptive feedback (onThrottled(), etc.) goes to the worker's own
+          limiter.
+    """
+    _FORWARDED = ('onThrottled', 'onSuccess', 'onQuota', 'pause',
+                                                                'setMaxRate')
+
+    def __init__(self, limiter, sharedLimiter):
+        self._limiter = limiter
+        self._sharedLimiter = sharedLimiter
+
+    def acquire(self, tokens=1):
+        waited = self._limiter.acquire(tokens)
+        return waited + self._sharedLimiter.acquire(tokens)
+
+    def reserve(self, tokens=1):
+        return max(self._limiter.reserve(tokens),
+                                        self._sharedLimiter.reserve(tokens))
+
+    def __getattr__(self, name):
+        if name in BudgetLimiter._FORWARDED:
+            return getattr(self._limiter, name)
+        raise AttributeError(name)
+
+    def getRate(self):
+        return min(self._limiter.getRate(), self._sharedLimiter.getRate())
+
+    def getLimiter(self):       return self._limiter
+    def getSharedLimiter(self): return self._sharedLimiter
+# end class BudgetLimiter -------------------------
+
+def runShard(worker, elsClient,
+            processRefs,        # processRefs(refs) -> ({pii: exception},
+                                #   {PIIs of the refs w/o a PMID yet}),
+                                #   None = just search (e.g., debugging)
+            batchSize=20,       # num of pii items to lease at a time
+            idleSecs=5,         # wait when others still hold leased items
+            **searchArgs,       # for SciDirectSearch, e.g., maxResults
+            ):
+    """ Do work items until there are none left: run the searches of the
+        journal items (adding a pii item per result), and processRefs() the
+        pii items' references. The ones w/o a PMID yet wait in the shard db.
+        W/o processRefs, the pii items are left for a later run.
+        elsClient should use worker.getBudgetLimiter() as its rate limiter.
+        Return {'journals': num searched, 'piis': num done,
+                'waiting': num w/o a PMID yet, 'failed': num}
+    """
+    coordinator = worker.getCoordinator()
+    name = worker.getName()
+    counts = {'journals': 0, 'piis': 0, 'waiting': 0, 'failed': 0}
+    while True:
+        items = coordinator.lease(name, 'journal', 1)
+        for item in items:
+            try:
+                args = dict(getAll=True)
+                args.update(searchArgs)
+                search = SciDirectSearch(elsClient, item.payload['query'],
+                                                            **args).execute()
+                coordinator.addItems('pii', [(r['pii'],
+                            {'journal': item.key, 'record': _trimRecord(r)})
+                            for r in search.getResults()])
+                coordinator.complete(item)
+                counts['journals'] += 1
+            except Exception as e:
+                coordinator.fail(item, e)
+                counts['failed'] += 1
+        if items:
+            continue
+
+        items = []
+        if processRefs is not None:
+            items = coordinator.lease(name, 'pii', batchSize)
+        if items:
+            refs = [SciDirectReference(elsClient, item.payload['record'],
+                                                compact=True) for item in items]
+            failures, noPmids = processRefs(refs)
+            for item in items:
+                if item.key in failures:
+                    coordinator.fail(item, failures[item.key])
+                    counts['failed'] += 1
+                elif item.key in noPmids:
+                    coordinator.wait(item)
+                    counts['waiting'] += 1
+                else:
+                    coordinator.complete(item)
+                    counts['piis'] += 1
+            continue
+
+        if coordinator.isFinished('journal' if processRefs is None else None):
+            return counts
+        time.sleep(idleSecs)    # others' leases may run out & come back
+
+def _trimRecord(record):
+    """ Return the search result fields SciDirectReference needs
+    """
+    return {k: record.get(k) for k in RECORD_FIELDS}
+
+def downloadPdfs(refs, pdfPathFunc, workers=4, knownIds=None, pdfStore=None):
+    """ processRefs for runShard(): get the refs' details, stream the pdfs
+        of the ones w/ PMIDs to pdfPathFunc(ref) (or into pdfStore, a
+        PdfStore, if given).
+        If knownIds (a KnownIdFilter), the refs w/ known PMIDs are skipped.
+        Return ({pii: exception} for the refs that failed,
+                {PIIs of the refs w/o PMIDs})
+    """
+    failures = prefetchDetails(refs, workers=workers)
+    pdfRefs = []
+    noPmids = set()
+    for r in refs:
+        if r.getPii() in failures:
+            continue
+        if r.getPmid() == 'no PMID':
+            noPmids.add(r.getPii())
+        elif knownIds is None or not knownIds.skipByPmid(r):
+            pdfRefs.append(r)
+    if pdfStore is not None:
+        failures.update(pdfStore.savePdfs(pdfRefs, workers=workers))
+    else:
+        failures.update(savePdfs(pdfRefs, pdfPathFunc, workers=workers))
+    return failures, noPmids
@@ -4,6 +4,13 @@
 These are tests for SciDirectLib.py
 
 Usage:   python test_SciDirectLib.py [-v]
+
+With ELSEVIER_APIKEY & ELSEVIER_INSTTOKEN in the environment, these talk to
+    the real API. Add ELSEVIER_RECORD=1 to also record the requests/responses
+    to the cassette in cassettes/SciDirectLib (see recordReplay.py).
+W/o them (or w/ ELSEVIER_REPLAY=1), the cassette is replayed instead: no
+    network, no credentials, no throttling. If there is no cassette, the
+    tests are skipped.
 """
 import sys
 import unittest
@@ -12,14 +19,27 @@ import os.path
 import json
 import requests
 import SciDirectLib as sdl
+import recordReplay
 
 ## Initialize Elsevier API client
-apikey = os.environ['ELSEVIER_APIKEY']
-insttoken = os.environ['ELSEVIER_INSTTOKEN']
-elsClient = sdl.ElsClient(apikey, inst_token=insttoken)
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                'cassettes', 'SciDirectLib')
+apikey = os.environ.get('ELSEVIER_APIKEY')
+insttoken = os.environ.get('ELSEVIER_INSTTOKEN')
+elsClient = None
+if apikey and not os.environ.get('ELSEVIER_REPLAY'):
+    if os.environ.get('ELSEVIER_RECORD'):
+        elsClient = recordReplay.recordingClient(apikey, insttoken,
+                                                                CASSETTE_DIR)
+    else:
+        elsClient = sdl.ElsClient(apikey, inst_token=insttoken)
+elif os.path.isdir(CASSETTE_DIR):
+    elsClient = recordReplay.replayClient(CASSETTE_DIR)
+skipReason = 'no ELSEVIER_APIKEY and no recorded cassette in ' + CASSETTE_DIR
 
 ######################################
 
+@unittest.skipIf(elsClient is None, skipReason)
 class ElsClient_tests(unittest.TestCase):
     def test_execGetRequest_badContentType(self):
         url = sdl.url_base + 'content/article/pii/'
@@ -67,6 +87,7 @@ class ElsClient_tests(unittest.TestCase):
 
 # end class ElsClient_tests ######################################
 
+@unittest.skipIf(elsClient is None, skipReason)
 class SciDirectSearch_tests(unittest.TestCase):
 
     def test_basicSearch(self):
@@ -141,6 +162,7 @@ class SciDirectSearch_tests(unittest.TestCase):
 
 # end class SciDirecSearch_tests ######################################
 
+@unittest.skipIf(elsClient is None, skipReason)
 class SciDirectReference_tests(unittest.TestCase):
     ref1Data = {      # taken from SciDirect search results. PMID 33417945
         "authors": [
@@ -0,0 +1,953 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for SciDirectLib.py that do not talk to the real API.
+They use a fake requests.Session that returns canned responses, so they
+    don't need ELSEVIER_APIKEY/ELSEVIER_INSTTOKEN or network access.
+
+Usage:   python test_SciDirectLib_offline.py [-v]
+"""
+import unittest
+import asyncio
+import json
+import os
+import time
+import tempfile
+import hashlib
+import requests
+import SciDirectLib as sdl
+import rateLimiter
+import metadataCache
+import retryPolicy
+import querySplit
+
+######################################
+
+class FakeResponse(object):
+    """ Just enough of a requests.Response for ElsClient
+    """
+    def __init__(self, status_code=200, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.chunkSizes = []    # chunk sizes iter_content() was asked for
+    @property
+    def text(self): return self.content.decode('utf-8')
+    def json(self): return json.loads(self.content)
+    def iter_content(self, chunk_size=1):
+        self.chunkSizes.append(chunk_size)
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+    def close(self): pass
+
+class FakeSession(object):
+    """ Stand in for requests.Session. Records requests it is sent and
+        returns responses from a list (or a function of the request)
+    """
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.requests = []      # (method, url, headers, data) sent
+        self.closed = False
+        self.headers = {}
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        self.requests.append((method, url, headers, data))
+        r = self.responses.pop(0)
+        if callable(r):
+            r = r(method, url, headers, data)
+        return r
+    def close(self): self.closed = True
+
+class FakeAsyncResponse(object):
+    """ Just enough of an aiohttp response for AsyncElsClient
+    """
+    def __init__(self, fakeResponse):
+        self.status = fakeResponse.status_code
+        self.headers = fakeResponse.headers
+        self._content = fakeResponse.content
+        self.content = self     # aiohttp streams the body via r.content
+    async def read(self): return self._content
+    async def iter_chunked(self, n):
+        for i in range(0, len(self._content), n):
+            yield self._content[i:i+n]
+    def release(self): pass
+    def __await__(self):
+        async def response(): return self
+        return response().__await__()
+
+class FakeAsyncSession(FakeSession):
+    """ Stand in for aiohttp.ClientSession, responses are FakeResponses
+    """
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        r = FakeSession.request(self, method, url, headers, data)
+        return FakeAsyncResponse(r)
+    async def close(self): self.closed = True
+
+def jsonResponse(payload, status_code=200):
+    return FakeResponse(status_code, json.dumps(payload).encode('utf-8'))
+
+def detailsResponse(pii, pmid='12345'):
+    """ Return a FakeResponse like the API's ?view=META response for pii
+    """
+    return jsonResponse({'full-text-retrieval-response': {
+                'pubmed-id': pmid,
+                'coredata' : {'pii': pii, 'pubType': 'fla',
+                              'prism:volume': '7'},
+                }})
+
+def searchResult(pii, journal='Bone'):
+    """ Return a search result record like the API returns for pii
+    """
+    return {'pii': pii, 'doi': '10.1016/%s' % pii, 'sourceTitle': journal,
+            'title': 'title %s' % pii, 'loadDate': '2021-01-05T00:00:00.000Z',
+            'publicationDate': '2021-03-15'}
+
+class tempCwd(object):
+    """ Context manager: run in a temporary current directory
+        (so files the code under test writes are cleaned up)
+    """
+    def __enter__(self):
+        self.oldCwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        return self.tmpdir.name
+    def __exit__(self, *args):
+        os.chdir(self.oldCwd)
+        self.tmpdir.cleanup()
+        return False
+
+def fakeClient(responses=None, **kwargs):
+    """ Return an ElsClient w/ a FakeSession, no throttling and no retries
+    """
+    kwargs.setdefault('rateLimiter', rateLimiter.NullRateLimiter())
+    kwargs.setdefault('retryPolicy', retryPolicy.NO_RETRIES)
+    return sdl.ElsClient('key', session=FakeSession(responses), **kwargs)
+
+######################################
+
+class ElsClient_session_tests(unittest.TestCase):
+
+    def test_ownsPooledSession(self):
+        client = sdl.ElsClient('key', poolSize=4)
+        session = client.getSession()
+        self.assertIsInstance(session, requests.Session)
+        adapter = session.get_adapter(sdl.url_base)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        client.close()
+        self.assertIsNone(client.getSession())
+
+    def test_contextManager_closesOnlyOwnedSession(self):
+        session = FakeSession()
+        with sdl.ElsClient('key', session=session) as client:
+            self.assertIs(client.getSession(), session)
+        self.assertFalse(session.closed)
+        self.assertRaises(ValueError, client.execGetRequest, sdl.url_base)
+
+    def test_headers(self):
+        client = fakeClient([jsonResponse({'a': 1}),
+                             FakeResponse(content=b'%PDF-1.7')],
+                             inst_token='tok')
+        session = client.getSession()
+        self.assertEqual(client.execGetRequest(sdl.url_base), {'a': 1})
+        self.assertEqual(client.execGetRequest(sdl.url_base, 'pdf'),
+                                                                b'%PDF-1.7')
+        jsonHeaders = session.requests[0][2]
+        pdfHeaders = session.requests[1][2]
+        self.assertEqual(jsonHeaders['X-ELS-APIKey'], 'key')
+        self.assertEqual(jsonHeaders['X-ELS-Insttoken'], 'tok')
+        self.assertEqual(jsonHeaders['Accept-Encoding'], 'gzip, deflate')
+        self.assertEqual(pdfHeaders['Accept'], 'application/pdf')
+        self.assertEqual(pdfHeaders['Accept-Encoding'], 'identity')
+
+    def test_noKeepAlive(self):
+        client = fakeClient([jsonResponse({})], keepAlive=False)
+        client.execPutRequest(sdl.url_base, '{}')
+        self.assertEqual(client.getSession().requests[0][2]['Connection'],
+                                                                    'close')
+
+    def test_httpError(self):
+        client = fakeClient([FakeResponse(404, b'not found')])
+        self.assertRaises(requests.HTTPError, client.execGetRequest,
+                                                                sdl.url_base)
+        self.assertEqual(client.getRequestStatus()['status_code'], 404)
+
+# end class ElsClient_session_tests ######################################
+
+class ElsClient_rateLimiter_tests(unittest.TestCase):
+
+    def test_sameKeySharesLimiter(self):
+        c1 = sdl.ElsClient('shared-key', session=FakeSession())
+        c2 = sdl.ElsClient('shared-key', session=FakeSession())
+        c3 = sdl.ElsClient('other-key', session=FakeSession())
+        self.assertIs(c1.getRateLimiter(), c2.getRateLimiter())
+        self.assertIsNot(c1.getRateLimiter(), c3.getRateLimiter())
+        self.assertEqual(c1.getRateLimiter().getRate(), 1.0)
+
+    def test_limiterCalledPerRequest(self):
+        class CountingLimiter(object):
+            n = 0
+            def acquire(self, tokens=1):
+                self.n += 1
+                return 0.0
+        limiter = CountingLimiter()
+        client = fakeClient([jsonResponse({}), jsonResponse({})],
+                                                        rateLimiter=limiter)
+        client.execGetRequest(sdl.url_base)
+        client.execPutRequest(sdl.url_base, '{}')
+        self.assertEqual(limiter.n, 2)
+
+# end class ElsClient_rateLimiter_tests ######################################
+
+class ElsClient_retry_tests(unittest.TestCase):
+
+    noWait = retryPolicy.RetryPolicy(maxRetries=2, backoffBase=0)
+
+    def test_retriesTransientErrors(self):
+        client = fakeClient([FakeResponse(503, b'busy'),
+                             FakeResponse(502, b'bad gateway'),
+                             jsonResponse({'a': 1})], retryPolicy=self.noWait)
+        self.assertEqual(client.execGetRequest(sdl.url_base), {'a': 1})
+        self.assertEqual(client.getNumRetries(), 2)
+
+    def test_givesUp(self):
+        client = fakeClient([FakeResponse(503, b'busy')]*3,
+                                                    retryPolicy=self.noWait)
+        self.assertRaises(requests.HTTPError, client.execPutRequest,
+                                                            sdl.url_base, '{}')
+        self.assertEqual(len(client.getSession().requests), 3)
+
+    def test_noRetryOn404(self):
+        client = fakeClient([FakeResponse(404, b'nope')],
+                                                    retryPolicy=self.noWait)
+        self.assertRaises(requests.HTTPError, client.execGetRequest,
+                                                                sdl.url_base)
+        self.assertEqual(client.getNumRetries(), 0)
+
+    def test_connectionError(self):
+        def refuse(method, url, headers, data):
+            raise requests.ConnectionError('connection refused')
+        client = fakeClient([refuse, jsonResponse({'a': 1})],
+                                                    retryPolicy=self.noWait)
+        self.assertEqual(client.execGetRequest(sdl.url_base), {'a': 1})
+
+    def test_429ThrottlesSharedLimiter(self):
+        limiter = rateLimiter.AdaptiveRateLimiter(rate=4)
+        client = fakeClient([FakeResponse(429, b'RATE_LIMIT_EXCEEDED',
+                                            headers={'Retry-After': '0'}),
+                             jsonResponse({'a': 1})],
+                             rateLimiter=limiter, retryPolicy=self.noWait)
+        self.assertEqual(client.execGetRequest(sdl.url_base), {'a': 1})
+        self.assertEqual(limiter.getRate(), 2.02)   # halved, then +increase
+
+    def test_quotaHeaders(self):
+        limiter = rateLimiter.AdaptiveRateLimiter(rate=1)
+        resp = jsonResponse({'a': 1})
+        resp.headers = {'X-RateLimit-Remaining': '5',
+                        'X-RateLimit-Reset': str(time.time() + 50)}
+        client = fakeClient([resp], rateLimiter=limiter)
+        client.execGetRequest(sdl.url_base)
+        self.assertAlmostEqual(limiter.getRate(), 0.1, places=2)
+
+    def test_asyncRetries(self):
+        session = FakeAsyncSession([FakeResponse(503, b'busy'),
+                                    jsonResponse({'a': 1})])
+        client = sdl.AsyncElsClient('key', session=session,
+                                    rateLimiter=rateLimiter.NullRateLimiter(),
+                                    retryPolicy=self.noWait)
+        self.assertEqual(asyncio.run(client.execGetRequest(sdl.url_base)),
+                                                                    {'a': 1})
+        self.assertEqual(client.getNumRetries(), 1)
+
+# end class ElsClient_retry_tests ######################################
+
+class prefetch_tests(unittest.TestCase):
+
+    def respond(self, method, url, headers, data):
+        """ FakeSession responder: details or pdf for the pii in the url,
+            except pii 'bad' gets a 500 error
+        """
+        pii = url.split('/')[-1].split('?')[0]
+        if pii == 'bad':
+            return FakeResponse(500, b'server error')
+        if url.endswith('?view=META'):
+            return detailsResponse(pii, pmid=pii[-3:])
+        return FakeResponse(content=b'%PDF-1.7 ' + pii.encode())
+
+    def test_prefetchDetails(self):
+        piis = ['S%03d' % i for i in range(20)] + ['bad']
+        client = fakeClient([self.respond]*len(piis))
+        refs = [sdl.SciDirectReference(client, searchResult(p)) for p in piis]
+
+        failures = sdl.prefetchDetails(refs, workers=5)
+        self.assertEqual(list(failures.keys()), ['bad'])
+        self.assertIsInstance(failures['bad'], requests.HTTPError)
+
+        # all the others are loaded, no more requests needed
+        self.assertEqual([r.getPmid() for r in refs[:3]],
+                                                    ['000', '001', '002'])
+        self.assertEqual(len(client.getSession().requests), len(piis))
+
+    def test_prefetchPdfs(self):
+        piis = ['S001', 'bad', 'S002']
+        client = fakeClient([self.respond]*len(piis))
+        refs = [sdl.SciDirectReference(client, searchResult(p)) for p in piis]
+
+        failures = sdl.prefetchPdfs(refs, workers=3)
+        self.assertEqual(list(failures.keys()), ['bad'])
+        self.assertEqual(refs[2].getPdf(), b'%PDF-1.7 S002')
+
+# end class prefetch_tests ######################################
+
+def searchPage(piis, resultsFound):
+    return jsonResponse({'resultsFound': resultsFound,
+                            'results': [searchResult(p) for p in piis]})
+
+class SciDirectSearch_stream_tests(unittest.TestCase):
+
+    def test_pagesFetchedLazily(self):
+        client = fakeClient([searchPage(['S1', 'S2'], 5),
+                             searchPage(['S3', 'S4'], 5),
+                             searchPage(['S5'], 5)])
+        session = client.getSession()
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                        increment=2, stream=True).execute()
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(search.getTotalNumResults(), 5)
+
+        it = search.getIterator()
+        self.assertEqual([next(it).getPii() for i in range(2)], ['S1', 'S2'])
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(next(it).getPii(), 'S3')
+        self.assertEqual(len(session.requests), 2)
+        self.assertEqual(len(search.getResults()), 2)   # only current page
+        self.assertEqual([r.getPii() for r in it], ['S4', 'S5'])
+        self.assertEqual(search.getNumResults(), 5)
+        self.assertRaises(ValueError, search.getIterator)
+
+    def test_stopEarly(self):
+        client = fakeClient([searchPage(['S1', 'S2'], 100)])
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                        increment=2, stream=True).execute()
+        for r in search.getIterator():
+            break
+        self.assertEqual(len(client.getSession().requests), 1)
+
+    def test_maxResults(self):
+        client = fakeClient([searchPage(['S1', 'S2'], 100),
+                             searchPage(['S3', 'S4'], 100)])
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                            increment=2, maxResults=3, stream=True).execute()
+        self.assertEqual(len(list(search.getIterator())), 4)
+
+    def test_asyncStream(self):
+        session = FakeAsyncSession([searchPage(['S1'], 2),
+                                    searchPage(['S2'], 2)])
+        client = sdl.AsyncElsClient('key', session=session,
+                                    rateLimiter=rateLimiter.NullRateLimiter())
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                                    increment=1, stream=True)
+        async def run():
+            await search.executeAsync()
+            return [r.getPii() async for r in search.getAsyncIterator()]
+        self.assertEqual(asyncio.run(run()), ['S1', 'S2'])
+
+# end class SciDirectSearch_stream_tests ######################################
+
+class SciDirectSearch_resultSink_tests(unittest.TestCase):
+
+    def test_pagesPassedAsTheyArrive(self):
+        pages = []
+        def sink(search, records):
+            pages.append([r['pii'] for r in records])
+        client = fakeClient([searchPage(['S1', 'S2'], 3),
+                             searchPage(['S3'], 3)])
+        with tempCwd() as tmpdir:
+            sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                        increment=2, resultSink=sink).execute()
+            self.assertEqual(os.listdir(tmpdir), [])    # no dump.json
+        self.assertEqual(pages, [['S1', 'S2'], ['S3']])
+
+    def test_streamSink(self):
+        pages = []
+        client = fakeClient([searchPage(['S1'], 2), searchPage(['S2'], 2)])
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                            increment=1, stream=True,
+                            resultSink=lambda s, r: pages.append(len(r)))
+        search.execute()
+        self.assertEqual(pages, [1])
+        list(search.getIterator())
+        self.assertEqual(pages, [1, 1])
+
+    def test_noResults(self):
+        pages = []
+        client = fakeClient([jsonResponse({'resultsFound': 0})])
+        sdl.SciDirectSearch(client, {'qs': 'mice'},
+                        resultSink=lambda s, r: pages.append(r)).execute()
+        self.assertEqual(pages, [])
+
+# end class SciDirectSearch_resultSink_tests ##################################
+
+def fakeSearchApi(corpus):
+    """ Return a FakeSession response function that runs search queries on
+        corpus = {pii: publication year} like the API: by 'date', and w/ a
+        'show' & 'offset' page (newest 1st if sortBy 'date')
+    """
+    def search(method, url, headers, data):
+        query = json.loads(data)
+        first, last = querySplit.parseYears(query.get('date'))
+        display = query.get('display', {})
+        key = None
+        if display.get('sortBy') == 'date':
+            key = lambda p: (-corpus[p], p)
+        piis = sorted((p for p, year in corpus.items()
+                                        if first <= year <= last), key=key)
+        offset = display.get('offset', 0)
+        records = [searchResult(p) for p in
+                                piis[offset:offset + display.get('show', 25)]]
+        for record in records:
+            record['publicationDate'] = '%d-06-01' % corpus[record['pii']]
+        return jsonResponse({'resultsFound': len(piis), 'results': records})
+    return search
+
+class SciDirectSearch_split_tests(unittest.TestCase):
+
+    def setUp(self):
+        # 2000: 3 articles, 2001: 2, 2002: 1
+        self.corpus = {'S1': 2000, 'S2': 2000, 'S3': 2000, 'S4': 2001,
+                        'S5': 2001, 'S6': 2002}
+
+    def test_truncatedWithoutSplitters(self):
+        client = fakeClient([fakeSearchApi(self.corpus)] * 2)
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                increment=2, maxResults=3).execute()
+        self.assertEqual(search.getNumResults(), 4)     # 2 pages
+        self.assertTrue(search.isTruncated())
+        self.assertEqual(
+            client.getMetrics().snapshot()['events']['search_truncated'], 1)
+
+    def test_splitByYear(self):
+        client = fakeClient([fakeSearchApi(self.corpus)] * 20)
+        sinkPiis = []
+        search = sdl.SciDirectSearch(client,
+                        {'qs': 'mice', 'date': '2000-2002'}, getAll=True,
+                        increment=2, maxResults=2,
+                        splitters=querySplit.DEFAULT_SPLITTERS,
+                        resultSink=lambda s, r: sinkPiis.extend(
+                                                    x['pii'] for x in r))
+        search.execute()
+        dates = [json.loads(data).get('date') for m, u, h, data in
+                                        client.getSession().requests]
+        # 2000-2002 -> 2002, 2000-2001 -> 2001, 2000 (1 page, can't split)
+        self.assertEqual(dates, ['2000-2002', '2002', '2000-2001', '2001',
+                                                                    '2000'])
+        self.assertEqual(sorted(r['pii'] for r in search.getResults()),
+                                        ['S1', 'S2', 'S4', 'S5', 'S6'])
+        self.assertEqual(search.getTotalNumResults(), 6)
+        self.assertEqual(search.getNumResults(), 5)
+        self.assertTrue(search.isTruncated())   # the 3rd of 2000
+        self.assertEqual(sorted(sinkPiis), ['S1', 'S2', 'S4', 'S5', 'S6'])
+        events = client.getMetrics().snapshot()['events']
+        self.assertEqual(events['search_splits'], 2)
+
+    def test_splitDedupsPiis(self):
+        client = fakeClient([fakeSearchApi(self.corpus)] * 20)
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'},
+                        getAll=True, maxResults=5, increment=10,
+                        splitters=[lambda q: None if 'split' in q else
+                                [dict(q, split=1, date='2000-2001'),
+                                 dict(q, split=1, date='2001-2002')]])
+        search.execute()
+        self.assertEqual([r['pii'] for r in search.getResults()],
+                                    ['S1', 'S2', 'S3', 'S4', 'S5', 'S6'])
+        self.assertFalse(search.isTruncated())
+        self.assertEqual(client.getMetrics().snapshot()['events']
+                                            ['search_split_duplicates'], 2)
+
+    def test_noSplitNeeded(self):
+        client = fakeClient([fakeSearchApi(self.corpus)] * 3)
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                        increment=2, splitters=querySplit.DEFAULT_SPLITTERS)
+        search.execute()
+        self.assertEqual(len(client.getSession().requests), 3)
+        self.assertEqual(search.getNumResults(), 6)
+        self.assertFalse(search.isTruncated())
+
+    def test_reusesFirstPage(self):
+        corpus = dict(self.corpus, S7=2002, S8=2002)
+        for parallelPages in (1, 2):
+            client = fakeClient([fakeSearchApi(corpus)] * 20)
+            search = sdl.SciDirectSearch(client, {'qs': 'mice',
+                        'date': '2000-2002', 'display': {'sortBy': 'date'}},
+                        getAll=True, increment=2, maxResults=4,
+                        splitters=querySplit.DEFAULT_SPLITTERS,
+                        parallelPages=parallelPages).execute()
+            sent = [json.loads(data) for m, u, h, data in
+                                            client.getSession().requests]
+            # 2002's 1st page is the 1st page we got (S6, S7), and 2001's is
+            #  2000-2001's (S4, S5): they start at their 2nd page
+            self.assertEqual([(q['date'], q['display']['offset'])
+                                                            for q in sent],
+                        [('2000-2002', 0), ('2002', 2), ('2000-2001', 0),
+                         ('2001', 2), ('2000', 0), ('2000', 2)])
+            self.assertEqual([r['pii'] for r in search.getResults()],
+                        ['S6', 'S7', 'S8', 'S4', 'S5', 'S1', 'S2', 'S3'])
+            self.assertFalse(search.isTruncated())
+            self.assertEqual(client.getMetrics().snapshot()['events']
+                                                ['search_pages_reused'], 2)
+
+    def test_reusesFirstPageAsync(self):
+        corpus = dict(self.corpus, S7=2002, S8=2002)
+        session = FakeAsyncSession([fakeSearchApi(corpus)] * 20)
+        client = sdl.AsyncElsClient('key', session=session,
+                                    rateLimiter=rateLimiter.NullRateLimiter())
+        search = sdl.SciDirectSearch(client, {'qs': 'mice',
+                        'date': '2000-2002', 'display': {'sortBy': 'date'}},
+                        getAll=True, increment=2, maxResults=4,
+                        splitters=querySplit.DEFAULT_SPLITTERS,
+                        parallelPages=2)
+        asyncio.run(search.executeAsync())
+        self.assertEqual(len(session.requests), 6)
+        self.assertEqual(sorted(r['pii'] for r in search.getResults()),
+                        ['S1', 'S2', 'S3', 'S4', 'S5', 'S6', 'S7', 'S8'])
+
+    def test_noReuseWithoutDateSort(self):
+        corpus = dict(self.corpus, S7=2002, S8=2002)
+        client = fakeClient([fakeSearchApi(corpus)] * 20)
+        sdl.SciDirectSearch(client, {'qs': 'mice', 'date': '2000-2002'},
+                        getAll=True, increment=2, maxResults=4,
+                        splitters=querySplit.DEFAULT_SPLITTERS).execute()
+        offsets = [json.loads(data)['display']['offset'] for m, u, h, data
+                                            in client.getSession().requests]
+        self.assertEqual(offsets.count(0), 5)   # every search's 1st page
+
+    def test_noStreamingSplits(self):
+        with self.assertRaises(ValueError):
+            sdl.SciDirectSearch(fakeClient(), {'qs': 'mice'}, getAll=True,
+                        stream=True, splitters=querySplit.DEFAULT_SPLITTERS)
+
+# end class SciDirectSearch_split_tests ######################################
+
+def fakeListApi(piis, delays=None):
+    """ Return a FakeSession response function that pages through the list
+        piis (which the test may change) like the search API.
+        delays = {offset: secs to wait before answering}
+    """
+    def search(method, url, headers, data):
+        display = json.loads(data)['display']
+        offset = display['offset']
+        time.sleep((delays or {}).get(offset, 0))
+        return searchPage(piis[offset:offset + display['show']], len(piis))
+    return search
+
+class SciDirectSearch_parallel_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.piis = ['S%d' % i for i in range(1, 8)]
+
+    def search(self, client, **kwargs):
+        pages = []
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                        increment=2, parallelPages=3,
+                        resultSink=lambda s, r: pages.append(
+                                            [x['pii'] for x in r]), **kwargs)
+        return search.execute(), pages
+
+    def test_pagesInOrder(self):
+        # page 2 is slowest, pages 3 & 4 come back 1st
+        client = fakeClient([fakeListApi(self.piis, {2: 0.1})] * 4)
+        search, pages = self.search(client)
+        self.assertEqual([r['pii'] for r in search.getResults()], self.piis)
+        self.assertEqual(pages, [['S1', 'S2'], ['S3', 'S4'], ['S5', 'S6'],
+                                                                    ['S7']])
+        offsets = sorted(json.loads(data)['display']['offset']
+                            for m, u, h, data in client.getSession().requests)
+        self.assertEqual(offsets, [0, 2, 4, 6])
+        self.assertEqual(search.getNumResults(), 7)
+
+    def test_maxResults(self):
+        client = fakeClient([fakeListApi(self.piis)] * 2)
+        search, pages = self.search(client, maxResults=3)
+        self.assertEqual(search.getNumResults(), 4)
+        self.assertTrue(search.isTruncated())
+
+    def test_resultsFoundChanges(self):
+        api = fakeListApi(self.piis, {4: 0.1})
+        def addTwo(*request):       # S0 & S8 are loaded after the 1st page
+            response = api(*request)
+            self.piis.insert(0, 'S0')
+            self.piis.append('S8')
+            return response
+        client = fakeClient([addTwo] + [api] * 4)
+        search, pages = self.search(client)
+
+        # S2 is on pages 1 & 2 now, S8 is on a 5th page
+        self.assertEqual([r['pii'] for r in search.getResults()],
+                        ['S%d' % i for i in range(1, 9)])
+        self.assertEqual(search.getTotalNumResults(), 9)
+        self.assertEqual(len(client.getSession().requests), 5)
+        events = client.getMetrics().snapshot()['events']
+        self.assertEqual(events['search_results_changed'], 1)
+        self.assertEqual(events['search_page_duplicates'], 1)
+
+    def test_pageFails(self):
+        client = fakeClient([fakeListApi(self.piis),
+                             FakeResponse(500, b'server error'),
+                             fakeListApi(self.piis), fakeListApi(self.piis)])
+        with self.assertRaises(requests.HTTPError):
+            self.search(client)
+
+    def test_noStreaming(self):
+        with self.assertRaises(ValueError):
+            sdl.SciDirectSearch(fakeClient(), {'qs': 'mice'}, getAll=True,
+                                                stream=True, parallelPages=4)
+
+    def test_async(self):
+        client = sdl.AsyncElsClient('key',
+                        session=FakeAsyncSession([fakeListApi(self.piis)] * 4),
+                        rateLimiter=rateLimiter.NullRateLimiter())
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                            increment=2, parallelPages=3)
+        asyncio.run(search.executeAsync())
+        self.assertEqual([r['pii'] for r in search.getResults()], self.piis)
+
+# end class SciDirectSearch_parallel_tests ####################################
+
+class SciDirectReference_compact_tests(unittest.TestCase):
+
+    def test_slots(self):
+        ref = sdl.SciDirectReference(fakeClient(), searchResult('S1'))
+        self.assertFalse(hasattr(ref, '__dict__'))
+
+    def test_release(self):
+        client = fakeClient([detailsResponse('S1', pmid='111'),
+                             pdfResponse(b'%PDF-1.7 S1'),
+                             detailsResponse('S1', pmid='111')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.getPmid(), '111')
+        self.assertEqual(ref.getPdf(), b'%PDF-1.7 S1')
+        ref.release()
+        self.assertIsNone(ref._pdf)
+        self.assertIsNone(ref.getSearchResultsFields())
+        self.assertEqual(ref.getPmid(), '111')      # still have the fields
+        self.assertEqual(ref.getPii(), 'S1')
+        self.assertEqual(len(client.getSession().requests), 2)
+        self.assertIn('coredata', ref.getDetails())  # loaded again
+        self.assertEqual(len(client.getSession().requests), 3)
+
+    def test_compactWeakDetails(self):
+        client = fakeClient([detailsResponse('S1', pmid='111'),
+                             detailsResponse('S1', pmid='111')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'), compact=True)
+        self.assertIsNone(ref.getSearchResultsFields())
+        details = ref.getDetails()
+        self.assertEqual(details['pubmed-id'], '111')
+        self.assertIs(ref.getDetails(), details)    # held by us, not reloaded
+        del details
+        self.assertEqual(ref.getPmid(), '111')
+        self.assertEqual(len(client.getSession().requests), 1)
+        self.assertEqual(ref.getDetails()['pubmed-id'], '111')  # freed
+        self.assertEqual(len(client.getSession().requests), 2)
+
+    def test_compactSearchDropsRecords(self):
+        client = fakeClient([searchPage(['S1', 'S2', 'S3'], 3)])
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'},
+                                                    compact=True).execute()
+        it = search.getIterator()
+        ref = next(it)
+        self.assertEqual(ref.getPii(), 'S1')
+        self.assertIsNone(ref.getSearchResultsFields())
+        self.assertIsNone(search.getResults()[0])
+        self.assertEqual([r.getPii() for r in it], ['S2', 'S3'])
+        self.assertEqual(search.getResults(), [])
+        self.assertEqual(search.getNumResults(), 3)
+        self.assertRaises(ValueError, search.getIterator)
+
+# end class SciDirectReference_compact_tests #################################
+
+class ElsClient_metrics_tests(unittest.TestCase):
+
+    def test_requestMetrics(self):
+        client = fakeClient([FakeResponse(503, b'busy'),
+                             detailsResponse('S1'),
+                             searchPage(['S1', 'S2'], 2)],
+                    retryPolicy=retryPolicy.RetryPolicy(backoffBase=0))
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        ref.getPmid()
+        sdl.SciDirectSearch(client, {'qs': 'mice'}).execute()
+
+        snap = client.getMetrics().snapshot()
+        meta = snap['endpoints']['META']
+        self.assertEqual(meta['statuses'], {'200': 1, '503': 1})
+        self.assertEqual(meta['retries'], 1)
+        self.assertEqual(meta['latency']['count'], 2)
+        self.assertGreater(meta['bytes'], 0)
+        self.assertEqual(snap['endpoints']['search']['statuses'], {'200': 1})
+        self.assertIn('json_decode', snap['phaseSecs'])
+        self.assertEqual(snap['events']['details_fetched'], 1)
+        self.assertEqual(snap['events']['search_results'], 2)
+
+    def test_pdfMetrics(self):
+        content = b'%PDF-1.7 ' + b'x'*100
+        client = fakeClient([pdfResponse(content)])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        with tempCwd():
+            ref.savePdf('S1.pdf')
+        snap = client.getMetrics().snapshot()
+        self.assertEqual(snap['endpoints']['PDF']['bytes'], len(content))
+        self.assertIn('disk_write', snap['phaseSecs'])
+        self.assertEqual(snap['events']['pdfs_saved'], 1)
+
+    def test_sharedMetrics(self):
+        client = fakeClient()
+        self.assertIs(client.sharingClient().getMetrics(),
+                                                    client.getMetrics())
+
+# end class ElsClient_metrics_tests ######################################
+
+class metadataCache_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = metadataCache.SqliteMetadataCache(
+                                os.path.join(self.tmpdir.name, 'cache.db'))
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_detailsCached(self):
+        client = fakeClient([detailsResponse('S1', '111')],
+                                                    metadataCache=self.cache)
+        self.assertEqual(
+            sdl.SciDirectReference(client, searchResult('S1')).getPmid(),'111')
+        # a new reference, e.g., in the next harvest, doesn't hit the API
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.getPmid(), '111')
+        self.assertEqual(ref.getVolume(), '7')
+        self.assertEqual(len(client.getSession().requests), 1)
+        self.assertEqual(self.cache.getStats()['hits'], 1)
+
+    def test_noPmidCachedBriefly(self):
+        resp = jsonResponse({'full-text-retrieval-response': {
+                                        'coredata': {'pubType': 'fla'}}})
+        client = fakeClient([resp], metadataCache=self.cache)
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.getPmid(), 'no PMID')
+        self.cache._clock = lambda: 10**11      # far in the future
+        self.assertIsNone(self.cache.get('S1', 'META'))
+
+    def test_expiredDetailsRevalidated(self):
+        resp = detailsResponse('S1', '111')
+        resp.headers['ETag'] = '"v1"'
+        client = fakeClient([resp, FakeResponse(304)],
+                                                    metadataCache=self.cache)
+        self.cache._ttl = 10
+        sdl.SciDirectReference(client, searchResult('S1')).getPmid()
+        now = self.cache._clock()
+        self.cache._clock = lambda: now + 100   # the entry has expired
+
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.getPmid(), '111')
+        headers = client.getSession().requests[1][2]
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(self.cache.getStats()['revalidated'], 1)
+        entry = self.cache.getEntry('S1', 'META')
+        self.assertFalse(entry.expired)
+        self.assertEqual(entry.validators, {'ETag': '"v1"'})
+
+    def test_expiredDetailsChanged(self):
+        resp = detailsResponse('S1', '111')
+        resp.headers['ETag'] = '"v1"'
+        resp2 = detailsResponse('S1', '222')
+        resp2.headers['ETag'] = '"v2"'
+        client = fakeClient([resp, resp2], metadataCache=self.cache)
+        self.cache._ttl = 10
+        sdl.SciDirectReference(client, searchResult('S1')).getPmid()
+        now = self.cache._clock()
+        self.cache._clock = lambda: now + 100   # the entry has expired
+
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.getPmid(), '222')
+        self.assertEqual(self.cache.getEntry('S1', 'META').validators,
+                                                            {'ETag': '"v2"'})
+
+# end class metadataCache_tests ######################################
+
+def pdfResponse(content, contentLength=True):
+    headers = {'Content-Length': str(len(content))} if contentLength else {}
+    return FakeResponse(content=content, headers=headers)
+
+class savePdf_tests(unittest.TestCase):
+
+    pdf = b'%PDF-1.7' + b'x'*1000
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'a.pdf')
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_streamsToFile(self):
+        resp = pdfResponse(self.pdf)
+        client = fakeClient([resp])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertEqual(ref.savePdf(self.path, chunkSize=100), len(self.pdf))
+        self.assertEqual(open(self.path, 'rb').read(), self.pdf)
+        self.assertEqual(resp.chunkSizes, [100])
+        self.assertIsNone(ref._pdf)         # not kept in memory
+        self.assertEqual(os.listdir(self.tmpdir.name), ['a.pdf'])
+
+    def test_hasher(self):
+        client = fakeClient([pdfResponse(self.pdf)])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        hasher = hashlib.sha256()
+        ref.savePdf(self.path, chunkSize=100, hasher=hasher)
+        self.assertEqual(hasher.hexdigest(), hashlib.sha256(self.pdf).hexdigest())
+
+    def test_notPdf(self):
+        client = fakeClient([pdfResponse(b'<html>oops</html>')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertRaises(ValueError, ref.savePdf, self.path, chunkSize=2)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_truncated(self):
+        resp = pdfResponse(self.pdf)
+        resp.headers['Content-Length'] = str(len(self.pdf) + 10)
+        client = fakeClient([resp])
+        open(self.path, 'wb').write(b'%PDF old version')
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertRaises(ValueError, ref.savePdf, self.path)
+        # old file is untouched, no temp file left behind
+        self.assertEqual(open(self.path, 'rb').read(), b'%PDF old version')
+        self.assertEqual(os.listdir(self.tmpdir.name), ['a.pdf'])
+
+    def test_httpError(self):
+        client = fakeClient([FakeResponse(404, b'not found')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertRaises(requests.HTTPError, ref.savePdf, self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_alreadyInMemory(self):
+        client = fakeClient([pdfResponse(self.pdf)])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        ref.getPdf()
+        ref.savePdf(self.path)
+        self.assertEqual(open(self.path, 'rb').read(), self.pdf)
+        self.assertEqual(len(client.getSession().requests), 1)
+
+    def test_conditionalDownload(self):
+        resp = pdfResponse(self.pdf)
+        resp.headers['ETag'] = '"v1"'
+        resp.headers['Last-Modified'] = 'Wed, 21 Oct 2020 07:28:00 GMT'
+        client = fakeClient([resp, FakeResponse(304),
+                                            pdfResponse(b'%PDF-1.7 new')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        self.assertIsNone(ref.pdfChanged())
+        ref.savePdf(self.path)
+        self.assertTrue(ref.pdfChanged())
+        self.assertEqual(sdl.readPdfValidators(self.path)['ETag'], '"v1"')
+
+        # unchanged: file left alone
+        self.assertEqual(ref.savePdf(self.path), 0)
+        self.assertFalse(ref.pdfChanged())
+        headers = client.getSession().requests[1][2]
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(headers['If-Modified-Since'],
+                                            'Wed, 21 Oct 2020 07:28:00 GMT')
+        self.assertEqual(open(self.path, 'rb').read(), self.pdf)
+
+        # changed, new pdf has no validators so the old ones are removed
+        ref.savePdf(self.path)
+        self.assertTrue(ref.pdfChanged())
+        self.assertEqual(open(self.path, 'rb').read(), b'%PDF-1.7 new')
+        self.assertIsNone(sdl.readPdfValidators(self.path))
+
+    def test_unconditional(self):
+        resp = pdfResponse(self.pdf)
+        resp.headers['ETag'] = '"v1"'
+        client = fakeClient([resp, pdfResponse(self.pdf)])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        ref.savePdf(self.path)
+        ref.savePdf(self.path, conditional=False)
+        self.assertNotIn('If-None-Match', client.getSession().requests[1][2])
+
+    def test_savePdfs(self):
+        client = fakeClient([pdfResponse(self.pdf),
+                             FakeResponse(500, b'oops')])
+        refs = [sdl.SciDirectReference(client, searchResult(p))
+                                                        for p in ['S1', 'S2']]
+        failures = sdl.savePdfs(refs, lambda r: os.path.join(self.tmpdir.name,
+                                                r.getPii() + '.pdf'), workers=1)
+        self.assertEqual(list(failures.keys()), ['S2'])
+        self.assertEqual(os.listdir(self.tmpdir.name), ['S1.pdf'])
+
+    def test_async(self):
+        session = FakeAsyncSession([pdfResponse(self.pdf)])
+        client = sdl.AsyncElsClient('key', session=session,
+                                    rateLimiter=rateLimiter.NullRateLimiter())
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        numBytes = asyncio.run(ref.savePdfAsync(self.path, chunkSize=7))
+        self.assertEqual(numBytes, len(self.pdf))
+        self.assertEqual(open(self.path, 'rb').read(), self.pdf)
+
+# end class savePdf_tests ######################################
+
+class AsyncElsClient_tests(unittest.TestCase):
+
+    def fakeAsyncClient(self, responses):
+        return sdl.AsyncElsClient('key', session=FakeAsyncSession(responses),
+                                rateLimiter=rateLimiter.NullRateLimiter())
+
+    def test_requests(self):
+        client = self.fakeAsyncClient([jsonResponse({'a': 1}),
+                                       FakeResponse(content=b'%PDF-1.7'),
+                                       jsonResponse({'b': 2}),
+                                       FakeResponse(404, b'not found')])
+        async def run():
+            self.assertEqual(await client.execGetRequest(sdl.url_base),
+                                                                    {'a': 1})
+            self.assertEqual(await client.execGetRequest(sdl.url_base, 'pdf'),
+                                                                b'%PDF-1.7')
+            self.assertEqual(await client.execPutRequest(sdl.url_base, '{}'),
+                                                                    {'b': 2})
+            with self.assertRaises(requests.HTTPError):
+                await client.execGetRequest(sdl.url_base)
+            with self.assertRaises(ValueError):
+                await client.execGetRequest(sdl.url_base, 'foo')
+        asyncio.run(run())
+        self.assertEqual(client.getRequestStatus()['status_code'], 404)
+        method, url, headers, data = client.getSession().requests[2]
+        self.assertEqual((method, data), ('PUT', '{}'))
+
+    def test_sharesBudgetWithThreadedClient(self):
+        limiter = rateLimiter.TokenBucketLimiter()
+        client = sdl.AsyncElsClient('key', rateLimiter=limiter)
+        self.assertIs(client.getRateLimiter().getLimiter(), limiter)
+
+    def test_searchAndReferences(self):
+        page1 = {'resultsFound': 3,
+                    'results': [searchResult('S1'), searchResult('S2')]}
+        page2 = {'resultsFound': 3, 'results': [searchResult('S3')]}
+        client = self.fakeAsyncClient([jsonResponse(page1),
+                                       jsonResponse(page2),
+                                       detailsResponse('S1', '1'),
+                                       detailsResponse('S2', '2'),
+                                       detailsResponse('S3', '3')])
+        search = sdl.SciDirectSearch(client, {'qs': 'mice'}, getAll=True,
+                                                                increment=2)
+        async def run():
+            await search.executeAsync()
+            refs = list(search.getIterator())
+            failures = await sdl.prefetchDetailsAsync(refs)
+            return refs, failures
+        with tempCwd():
+            refs, failures = asyncio.run(run())
+        self.assertEqual(failures, {})
+        self.assertEqual(search.getNumResults(), 3)
+        self.assertEqual(sorted(r.getPmid() for r in refs), ['1', '2', '3'])
+        offsets = [json.loads(req[3])['display']['offset']
+                                for req in client.getSession().requests[:2]]
+        self.assertEqual(offsets, [0, 2])
+
+# end class AsyncElsClient_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
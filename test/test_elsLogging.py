@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for elsLogging.py
+
+Usage:   python test_elsLogging.py [-v]
+"""
+import unittest
+import os
+import sys
+import subprocess
+import logging
+import threading
+import elsLogging
+from test_SciDirectLib_offline import tempCwd
+
+######################################
+
+class RecordingHandler(logging.Handler):
+    """ Records the thread each record is formatted in
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    def emit(self, record):
+        self.messages.append((record.getMessage(),
+                                        threading.current_thread().name))
+
+class elsLogging_tests(unittest.TestCase):
+
+    def tearDown(self):
+        elsLogging.shutdownLogging()
+
+    def test_noSideEffectsOnImport(self):
+        repoDir = os.path.dirname(os.path.abspath(elsLogging.__file__))
+        with tempCwd():
+            output = subprocess.check_output([sys.executable, '-c',
+                    'import sys; sys.path.insert(0, %r); import SciDirectLib;'
+                    'print(SciDirectLib.logger.handlers)' % repoDir])
+            self.assertEqual(output.strip(), b'[]')
+            self.assertFalse(os.path.exists('logs'))
+
+    def test_logFile(self):
+        with tempCwd():
+            elsLogging.configureLogging('logs', consoleLevel=None)
+            elsLogging.configureLogging('logs', consoleLevel=None)  # again
+            logger = logging.getLogger('SciDirectLib')
+            self.assertEqual(len([h for h in logger.handlers
+                    if isinstance(h, logging.handlers.QueueHandler)]), 1)
+            logger.info('Sending PUT request to %s', 'http://x')
+            elsLogging.shutdownLogging()
+            fileNames = os.listdir('logs')
+            self.assertEqual(len(fileNames), 1)
+            with open(os.path.join('logs', fileNames[0])) as f:
+                self.assertIn('Sending PUT request to http://x', f.read())
+        self.assertIsNone(elsLogging.getListener())
+
+    def test_formattedInBackground(self):
+        listener = elsLogging.configureLogging(None, consoleLevel=None,
+                                                        loggerNames=['elsTest'])
+        recorder = RecordingHandler()
+        listener.handlers = (recorder,)
+        class Expensive(object):
+            def __str__(self):
+                return 'formatted in %s' % threading.current_thread().name
+        logging.getLogger('elsTest').info('%s', Expensive())
+        elsLogging.shutdownLogging()
+        message, threadName = recorder.messages[0]
+        self.assertEqual(message, 'formatted in %s' % threadName)
+        self.assertNotEqual(threadName, threading.current_thread().name)
+
+# end class elsLogging_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for elsMetrics.py
+
+Usage:   python test_elsMetrics.py [-v]
+"""
+import unittest
+import json
+import elsMetrics as em
+
+######################################
+
+class endpointOf_tests(unittest.TestCase):
+
+    def test_endpoints(self):
+        base = 'https://api.elsevier.com/'
+        self.assertEqual(em.endpointOf(base + 'content/search/sciencedirect'),
+                                                                    'search')
+        self.assertEqual(em.endpointOf(base +
+                                'content/article/pii/S1?view=META'), 'META')
+        self.assertEqual(em.endpointOf(base + 'content/article/pii/S1'),
+                                                                        'PDF')
+        self.assertEqual(em.endpointOf(base + 'foo'), 'other')
+
+# end class endpointOf_tests ######################################
+
+class Histogram_tests(unittest.TestCase):
+
+    def test_observe(self):
+        h = em.Histogram(buckets=(1, 5))
+        for v in (0.5, 1, 3, 10):
+            h.observe(v)
+        self.assertEqual(h.snapshot(), {'buckets': [[1, 2], [5, 3],
+                                            ['+Inf', 4]], 'sum': 14.5, 'count': 4})
+        self.assertEqual(h.quantile(0.5), 1)
+        self.assertEqual(h.quantile(0.75), 5)
+        self.assertEqual(h.quantile(1.0), float('inf'))
+        self.assertIsNone(em.Histogram().quantile(0.5))
+
+# end class Histogram_tests ######################################
+
+class ElsMetrics_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.m = em.ElsMetrics(buckets=(0.5, 1))
+        self.m.observeRequest('META', 0.2, 200, 100)
+        self.m.observeRequest('META', 0.7, 429)
+        self.m.addRetry('META')
+        self.m.addBytes('PDF', 2000)
+        self.m.addThrottle(1.5)
+        self.m.addTime('json_decode', 0.25)
+        self.m.count('search_pages', 2)
+
+    def test_snapshot(self):
+        snap = self.m.snapshot()
+        meta = snap['endpoints']['META']
+        self.assertEqual(meta['statuses'], {'200': 1, '429': 1})
+        self.assertEqual(meta['bytes'], 100)
+        self.assertEqual(meta['retries'], 1)
+        self.assertEqual(meta['latency']['count'], 2)
+        self.assertEqual(snap['endpoints']['PDF']['bytes'], 2000)
+        self.assertIsNone(snap['endpoints']['PDF']['latency'])
+        self.assertEqual(snap['throttleSecs'], 1.5)
+        self.assertEqual(snap['phaseSecs'], {'json_decode': 0.25})
+        self.assertEqual(snap['events'], {'search_pages': 2})
+        self.assertEqual(json.loads(self.m.toJson())['throttleSecs'], 1.5)
+
+    def test_timer(self):
+        times = [10.0, 12.0]
+        self.m._clock = lambda: times.pop(0) if len(times) > 1 else times[0]
+        with self.m.timer('disk_write'):
+            pass
+        self.assertEqual(self.m.snapshot()['phaseSecs']['disk_write'], 2.0)
+
+    def test_prometheus(self):
+        lines = self.m.toPrometheus().splitlines()
+        self.assertIn('# TYPE elsclient_request_seconds histogram', lines)
+        self.assertIn('elsclient_request_seconds_bucket'
+                        '{endpoint="META",le="0.5"} 1', lines)
+        self.assertIn('elsclient_request_seconds_bucket'
+                        '{endpoint="META",le="+Inf"} 2', lines)
+        self.assertIn('elsclient_responses_total'
+                        '{endpoint="META",status="429"} 1', lines)
+        self.assertIn('elsclient_throttle_seconds_total 1.5', lines)
+        self.assertIn('elsclient_events_total{event="search_pages"} 2', lines)
+
+    def test_summary(self):
+        text = self.m.summary()
+        self.assertIn('META: 2 requests', text)
+        self.assertIn('Throttle sleep: 1.5s', text)
+
+    def test_reset(self):
+        self.m.reset()
+        self.assertEqual(self.m.snapshot()['endpoints'], {})
+
+# end class ElsMetrics_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
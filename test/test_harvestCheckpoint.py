@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for harvestCheckpoint.py
+
+Usage:   python test_harvestCheckpoint.py [-v]
+"""
+import unittest
+import os
+import tempfile
+import harvestCheckpoint as hc
+
+######################################
+
+class queryKey_tests(unittest.TestCase):
+
+    def test_ignoresDateAndDisplay(self):
+        q1 = {'pub': '"Neuron"', 'qs': 'mice',
+              'loadedAfter': '2021-05-15T00:00:00Z',
+              'display': {'sortBy': 'date'}}
+        q2 = {'qs': 'mice', 'pub': '"Neuron"',
+              'loadedAfter': '2022-01-01T00:00:00Z'}
+        self.assertEqual(hc.queryKey(q1), hc.queryKey(q2))
+        self.assertNotEqual(hc.queryKey(q1),
+                            hc.queryKey({'pub': '"Bone"', 'qs': 'mice'}))
+
+# end class queryKey_tests ######################################
+
+class HarvestCheckpoint_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbPath = os.path.join(self.tmpdir.name, 'checkpoint.db')
+        self.cp = hc.HarvestCheckpoint(self.dbPath)
+    def tearDown(self):
+        self.cp.close()
+        self.tmpdir.cleanup()
+
+    def test_firstRun(self):
+        self.assertIsNone(self.cp.getLoadDate('k'))
+        self.assertEqual(self.cp.getLoadedAfter('k', '2021-05-15'),
+                                                                '2021-05-15')
+        self.assertEqual(self.cp.getDonePiis('k'), set())
+
+    def test_resumeAfterCrash(self):
+        self.cp.markDone('k', 'S1', '2021-06-01T00:00:00.000Z')
+        self.cp.close()
+        # no finishRun(), e.g., we crashed
+        self.cp = hc.HarvestCheckpoint(self.dbPath)
+        self.assertTrue(self.cp.isDone('k', 'S1'))
+        self.assertFalse(self.cp.isDone('k', 'S2'))
+        self.assertFalse(self.cp.isDone('other', 'S1'))
+        self.assertEqual(self.cp.getLoadedAfter('k', '2021-05-15'),
+                                                                '2021-05-15')
+
+    def test_finishRun(self):
+        self.cp.markDone('k', 'S1', '2021-05-20T00:00:00.000Z')
+        self.cp.markDone('k', 'S2', '2021-06-01T10:00:00.000Z')
+        self.assertEqual(self.cp.finishRun('k', '2021-06-01T10:00:00.000Z'),
+                                                '2021-06-01T10:00:00.000Z')
+        # one day of overlap
+        self.assertEqual(self.cp.getLoadedAfter('k'), '2021-05-31')
+        # S1 is before the next window, forgotten
+        self.assertEqual(self.cp.getDonePiis('k'), {'S2'})
+
+    def test_failuresHoldBack(self):
+        self.cp.finishRun('k', '2021-06-01T00:00:00.000Z',
+                            oldestFailedLoadDate='2021-05-20T00:00:00.000Z')
+        self.assertEqual(self.cp.getLoadedAfter('k'), '2021-05-19')
+
+    def test_neverMovesBackward(self):
+        self.cp.finishRun('k', '2021-06-01T00:00:00.000Z')
+        self.cp.finishRun('k', '2021-05-01T00:00:00.000Z')
+        self.cp.finishRun('k', None)
+        self.assertEqual(self.cp.getLoadDate('k'), '2021-06-01T00:00:00.000Z')
+
+    def test_reset(self):
+        self.cp.markDone('k', 'S1', '2021-06-01T00:00:00.000Z')
+        self.cp.finishRun('k', '2021-06-01T00:00:00.000Z')
+        self.cp.reset('k')
+        self.assertIsNone(self.cp.getLoadDate('k'))
+        self.assertEqual(self.cp.getDonePiis('k'), set())
+
+# end class HarvestCheckpoint_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
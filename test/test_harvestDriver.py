@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for harvestDriver.py. They don't talk to the real API.
+
+Usage:   python test_harvestDriver.py [-v]
+"""
+import unittest
+import json
+import threading
+import time
+import rateLimiter
+import harvestDriver as hd
+import journalBatch as jb
+from test_SciDirectLib_offline import FakeResponse, fakeClient, searchPage, \
+                                        searchResult, tempCwd
+
+######################################
+
+class RecordingLimiter(object):
+    """ Records which thread acquires, can be held shut w/ an Event
+    """
+    def __init__(self):
+        self.order = []
+        self.gate = threading.Event()
+    def acquire(self, tokens=1):
+        self.gate.wait()
+        self.order.append(threading.current_thread().name)
+        return 0.0
+    def getRate(self): return 1.0
+
+class FairShareLimiter_tests(unittest.TestCase):
+
+    def waitForWaiting(self, fair, n):
+        for i in range(500):
+            if fair._busy and sum(fair._waiting.values()) == n:
+                return
+            time.sleep(0.01)
+        self.fail('threads never queued')
+
+    def test_roundRobin(self):
+        recorder = RecordingLimiter()
+        fair = hd.FairShareLimiter(recorder)
+        def start(tenant, threadName):
+            t = threading.Thread(name=threadName,
+                            target=fair.getTenant(tenant).acquire)
+            t.start()
+            return t
+        threads = [start('X', 'X')]         # holds the limiter
+        self.waitForWaiting(fair, 0)
+        for i in range(3):
+            threads.append(start('A', 'A%d' % i))
+        self.waitForWaiting(fair, 3)
+        threads.append(start('B', 'B'))
+        self.waitForWaiting(fair, 4)
+        recorder.gate.set()
+        for t in threads: t.join()
+        # B doesn't wait behind all of A's requests
+        self.assertEqual([name[0] for name in recorder.order],
+                                                    ['X', 'A', 'B', 'A', 'A'])
+
+    def test_tenantCounts(self):
+        tenant = hd.FairShareLimiter(rateLimiter.NullRateLimiter()
+                                                        ).getTenant('Bone')
+        tenant.acquire()
+        tenant.acquire()
+        self.assertEqual(tenant.getNumRequests(), 2)
+        self.assertEqual(tenant.getName(), 'Bone')
+
+    def test_adaptiveFeedbackForwarded(self):
+        adaptive = rateLimiter.AdaptiveRateLimiter(rate=2)
+        tenant = hd.FairShareLimiter(adaptive).getTenant('Bone')
+        tenant.onThrottled()
+        self.assertEqual(adaptive.getRate(), 1.0)
+        self.assertEqual(tenant.getRate(), 1.0)
+        plain = hd.FairShareLimiter(rateLimiter.NullRateLimiter())
+        self.assertFalse(hasattr(plain.getTenant('Bone'), 'onThrottled'))
+
+# end class FairShareLimiter_tests ######################################
+
+class HarvestDriver_tests(unittest.TestCase):
+
+    def respond(self, method, url, headers, data):
+        """ FakeSession responder: one page of results per journal,
+            except journal "Bad" gets a 500 error
+        """
+        pub = json.loads(data)['pub']
+        if pub == 'Bad':
+            return FakeResponse(500, b'server error')
+        return searchPage(['%s-%d' % (pub, i) for i in range(len(pub))],
+                                                                    len(pub))
+
+    def test_run(self):
+        client = fakeClient([self.respond]*3)
+        states = []
+        def process(task, search, elsClient):
+            self.assertIsNot(elsClient, client)
+            self.assertIs(elsClient.getSession(), client.getSession())
+            return [r.getPii() for r in search.getIterator()]
+        def progressFunc(progress):
+            states.append((progress.name, progress.state))
+
+        tasks = [hd.HarvestTask(name, {'pub': name, 'qs': 'mice'})
+                                        for name in ['Bone', 'Bad', 'Neuron']]
+        driver = hd.HarvestDriver(client, process, maxConcurrent=2,
+                                        progressFunc=progressFunc, getAll=True)
+        with tempCwd():
+            progress = driver.run(tasks)
+
+        self.assertEqual(list(progress.keys()), ['Bone', 'Bad', 'Neuron'])
+        self.assertEqual(progress['Bone'].state, hd.TaskProgress.DONE)
+        self.assertEqual(progress['Bone'].result,
+                                        ['Bone-0', 'Bone-1', 'Bone-2', 'Bone-3'])
+        self.assertEqual(progress['Bone'].numResults, 4)
+        self.assertEqual(progress['Bone'].getNumRequests(), 1)
+        self.assertEqual(progress['Neuron'].state, hd.TaskProgress.DONE)
+        self.assertEqual(progress['Bad'].state, hd.TaskProgress.FAILED)
+        self.assertIsNotNone(progress['Bad'].error)
+        self.assertIn('error', str(progress['Bad']))
+        self.assertEqual([s for n, s in states if n == 'Bone'],
+                                        ['searching', 'processing', 'done'])
+        self.assertFalse(client.getSession().closed)
+
+    def test_searchGiven(self):
+        client = fakeClient()
+        results = jb.JournalResults(client, 'Bone', {'pub': '"Bone"'})
+        results._addRecords([searchResult('S1'), searchResult('S2')])
+        def process(task, search, elsClient):
+            return [r.getElsClient() is elsClient for r in search.getIterator()]
+        driver = hd.HarvestDriver(client, process)
+        progress = driver.run([hd.HarvestTask('Bone', {}, search=results)])
+        self.assertEqual(progress['Bone'].result, [True, True])
+        self.assertEqual(progress['Bone'].numResults, 2)
+        self.assertEqual(client.getSession().requests, [])
+
+    def test_duplicateNames(self):
+        driver = hd.HarvestDriver(fakeClient(), lambda *args: None)
+        tasks = [hd.HarvestTask('Bone', {}), hd.HarvestTask('Bone', {})]
+        self.assertRaises(ValueError, driver.run, tasks)
+
+# end class HarvestDriver_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
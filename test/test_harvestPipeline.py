@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for harvestPipeline.py. They don't talk to the real API.
+
+Usage:   python test_harvestPipeline.py [-v]
+"""
+import unittest
+import os
+import time
+import threading
+import harvestPipeline as hp
+from harvestDriver import HarvestTask
+from harvestCheckpoint import HarvestCheckpoint
+from knownIds import KnownIdFilter
+from pendingPmids import PendingPmidQueue
+from pdfStore import PdfStore
+from test_SciDirectLib_offline import FakeResponse, fakeClient, searchResult, \
+                        detailsResponse, jsonResponse, pdfResponse, tempCwd
+
+######################################
+
+class Pipeline_tests(unittest.TestCase):
+
+    def test_run(self):
+        out = []
+        lock = threading.Lock()
+        def collect(item):
+            with lock:
+                out.append(item)
+        stages = [hp.Stage('expand', lambda n: range(n), fanOut=True),
+                  hp.Stage('odd', lambda n: n if n % 2 else None, workers=3),
+                  hp.Stage('square', lambda n: n*n, workers=2),
+                  hp.Stage('collect', collect)]
+        stats = hp.Pipeline(stages).run([4, 6])
+        self.assertEqual(sorted(out), [1, 1, 9, 9, 25])
+        self.assertEqual([(s.name, s.numIn, s.numOut, s.numDropped)
+                                                        for s in stats],
+                        [('expand', 2, 10, 0), ('odd', 10, 5, 5),
+                         ('square', 5, 5, 0), ('collect', 5, 0, 5)])
+
+    def test_quarantine(self):
+        quarantined = []
+        def check(n):
+            if n == 3:
+                raise ValueError('bad item')
+            return n
+        stats = hp.Pipeline([hp.Stage('check', check, workers=2),
+                             hp.Stage('sink', lambda n: n)],
+                            quarantineFunc=quarantined.append).run(range(6))
+        self.assertEqual([(q.stage, q.item, str(q.error))
+                            for q in quarantined], [('check', 3, 'bad item')])
+        self.assertEqual(stats[0].numQuarantined, 1)
+        self.assertEqual(stats[1].numIn, 5)
+
+    def test_quarantineFuncFails(self):
+        def check(n):
+            if n % 2:
+                raise ValueError('bad item')
+            return n
+        def quarantine(q):
+            raise IOError('disk full')
+        out = []
+        pipeline = hp.Pipeline([hp.Stage('check', check, queueSize=1),
+                                hp.Stage('sink', out.append)],
+                               quarantineFunc=quarantine)
+        with self.assertLogs('harvestPipeline', 'ERROR') as logs:
+            stats = pipeline.run(range(10))
+        # the worker carried on, the queue was drained
+        self.assertEqual(out, [0, 2, 4, 6, 8])
+        self.assertEqual(stats[0].numQuarantined, 5)
+        self.assertEqual(len(logs.records), 5)
+
+    def test_backpressure(self):
+        produced = []
+        gate = threading.Event()
+        def produce(n):
+            for i in range(n):
+                produced.append(i)
+                yield i
+        def slow(i):
+            gate.wait()
+            return i
+        pipeline = hp.Pipeline([hp.Stage('produce', produce, fanOut=True),
+                                hp.Stage('slow', slow, queueSize=2)])
+        t = threading.Thread(target=pipeline.run, args=([100],))
+        t.start()
+        time.sleep(0.2)
+        # 2 queued for 'slow', 1 being processed, 1 waiting to be put
+        self.assertLessEqual(len(produced), 4)
+        gate.set()
+        t.join()
+        self.assertEqual(len(produced), 100)
+
+    def test_needsStages(self):
+        self.assertRaises(ValueError, hp.Pipeline, [])
+        self.assertRaises(ValueError, hp.Stage, 'x', None, workers=0)
+
+# end class Pipeline_tests ######################################
+
+class JournalHarvest_tests(unittest.TestCase):
+
+    pdf = b'%PDF-1.7' + b'x'*100
+
+    def respond(self, method, url, headers, data):
+        """ FakeSession responder: Bone's search has S1..S6,
+            S2 is done already, S3's details fail, S4 has no PMID,
+            S5 has a known DOI, S6 is fine
+        """
+        if 'content/search' in url:
+            records = [searchResult('S%d' % i) for i in range(1, 7)]
+            for i, r in enumerate(records):
+                r['loadDate'] = '2021-01-0%dT00:00:00.000Z' % (i+1)
+            return jsonResponse({'resultsFound': 6, 'results': records})
+        pii = url.split('/pii/')[1].split('?')[0]
+        if 'view=META' in url:
+            if pii == 'S3':
+                return FakeResponse(500, b'server error')
+            if pii == 'S4':
+                return jsonResponse({'full-text-retrieval-response': {
+                                    'coredata': {'pii': pii}}})
+            return detailsResponse(pii, pmid=pii[1:])
+        return pdfResponse(self.pdf)
+
+    def test_run(self):
+        with tempCwd():
+            client = fakeClient([self.respond]*20)
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            pending = PendingPmidQueue('pending.db')
+            known = KnownIdFilter(dois=['10.1016/S5'])
+            task = HarvestTask('Bone', {'pub': '"Bone"', 'qs': 'mice'})
+            report = hp.JournalReport(task)
+            checkpoints.markDone(report.key, 'S2', '2021-01-02')
+            quarantined = []
+            harvest = hp.JournalHarvest(client, checkpoints,
+                            pdfPathFunc=lambda r: 'PMID_%s.pdf' % r.getPmid(),
+                            knownIds=known, pending=pending,
+                            detailsWorkers=2, pdfWorkers=2, queueSize=2,
+                            formatFunc=lambda r: r.getPii(),
+                            quarantineFunc=quarantined.append)
+            reports = harvest.run([task])
+
+            report = reports['Bone']
+            self.assertIsNone(report.error)
+            self.assertEqual(dict(report.counts), {'results': 6, 'done': 1,
+                        'pending': 1, 'known': 1, 'noPmid': 0, 'pmids': 2,
+                        'pdfs': 2, 'unchanged': 0, 'stored': 2})
+            self.assertEqual(sorted(os.listdir('.')), ['PMID_1.pdf',
+                        'PMID_6.pdf', 'checkpoints.db', 'pending.db'])
+            self.assertEqual(sorted(report.lines), ['S1', 'S4', 'S6'])
+            self.assertEqual([(s, pii) for s, pii, e in report.failures],
+                                                        [('details', 'S3')])
+            self.assertEqual([q.stage for q in quarantined], ['details'])
+            self.assertEqual(pending.getPendingPiis(), {'S4'})
+            self.assertTrue(checkpoints.isDone(report.key, 'S6'))
+            # the checkpoint stops at the failed ref, so it is retried
+            self.assertEqual(checkpoints.getLoadDate(report.key),
+                                                '2021-01-03T00:00:00.000Z')
+            self.assertIn('1 failed', str(report))
+            self.assertEqual([s.numIn for s in harvest.getStageStats()],
+                                                            [1, 6, 4, 2, 2])
+
+    def test_pdfStore(self):
+        with tempCwd():
+            client = fakeClient([self.respond]*20)
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            store = PdfStore('store')
+            store.importPdf(self.writePdf('old.pdf'), pmid='6')
+            task = HarvestTask('Bone', {'pub': '"Bone"', 'qs': 'mice'})
+            harvest = hp.JournalHarvest(client, checkpoints, pdfStore=store)
+            report = harvest.run([task])['Bone']
+
+            # S1, S2, S5 are downloaded (the same content), S6 we had
+            self.assertEqual((report.counts['pdfs'],
+                                report.counts['unchanged']), (3, 1))
+            self.assertEqual(store.getNumObjects(), 1)
+            self.assertEqual(store.lookup('pii', 'S1'),
+                                                store.lookup('pmid', '6'))
+            self.assertTrue(checkpoints.isDone(report.key, 'S6'))
+            store.close()
+
+    def writePdf(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.pdf)
+        return path
+
+    def respondBatch(self, method, url, headers, data):
+        """ FakeSession responder: the search finds S1 (Bone), S2 (Neuron)
+            and S3 (a look-alike journal)
+        """
+        if 'content/search' in url:
+            records = [searchResult('S1', 'Bone'), searchResult('S2', 'Neuron'),
+                       searchResult('S3', 'Neuron Reports')]
+            return jsonResponse({'resultsFound': 3, 'results': records})
+        pii = url.split('/pii/')[1].split('?')[0]
+        if 'view=META' in url:
+            return detailsResponse(pii, pmid=pii[1:])
+        return pdfResponse(self.pdf)
+
+    def test_batched(self):
+        with tempCwd():
+            client = fakeClient([self.respondBatch]*10)
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            tasks = [HarvestTask(name, {'pub': '"%s"' % name, 'qs': 'mice'})
+                                                for name in ['Bone', 'Neuron']]
+            harvest = hp.JournalHarvest(client, checkpoints,
+                            pdfPathFunc=lambda r: 'PMID_%s.pdf' % r.getPmid(),
+                            batchSize=8)
+            reports = harvest.run(tasks)
+
+            # one search for both journals, in the search stage
+            requests = client.getSession().requests
+            self.assertEqual(sum('content/search' in r[1] for r in requests), 1)
+            self.assertEqual(len(requests), 5)
+            self.assertEqual(harvest.getStageStats()[0].numIn, 1)
+            self.assertEqual([reports[n].counts['pdfs'] for n in reports],
+                                                                        [1, 1])
+            self.assertTrue(checkpoints.isDone(reports['Neuron'].key, 'S2'))
+            self.assertEqual(harvest.getBatch().getUnmatchedCounts(),
+                                                        {'Neuron Reports': 1})
+
+    def test_batchSearchFails(self):
+        with tempCwd():
+            client = fakeClient([FakeResponse(500, b'server error')])
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            tasks = [HarvestTask(name, {'pub': '"%s"' % name})
+                                                for name in ['Bone', 'Neuron']]
+            quarantined = []
+            harvest = hp.JournalHarvest(client, checkpoints, batchSize=8,
+                                        quarantineFunc=quarantined.append)
+            reports = harvest.run(tasks)
+            self.assertTrue(all(r.error is not None for r in reports.values()))
+            self.assertEqual([[r.name for r in q.item] for q in quarantined],
+                                                        [['Bone', 'Neuron']])
+
+    def test_truncatedSearch(self):
+        with tempCwd():
+            page = jsonResponse({'resultsFound': 6,
+                        'results': [searchResult('S1'), searchResult('S2')]})
+            client = fakeClient([page] + [self.respond]*4)
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            harvest = hp.JournalHarvest(client, checkpoints,
+                            pdfPathFunc=lambda r: 'PMID_%s.pdf' % r.getPmid(),
+                            maxResults=2, increment=2)
+            report = harvest.run([HarvestTask('Bone',
+                                        {'pub': '"Bone"', 'qs': 'mice'})])['Bone']
+
+            # only 2 of the 6 results were paged to: the checkpoint stays
+            #  so the next run's loadedAfter doesn't skip the other 4
+            self.assertTrue(report.truncated)
+            self.assertEqual(report.counts['pdfs'], 2)
+            self.assertTrue(checkpoints.isDone(report.key, 'S1'))
+            self.assertIsNone(checkpoints.getLoadDate(report.key))
+            self.assertIn('search truncated', str(report))
+
+    def test_searchFails(self):
+        with tempCwd():
+            client = fakeClient([FakeResponse(500, b'server error')])
+            checkpoints = HarvestCheckpoint('checkpoints.db')
+            harvest = hp.JournalHarvest(client, checkpoints,
+                            pdfPathFunc=lambda r: 'PMID_%s.pdf' % r.getPmid())
+            reports = harvest.run([HarvestTask('Bone', {'pub': '"Bone"'})])
+            self.assertIsNotNone(reports['Bone'].error)
+            self.assertIn('search failed', str(reports['Bone']))
+            self.assertIsNone(checkpoints.getLoadDate(reports['Bone'].key))
+
+# end class JournalHarvest_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for journalBatch.py. They don't talk to the real API.
+
+Usage:   python test_journalBatch.py [-v]
+"""
+import unittest
+import json
+import journalBatch as jb
+from test_SciDirectLib_offline import jsonResponse, fakeClient, searchResult
+
+######################################
+
+def record(pii, journal, loadDate='2021-01-05T00:00:00.000Z'):
+    r = searchResult(pii, journal)
+    r['loadDate'] = loadDate
+    return r
+
+class JournalIndex_tests(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(
+                jb.normalizeJournalName(' Seminars in Cell &  Developmental-Biology'),
+                'seminars in cell and developmental biology')
+
+    def test_lookupIsExact(self):
+        index = jb.JournalIndex(['Developmental Biology', 'Cell'])
+        self.assertEqual(index.lookup('DEVELOPMENTAL BIOLOGY'),
+                                                        'Developmental Biology')
+        self.assertIsNone(index.lookup(
+                                    'Current Topics in Developmental Biology'))
+        self.assertIsNone(index.lookup('Cells'))
+        self.assertIsNone(index.lookup(None))
+
+    def test_sameNormalizedName(self):
+        self.assertRaises(ValueError, jb.JournalIndex, ['A & B', 'a and b'])
+
+    def test_batchPubQuery(self):
+        self.assertEqual(jb.batchPubQuery(['Bone', 'Neuron']),
+                                                    '"Bone" OR "Neuron"')
+# end class JournalIndex_tests ######################################
+
+class BatchedJournalSearch_tests(unittest.TestCase):
+
+    def queries(self, names, loadedAfter='2021-01-01T00:00:00Z', qs='mice'):
+        return {name: {'pub': '"%s"' % name, 'qs': qs,
+                        'loadedAfter': loadedAfter} for name in names}
+
+    def test_batches(self):
+        queries = self.queries(['A', 'B', 'C'])
+        queries.update(self.queries(['D'], qs='rats'))
+        queries['C']['loadedAfter'] = '2021-02-01T00:00:00Z'
+        batch = jb.BatchedJournalSearch(fakeClient(), queries, batchSize=2)
+        self.assertEqual(batch.getBatches(), [['A', 'B'], ['C'], ['D']])
+        batch = jb.BatchedJournalSearch(fakeClient(), queries, batchSize=3)
+        self.assertEqual(batch.getBatches(), [['A', 'B', 'C'], ['D']])
+
+    def test_demultiplex(self):
+        queries = self.queries(['Developmental Biology', 'Bone', 'Neuron'])
+        queries['Bone']['loadedAfter'] = '2021-03-01T00:00:00Z'
+        page1 = [record('S1', 'Developmental Biology'),
+                 record('S2', 'Current Topics in Developmental Biology'),
+                 record('S3', 'Bone', '2021-02-01T00:00:00.000Z'),  # too old
+                 ]
+        page2 = [record('S4', 'Bone', '2021-03-02T00:00:00.000Z'),
+                 record('S5', 'developmental biology')]
+        client = fakeClient([
+                        jsonResponse({'resultsFound': 5, 'results': page1}),
+                        jsonResponse({'resultsFound': 5, 'results': page2})])
+        sunk = []
+        batch = jb.BatchedJournalSearch(client, queries, getAll=True,
+                            increment=3, resultSink=lambda s, recs:
+                                sunk.append((s.getName(), len(recs)))).execute()
+
+        # one search (2 pages) for the 3 journals, oldest loadedAfter
+        requests = client.getSession().requests
+        self.assertEqual(len(requests), 2)
+        sent = json.loads(requests[0][3])
+        self.assertEqual(sent['pub'],
+                            '"Developmental Biology" OR "Bone" OR "Neuron"')
+        self.assertEqual(sent['loadedAfter'], '2021-01-01T00:00:00Z')
+
+        results = batch.getResults()
+        self.assertEqual(list(results.keys()),
+                            ['Developmental Biology', 'Bone', 'Neuron'])
+        devBio = results['Developmental Biology']
+        self.assertEqual([r.getPii() for r in devBio.getIterator()],
+                                                                ['S1', 'S5'])
+        self.assertEqual([r.getPii() for r in results['Bone'].getIterator()],
+                                                                        ['S4'])
+        self.assertEqual(results['Neuron'].getTotalNumResults(), 0)
+        self.assertEqual(results['Bone'].getQuery(), queries['Bone'])
+        self.assertEqual(batch.getUnmatchedCounts(),
+                            {'Current Topics in Developmental Biology': 1})
+        self.assertEqual(batch.getNumBeforeLoadedAfter(), 1)
+        self.assertEqual(sunk, [('Developmental Biology', 1),
+                                ('Bone', 1), ('Developmental Biology', 1)])
+        self.assertEqual(batch.getSearches()[0].getResults(), [])
+        events = client.getMetrics().snapshot()['events']
+        self.assertEqual(events['batch_searches'], 1)
+        self.assertEqual(events['batch_results_dropped'], 2)
+
+    def test_otherBatchesJournals(self):
+        queries = self.queries(['A', 'B', 'C'])
+        queries['C']['qs'] = 'rats'
+        client = fakeClient([
+            jsonResponse({'resultsFound': 3, 'results': [record('P1', 'A'),
+                            record('P2', 'B'), record('P3', 'C')]}),
+            jsonResponse({'resultsFound': 2, 'results': [record('P3', 'C'),
+                            record('P4', 'A')]})])
+        batch = jb.BatchedJournalSearch(client, queries, batchSize=2,
+                                                        getAll=True).execute()
+        self.assertEqual(batch.getBatches(), [['A', 'B'], ['C']])
+
+        # each journal only gets its own batch's results, once
+        results = batch.getResults()
+        self.assertEqual([r.getPii() for r in results['A'].getIterator()],
+                                                                        ['P1'])
+        self.assertEqual([r.getPii() for r in results['C'].getIterator()],
+                                                                        ['P3'])
+        self.assertEqual(batch.getUnmatchedCounts(), {'C': 1, 'A': 1})
+
+    def test_tooManyForOneBatch(self):
+        queries = self.queries(['Bone', 'Neuron'])
+        queries['Neuron']['loadedAfter'] = '2021-02-01T00:00:00Z'
+        client = fakeClient([
+            jsonResponse({'resultsFound': 9,          # more than maxResults
+                            'results': [record('S1', 'Bone')]}),
+            jsonResponse({'resultsFound': 2, 'results': [record('S1', 'Bone'),
+                            record('S2', 'Bone')]}),
+            jsonResponse({'resultsFound': 1, 'results': [record('S3',
+                            'Neuron', '2021-02-02T00:00:00.000Z')]})])
+        batch = jb.BatchedJournalSearch(client, queries, getAll=True,
+                                        maxResults=4, increment=2).execute()
+
+        # the batch falls back to a search per journal, w/ its own query
+        sent = [json.loads(r[3]) for r in client.getSession().requests]
+        self.assertEqual([q['pub'] for q in sent],
+                            ['"Bone" OR "Neuron"', '"Bone"', '"Neuron"'])
+        self.assertEqual(sent[2]['loadedAfter'], '2021-02-01T00:00:00Z')
+        results = batch.getResults()
+        self.assertEqual([r.getPii() for r in results['Bone'].getIterator()],
+                                                                ['S1', 'S2'])
+        self.assertEqual([r.getPii() for r in results['Neuron'].getIterator()],
+                                                                        ['S3'])
+        self.assertFalse(batch.getSearches()[0].isTruncated())
+        events = client.getMetrics().snapshot()['events']
+        self.assertEqual(events['batch_fallbacks'], 1)
+
+    def test_compact(self):
+        client = fakeClient([jsonResponse({'resultsFound': 1,
+                                    'results': [record('S1', 'Bone')]})])
+        batch = jb.BatchedJournalSearch(client, self.queries(['Bone']),
+                                                    compact=True).execute()
+        results = batch.getResults()['Bone']
+        refs = list(results.getIterator())
+        self.assertIsNone(refs[0].getSearchResultsFields())
+        self.assertRaises(ValueError, results.getIterator)
+
+    def test_noStreaming(self):
+        self.assertRaises(ValueError, jb.BatchedJournalSearch, fakeClient(),
+                                            self.queries(['Bone']), stream=True)
+
+# end class BatchedJournalSearch_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for jsonCodec.py
+
+Usage:   python test_jsonCodec.py [-v]
+"""
+import unittest
+import jsonCodec
+
+######################################
+
+class jsonCodec_tests(unittest.TestCase):
+
+    doc = {'full-text-retrieval-response': {'pubmed-id': '123',
+                            'coredata': {'dc:title': 'Mice été'}}}
+
+    def setUp(self):
+        self.orjson = jsonCodec.orjson
+    def tearDown(self):
+        jsonCodec.orjson = self.orjson
+
+    def check(self):
+        text = jsonCodec.dumps(self.doc)
+        self.assertIsInstance(text, str)
+        self.assertEqual(jsonCodec.loads(text), self.doc)
+        self.assertEqual(jsonCodec.loads(text.encode('utf-8')), self.doc)
+        self.assertRaises(ValueError, jsonCodec.loads, b'{"pii": ')
+
+    def test_default(self):
+        self.check()
+
+    def test_stdlibFallback(self):
+        jsonCodec.orjson = None
+        self.assertEqual(jsonCodec.getParser(), 'json')
+        self.check()
+
+# end class jsonCodec_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
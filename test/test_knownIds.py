@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for knownIds.py
+
+Usage:   python test_knownIds.py [-v]
+"""
+import unittest
+import knownIds as ki
+from test_SciDirectLib_offline import fakeClient, searchResult, \
+                                        detailsResponse, tempCwd
+import SciDirectLib as sdl
+
+######################################
+
+class parseIds_tests(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(ki.parseIds('123|10.1016/J.Bone.2021.1\tPMID:0456\n'),
+                            [('pmid', '123'), ('doi', '10.1016/j.bone.2021.1'),
+                             ('pmid', '456')])
+        self.assertEqual(ki.parseIds('MGI:12345, https://doi.org/10.1/X'),
+                                                        [('doi', '10.1/x')])
+        self.assertEqual(ki.parseIds(''), [])
+# end class parseIds_tests ######################################
+
+class BloomFilter_tests(unittest.TestCase):
+
+    def test_noFalseNegatives(self):
+        bloom = ki.BloomFilter(1000, errorRate=0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertTrue(all(str(i) in bloom for i in range(1000)))
+        self.assertEqual(len(bloom), 1000)
+
+    def test_falsePositiveRate(self):
+        bloom = ki.BloomFilter(1000, errorRate=0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        falsePositives = sum(str(i) in bloom for i in range(1000, 11000))
+        self.assertLess(falsePositives, 300)     # ~1% of 10000
+        self.assertLess(bloom.getNumBytes(), 1300)
+# end class BloomFilter_tests ######################################
+
+class KnownIdFilter_tests(unittest.TestCase):
+
+    def ref(self, pii, pmid, doi):
+        client = fakeClient([detailsResponse(pii, pmid)])
+        record = searchResult(pii)
+        record['doi'] = doi
+        return sdl.SciDirectReference(client, record)
+
+    def check(self, known):
+        byDoi = self.ref('S1', '1', '10.1016/KNOWN')
+        self.assertTrue(known.skipByDoi(byDoi))
+        self.assertEqual(byDoi.getElsClient().getSession().requests, [])
+        byPmid = self.ref('S2', '456', '10.1016/new')
+        self.assertFalse(known.skipByDoi(byPmid))
+        self.assertTrue(known.skipByPmid(byPmid))
+        new = self.ref('S3', '789', '10.1016/new')
+        self.assertFalse(known.skipByDoi(new))
+        self.assertFalse(known.skipByPmid(new))
+        self.assertEqual(known.getStats(), {'checked': 3, 'skippedByDoi': 1,
+                'skippedByPmid': 1, 'pdfsSaved': 2, 'requestsSaved': 3})
+
+    def test_exact(self):
+        self.check(ki.KnownIdFilter(pmids=[123, '456'], dois=['10.1016/known']))
+
+    def test_load(self):
+        for compact in (False, True):
+            with tempCwd():
+                with open('export.txt', 'w') as f:
+                    f.write('456|doi:10.1016/Known\n123\n')
+                known = ki.loadKnownIds('export.txt', compact=compact)
+            self.assertEqual(known.isCompact(), compact)
+            self.assertEqual((known.getNumPmids(), known.getNumDois()), (2, 1))
+            self.check(known)
+
+    def test_empty(self):
+        known = ki.KnownIdFilter(compact=True)
+        self.assertFalse(known.hasPmid('123'))
+        self.assertFalse(known.hasDoi(None))
+# end class KnownIdFilter_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
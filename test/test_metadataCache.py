@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for metadataCache.py
+
+Usage:   python test_metadataCache.py [-v]
+"""
+import unittest
+import os
+import tempfile
+import metadataCache as mc
+
+######################################
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+    def clock(self):
+        self.now += 0.001       # so each call sees time move a little
+        return self.now
+
+class MetadataCacheTests(object):
+    """ Tests for both cache backends. Subclasses define makeCache()
+    """
+    payload = {'full-text-retrieval-response': {'pubmed-id': '123',
+                                                'coredata': {'pubType': 'fla'}}}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fc = FakeClock()
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def cache(self, **kwargs):
+        c = self.makeCache(**kwargs)
+        c._clock = self.fc.clock
+        return c
+
+    def test_getPut(self):
+        c = self.cache()
+        self.assertIsNone(c.get('S1', 'META'))
+        c.put('S1', 'META', self.payload)
+        self.assertEqual(c.get('S1', 'META'), self.payload)
+        self.assertIsNone(c.get('S1', 'FULL'))      # keyed by view too
+        stats = c.getStats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['puts']),
+                                                                    (1, 2, 1))
+
+    def test_persistent(self):
+        self.cache().put('S1', 'META', self.payload)
+        self.assertEqual(self.cache().get('S1', 'META'), self.payload)
+
+    def test_ttl(self):
+        c = self.cache(ttl=10)
+        c.put('S1', 'META', self.payload)
+        c.put('S2', 'META', self.payload, ttl=100)
+        self.fc.now += 50
+        self.assertIsNone(c.get('S1', 'META'))
+        self.assertEqual(c.get('S2', 'META'), self.payload)
+        self.assertEqual(c.getStats()['expired'], 1)
+
+    def test_maxEntries_evictsLeastRecentlyUsed(self):
+        c = self.cache(maxEntries=2)
+        c.put('S1', 'META', self.payload)
+        self.fc.now += 1
+        c.put('S2', 'META', self.payload)
+        self.fc.now += 1
+        c.get('S1', 'META')             # S2 is now least recently used
+        self.fc.now += 1
+        c.put('S3', 'META', self.payload)
+        self.assertEqual(c.getNumEntries(), 2)
+        self.assertIsNone(c.get('S2', 'META'))
+        self.assertIsNotNone(c.get('S1', 'META'))
+        self.assertEqual(c.getStats()['evictions'], 1)
+
+    def test_maxBytes(self):
+        c = self.cache(maxBytes=250)
+        for i in range(5):
+            self.fc.now += 1
+            c.put('S%d' % i, 'META', self.payload)
+        self.assertLess(c.getNumEntries(), 5)
+        self.assertIsNotNone(c.get('S4', 'META'))
+
+    def test_validatorsAndRefresh(self):
+        c = self.cache(ttl=10)
+        c.put('S1', 'META', self.payload, validators={'ETag': '"v1"'})
+        self.fc.now += 50
+        self.assertIsNone(c.get('S1', 'META'))
+        entry = c.getEntry('S1', 'META')
+        self.assertTrue(entry.expired)
+        self.assertEqual(entry.payload, self.payload)
+        self.assertEqual(entry.validators, {'ETag': '"v1"'})
+        c.refresh('S1', 'META')
+        self.assertEqual(c.get('S1', 'META'), self.payload)
+        self.assertEqual(c.getStats()['revalidated'], 1)
+
+    def test_deleteClear(self):
+        c = self.cache()
+        c.put('S1', 'META', self.payload)
+        c.put('S2', 'META', self.payload)
+        c.delete('S1', 'META')
+        self.assertIsNone(c.get('S1', 'META'))
+        c.clear()
+        self.assertEqual(c.getNumEntries(), 0)
+
+class SqliteMetadataCache_tests(MetadataCacheTests, unittest.TestCase):
+    def makeCache(self, **kwargs):
+        return mc.SqliteMetadataCache(os.path.join(self.tmpdir.name, 'c.db'),
+                                                                    **kwargs)
+# end class SqliteMetadataCache_tests ######################################
+
+class DirectoryMetadataCache_tests(MetadataCacheTests, unittest.TestCase):
+    def makeCache(self, **kwargs):
+        return mc.DirectoryMetadataCache(os.path.join(self.tmpdir.name, 'c'),
+                                                                    **kwargs)
+# end class DirectoryMetadataCache_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for pdfStore.py. They don't talk to the real API.
+
+Usage:   python test_pdfStore.py [-v]
+"""
+import unittest
+import os
+import time
+import hashlib
+import tempfile
+import pdfStore as ps
+import SciDirectLib as sdl
+from test_SciDirectLib_offline import FakeResponse, fakeClient, searchResult, \
+                                        detailsResponse, pdfResponse
+
+######################################
+
+class PdfStore_tests(unittest.TestCase):
+
+    pdf = b'%PDF-1.7' + b'x'*1000
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'store')
+        self.store = ps.PdfStore(self.root)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def ref(self, pii, pmid, pdf):
+        """ Return a ref w/ its details loaded, whose client serves pdf
+        """
+        client = fakeClient([detailsResponse(pii, pmid), pdfResponse(pdf)])
+        ref = sdl.SciDirectReference(client, searchResult(pii))
+        ref.getPmid()
+        return ref
+
+    def tmpFiles(self):
+        return os.listdir(os.path.join(self.root, 'tmp'))
+
+    def test_savePdf(self):
+        ref = self.ref('S1', '111', self.pdf)
+        self.assertTrue(self.store.savePdf(ref))
+        sha256 = hashlib.sha256(self.pdf).hexdigest()
+        path = self.store.getPdfPath('pmid', '111')
+        self.assertEqual(path, os.path.join(self.root, 'objects', sha256[:2],
+                                            sha256[2:4], sha256 + '.pdf'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.pdf)
+        self.assertEqual(self.store.lookup('pii', 'S1'), sha256)
+        self.assertTrue(self.store.hasDoi('10.1016/s1'))    # any case
+        self.assertTrue(self.store.hasPmid(111))
+        self.assertFalse(self.store.hasPmid('222'))
+        self.assertEqual(self.tmpFiles(), [])
+
+        # persists
+        self.store.close()
+        self.store = ps.PdfStore(self.root)
+        self.assertEqual(self.store.getPdfPath('pii', 'S1'), path)
+
+    def test_skipsKnownIds(self):
+        self.store.savePdf(self.ref('S1', '111', self.pdf))
+        # known by PII, no requests at all
+        ref = sdl.SciDirectReference(fakeClient([]), searchResult('S1'))
+        self.assertFalse(self.store.savePdf(ref))
+        self.assertEqual(self.store.getStats(),
+                {'downloaded': 1, 'imported': 0, 'deduped': 0, 'skipped': 1})
+
+    def test_dedupsContent(self):
+        self.store.savePdf(self.ref('S1', '111', self.pdf))
+        self.store.savePdf(self.ref('S2', '222', self.pdf))
+        self.store.savePdf(self.ref('S3', '333', self.pdf + b'y'))
+        self.assertEqual(self.store.getNumObjects(), 2)
+        self.assertEqual(self.store.lookup('pmid', '111'),
+                                            self.store.lookup('pmid', '222'))
+        self.assertNotEqual(self.store.lookup('pmid', '111'),
+                                            self.store.lookup('pmid', '333'))
+        self.assertEqual(self.store.getStats()['deduped'], 1)
+        self.assertEqual(self.tmpFiles(), [])
+
+    def test_failedDownload(self):
+        client = fakeClient([detailsResponse('S1', '111'),
+                             pdfResponse(b'<html>oops</html>')])
+        ref = sdl.SciDirectReference(client, searchResult('S1'))
+        with self.assertRaises(ValueError):
+            self.store.savePdf(ref)
+        self.assertFalse(self.store.hasPii('S1'))
+        self.assertEqual(self.store.getNumObjects(), 0)
+        self.assertEqual(self.tmpFiles(), [])
+
+    def test_savePdfs(self):
+        refs = [self.ref('S1', '111', self.pdf),
+                sdl.SciDirectReference(fakeClient([detailsResponse('S2', '222'),
+                                    FakeResponse(500, b'server error')]),
+                                    searchResult('S2'))]
+        failures = self.store.savePdfs(refs, workers=2)
+        self.assertEqual(list(failures.keys()), ['S2'])
+        self.assertTrue(self.store.hasPii('S1'))
+
+    def test_importPdf(self):
+        path = os.path.join(self.tmpdir.name, 'PMID_111.pdf')
+        with open(path, 'wb') as f:
+            f.write(self.pdf)
+        sha256 = self.store.importPdf(path, pmid='111')
+        self.assertEqual(sha256, hashlib.sha256(self.pdf).hexdigest())
+        self.assertTrue(self.store.hasPmid('111'))
+
+        # a download of the same PMID is skipped, no request needed
+        ref = sdl.SciDirectReference(fakeClient([detailsResponse('S1', '111')]),
+                                                            searchResult('S1'))
+        self.assertFalse(self.store.savePdf(ref))
+        self.assertEqual(self.store.lookup('pii', 'S1'), sha256)
+
+        with open(path, 'wb') as f:
+            f.write(b'not a pdf')
+        with self.assertRaises(ValueError):
+            self.store.importPdf(path, pmid='222')
+        self.assertEqual(self.tmpFiles(), [])
+
+    def test_removesOldTmpFiles(self):
+        tmpDir = os.path.join(self.root, 'tmp')
+        for name, age in [('old.pdf', 2*ps.TMP_MAX_AGE), ('new.pdf', 0)]:
+            path = os.path.join(tmpDir, name)
+            open(path, 'wb').close()
+            then = time.time() - age
+            os.utime(path, (then, then))
+        ps.PdfStore(self.root).close()
+        self.assertEqual(self.tmpFiles(), ['new.pdf'])
+
+# end class PdfStore_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for pendingPmids.py. They don't talk to the real API.
+
+Usage:   python test_pendingPmids.py [-v]
+"""
+import unittest
+import os
+import tempfile
+import pendingPmids as pp
+import SciDirectLib as sdl
+from test_SciDirectLib_offline import FakeResponse, fakeClient, searchResult, \
+                                        detailsResponse, jsonResponse
+
+######################################
+
+def noPmidResponse(pii):
+    return jsonResponse({'full-text-retrieval-response': {
+                                'coredata': {'pii': pii, 'pubType': 'fla'}}})
+
+class PendingPmidQueue_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbPath = os.path.join(self.tmpdir.name, 'pending.db')
+        self.queue = self.newQueue()
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmpdir.cleanup()
+
+    def newQueue(self):
+        queue = pp.PendingPmidQueue(self.dbPath, firstDelay=100, backoff=2,
+                                                    maxDelay=300, maxChecks=4)
+        self.now = 1000.0
+        queue._clock = lambda: self.now
+        return queue
+
+    def ref(self, pii):
+        return sdl.SciDirectReference(fakeClient(), searchResult(pii),
+                                                                compact=True)
+
+    def test_addAndPersist(self):
+        self.assertTrue(self.queue.add(self.ref('S1'), 'key1'))
+        self.assertFalse(self.queue.add(self.ref('S1'), 'key1'))
+        self.queue.add(self.ref('S2'), 'key2')
+        self.assertTrue(self.queue.isPending('S1'))
+        self.assertEqual(self.queue.getPendingPiis('key1'), {'S1'})
+        self.queue.close()
+
+        self.queue = self.newQueue()
+        self.assertEqual(self.queue.getPendingPiis(), {'S1', 'S2'})
+        self.assertEqual(self.queue.getNumPending(), 2)
+
+    def test_schedule(self):
+        self.queue.add(self.ref('S1'), 'key1')
+        self.assertEqual(self.queue.getDue(), [])
+        self.now += 100
+        entries = self.queue.getDue()
+        self.assertEqual([e.pii for e in entries], ['S1'])
+        self.assertEqual(entries[0].key, 'key1')
+        ref = entries[0].getReference(fakeClient())
+        self.assertEqual(ref.getDoi(), '10.1016/S1')
+        self.assertEqual(ref.getJournal(), 'Bone')
+
+        # waits 200, then 300 (maxDelay), then gives up after maxChecks
+        self.assertEqual(self.queue.reschedule('S1'), self.now + 200)
+        self.now += 199
+        self.assertEqual(self.queue.getDue(), [])
+        self.now += 1
+        self.assertEqual(self.queue.reschedule('S1'), self.now + 300)
+        self.assertIsNotNone(self.queue.reschedule('S1'))
+        self.assertIsNone(self.queue.reschedule('S1'))
+        self.assertFalse(self.queue.isPending('S1'))
+        self.assertEqual(self.queue.getStats(),
+                    {'added': 1, 'rechecked': 4, 'found': 0, 'dropped': 1})
+
+    def test_recheckDue(self):
+        for pii in ['S1', 'S2', 'S3', 'S4']:
+            self.queue.add(self.ref(pii), 'key')
+        self.now += 100
+        client = fakeClient([detailsResponse('S1', '111'),
+                             noPmidResponse('S2'),
+                             FakeResponse(500, b'server error'),
+                             detailsResponse('S4', '444')])
+        found, failures = pp.recheckDue(self.queue, client, workers=1, limit=3)
+
+        self.assertEqual([(r.getPii(), r.getPmid(), key) for r, key in found],
+                                                        [('S1', '111', 'key')])
+        self.assertEqual(list(failures.keys()), ['S3'])
+        self.assertEqual(len(client.getSession().requests), 3)
+        self.assertEqual(self.queue.getPendingPiis(), {'S2', 'S3', 'S4'})
+        self.assertEqual([e.pii for e in self.queue.getDue()], ['S3', 'S4'])
+
+# end class PendingPmidQueue_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for querySplit.py. They don't talk to the API (see
+test_SciDirectLib_offline.py for searches that split).
+
+Usage:   python test_querySplit.py [-v]
+"""
+import unittest
+import datetime
+import querySplit as qsp
+
+######################################
+
+class splitByYear_tests(unittest.TestCase):
+
+    def test_parseYears(self):
+        self.assertEqual(qsp.parseYears('2015'), (2015, 2015))
+        self.assertEqual(qsp.parseYears(' 2015 - 2020'), (2015, 2020))
+        self.assertEqual(qsp.parseYears(None),
+                        (qsp.FIRST_YEAR, datetime.date.today().year + 1))
+        for bad in ['15', '2020-2015', 'recent']:
+            with self.assertRaises(ValueError):
+                qsp.parseYears(bad)
+
+    def test_split(self):
+        query = {'qs': 'mice', 'pub': '"Bone"', 'date': '2010-2015'}
+        self.assertEqual(qsp.splitByYear(query),
+                    [dict(query, date='2013-2015'), dict(query, date='2010-2012')])
+        self.assertEqual(qsp.splitByYear(dict(query, date='2010-2011')),
+                    [dict(query, date='2011'), dict(query, date='2010')])
+        self.assertIsNone(qsp.splitByYear(dict(query, date='2010')))
+        self.assertEqual(query['date'], '2010-2015')    # not changed
+
+    def test_splitUndated(self):
+        # the recent years 1st, not 1823..now bisected
+        last = datetime.date.today().year + 1
+        query = {'qs': 'mice'}
+        self.assertEqual(qsp.splitByYear(query), [
+                dict(query, date='%d-%d' % (last - qsp.RECENT_YEARS + 1, last)),
+                dict(query, date='%d-%d' % (qsp.FIRST_YEAR,
+                                                last - qsp.RECENT_YEARS))])
+
+    def test_splitsDown(self):
+        queries = [{'qs': 'mice'}]
+        years = []
+        while queries:
+            query = queries.pop()
+            subQueries = qsp.splitByYear(query)
+            if subQueries is None:
+                years.append(int(query['date']))
+            else:
+                queries += subQueries
+        first, last = qsp.parseYears(None)
+        self.assertEqual(sorted(years), list(range(first, last + 1)))
+
+# end class splitByYear_tests ######################################
+
+class splitByTerms_tests(unittest.TestCase):
+
+    def test_split(self):
+        split = qsp.splitByTerms(['brain', 'heart'])
+        query = {'qs': 'mice', 'date': '2020'}
+        self.assertEqual([q['qs'] for q in split(query)],
+                ['(mice) AND (brain)',
+                 '(mice) AND (heart) AND NOT (brain)',
+                 '(mice) AND NOT (brain OR heart)'])
+        for subQuery in split(query):
+            self.assertEqual(subQuery['date'], '2020')
+            self.assertIsNone(split(subQuery))      # doesn't split again
+        self.assertIsNone(split({'pub': '"Bone"'}))
+
+    def test_noTerms(self):
+        with self.assertRaises(ValueError):
+            qsp.splitByTerms([])
+
+# end class splitByTerms_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for rateLimiter.py
+
+Usage:   python test_rateLimiter.py [-v]
+"""
+import unittest
+import os
+import tempfile
+import threading
+import rateLimiter as rl
+
+######################################
+
+class FakeClock(object):
+    """ A clock that only moves when somebody sleeps
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+    def clock(self): return self.now
+    def sleep(self, secs):
+        self.slept.append(secs)
+        self.now += secs
+
+def useFakeClock(limiter, fakeClock):
+    limiter._clock = fakeClock.clock
+    limiter._sleep = fakeClock.sleep
+    if hasattr(limiter, '_ts_last'):
+        limiter._ts_last = fakeClock.now
+    return limiter
+
+######################################
+
+class TokenBucketLimiter_tests(unittest.TestCase):
+
+    def test_burstThenRate(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.TokenBucketLimiter(rate=2, burst=3), fc)
+        waits = [limiter.acquire() for i in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        self.assertAlmostEqual(waits[4], 0.5)
+
+    def test_refillCappedAtBurst(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.TokenBucketLimiter(rate=1, burst=2), fc)
+        fc.now += 100
+        waits = [limiter.acquire() for i in range(3)]
+        self.assertEqual(waits, [0.0, 0.0, 1.0])
+
+    def test_threadsReserveInOrder(self):
+        fc = FakeClock()
+        limiter = rl.TokenBucketLimiter(rate=10, burst=1)
+        limiter._clock = fc.clock
+        limiter._sleep = lambda secs: None    # don't actually move the clock
+        limiter._ts_last = fc.now
+        waits = []
+        def worker():
+            waits.append(limiter.acquire())
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual([round(w, 6) for w in sorted(waits)],
+                                                [0.0, 0.1, 0.2, 0.3, 0.4])
+
+    def test_badParams(self):
+        self.assertRaises(ValueError, rl.TokenBucketLimiter, rate=0)
+        self.assertRaises(ValueError, rl.TokenBucketLimiter, burst=0)
+
+# end class TokenBucketLimiter_tests ######################################
+
+class AdaptiveRateLimiter_tests(unittest.TestCase):
+
+    def test_aimd(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.AdaptiveRateLimiter(rate=2, increase=0.5),
+                                                                        fc)
+        limiter.onThrottled()
+        self.assertEqual(limiter.getRate(), 1.0)
+        limiter.onSuccess()
+        limiter.onSuccess()
+        limiter.onSuccess()
+        self.assertEqual(limiter.getRate(), 2.0)    # capped at maxRate
+
+    def test_minRate(self):
+        limiter = rl.AdaptiveRateLimiter(rate=1, minRate=0.4)
+        for i in range(5):
+            limiter.onThrottled()
+        self.assertEqual(limiter.getRate(), 0.4)
+
+    def test_throttledPausesEveryone(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.AdaptiveRateLimiter(rate=1, burst=5), fc)
+        limiter.onThrottled(delay=10)
+        self.assertAlmostEqual(limiter.acquire(), 10.0)
+
+    def test_quota(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.AdaptiveRateLimiter(rate=1, minRate=0.01),
+                                                                        fc)
+        limiter.onQuota(15, 50)
+        self.assertAlmostEqual(limiter.getRate(), 0.3)
+        limiter.onSuccess()
+        self.assertAlmostEqual(limiter.getRate(), 0.3)  # can't exceed quota
+        limiter.onQuota(0, 50)
+        self.assertAlmostEqual(limiter.acquire(), 50.0)
+
+    def test_weeklyQuota(self):
+        # what the API sends: the key's weekly quota, reset days away
+        fc = FakeClock()
+        limiter = useFakeClock(rl.AdaptiveRateLimiter(rate=1), fc)
+        limiter.onQuota(15, 50)                 # a short window caps it
+        self.assertAlmostEqual(limiter.getRate(), 0.3)
+        for i in range(50):
+            limiter.onQuota(19990 - i, 6*24*60*60)
+            limiter.onSuccess()
+        self.assertEqual(limiter.getRate(), 1.0)    # doesn't collapse
+        limiter.onQuota(0, 6*24*60*60)          # but none left: wait it out
+        self.assertAlmostEqual(limiter.acquire(), 6*24*60*60)
+
+    def test_setMaxRate(self):
+        limiter = rl.AdaptiveRateLimiter(rate=4, increase=1)
+        limiter.setMaxRate(2)
+        self.assertEqual(limiter.getRate(), 2.0)
+        limiter.setMaxRate(3)
+        limiter.onSuccess()
+        limiter.onSuccess()
+        self.assertEqual(limiter.getRate(), 3.0)
+        self.assertRaises(ValueError, limiter.setMaxRate, 0)
+
+    def test_concurrentFeedback(self):
+        # no update is lost when many threads report at once
+        limiter = rl.AdaptiveRateLimiter(rate=1, minRate=1e-6, maxRate=1000,
+                                                            increase=0.25)
+        def report(func, n):
+            for i in range(n):
+                func()
+        threads = [threading.Thread(target=report, args=(limiter.onThrottled,
+                                                        2)) for i in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertAlmostEqual(limiter.getRate(), 0.5**10)
+
+        threads = [threading.Thread(target=report, args=(limiter.onSuccess,
+                                                        100)) for i in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertAlmostEqual(limiter.getRate(), 0.5**10 + 8*100*0.25)
+
+# end class AdaptiveRateLimiter_tests ######################################
+
+class SlidingWindowLimiter_tests(unittest.TestCase):
+
+    def test_window(self):
+        fc = FakeClock()
+        limiter = useFakeClock(rl.SlidingWindowLimiter(maxRequests=2,
+                                                            window=1.0), fc)
+        waits = [limiter.acquire() for i in range(4)]
+        self.assertEqual(waits, [0.0, 0.0, 1.0, 0.0])
+        self.assertEqual(limiter.getRate(), 2.0)
+
+# end class SlidingWindowLimiter_tests ######################################
+
+class SqliteRateLimiter_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbPath = os.path.join(self.tmpdir.name, 'rate.db')
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sharedBetweenLimiters(self):
+        fc = FakeClock()
+        # two limiters on one file act like one bucket (e.g., two processes)
+        l1 = useFakeClock(rl.SqliteRateLimiter(self.dbPath, rate=1, burst=2),
+                                                                        fc)
+        l2 = useFakeClock(rl.SqliteRateLimiter(self.dbPath, rate=1, burst=2),
+                                                                        fc)
+        self.assertEqual(l1.acquire(), 0.0)
+        self.assertEqual(l2.acquire(), 0.0)
+        self.assertEqual(l1.acquire(), 1.0)
+        self.assertEqual(l2.acquire(), 1.0)
+
+    def test_separateNames(self):
+        fc = FakeClock()
+        l1 = useFakeClock(rl.SqliteRateLimiter(self.dbPath, name='a'), fc)
+        l2 = useFakeClock(rl.SqliteRateLimiter(self.dbPath, name='b'), fc)
+        self.assertEqual(l1.acquire(), 0.0)
+        self.assertEqual(l2.acquire(), 0.0)
+
+# end class SqliteRateLimiter_tests ######################################
+
+class getSharedLimiter_tests(unittest.TestCase):
+
+    def test_sameKeySameLimiter(self):
+        l1 = rl.getSharedLimiter('test-key-1')
+        self.assertIs(l1, rl.getSharedLimiter('test-key-1'))
+        self.assertIsNot(l1, rl.getSharedLimiter('test-key-2'))
+
+# end class getSharedLimiter_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for recordReplay.py
+
+Usage:   python test_recordReplay.py [-v]
+"""
+import unittest
+import os
+import json
+import tempfile
+import requests
+import SciDirectLib as sdl
+import recordReplay as rr
+import rateLimiter
+from test_SciDirectLib_offline import FakeResponse, FakeSession, \
+                        jsonResponse, detailsResponse, searchPage, pdfResponse
+
+######################################
+
+class recordReplay_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cassetteDir = os.path.join(self.tmpdir.name, 'cassette')
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def record(self, responses):
+        """ Return an ElsClient that records the responses from a FakeSession
+        """
+        session = rr.RecordingSession(self.cassetteDir,
+                                            session=FakeSession(responses),
+                                            secrets=('secret-key', None))
+        return sdl.ElsClient('secret-key', inst_token='secret-token',
+                                session=session,
+                                rateLimiter=rateLimiter.NullRateLimiter())
+
+    def test_recordThenReplay(self):
+        detailsUrl = sdl.url_base + 'content/article/pii/S1?view=META'
+        pdfUrl = sdl.url_base + 'content/article/pii/S1'
+        query = json.dumps({'qs': 'mice'})
+        pdf = FakeResponse(content=b'%PDF-1.7 \xff\xfe',
+                            headers={'Content-Type': 'application/pdf'})
+        search = jsonResponse({'resultsFound': 0})
+        search.headers['Content-Type'] = 'application/json'
+        search.headers['X-ELS-APIKey'] = 'secret-key'   # the API echoes it
+        client = self.record([detailsResponse('S1', pmid='111'), pdf, search])
+        recorded = [client.execGetRequest(detailsUrl),
+                    client.execGetRequest(pdfUrl, contentType='pdf'),
+                    client.execPutRequest(sdl.search_url, query)]
+
+        # no credentials in the cassette
+        for name in os.listdir(self.cassetteDir):
+            with open(os.path.join(self.cassetteDir, name), 'rb') as f:
+                self.assertNotIn(b'secret', f.read())
+
+        replay = rr.replayClient(self.cassetteDir)
+        self.assertEqual([replay.execGetRequest(detailsUrl),
+                          replay.execGetRequest(pdfUrl, contentType='pdf'),
+                          replay.execPutRequest(sdl.search_url, query)],
+                                                                    recorded)
+
+    def test_matchesAccept(self):
+        # an article's json and pdf have the same URL
+        url = sdl.url_base + 'content/article/pii/S1'
+        pdf = FakeResponse(content=b'%PDF-1.7',
+                            headers={'Content-Type': 'application/pdf'})
+        client = self.record([detailsResponse('S1', pmid='111'), pdf])
+        client.execGetRequest(url)
+        client.execGetRequest(url, contentType='pdf')
+
+        replay = rr.replayClient(self.cassetteDir)
+        self.assertEqual(replay.execGetRequest(url, contentType='pdf'),
+                                                                b'%PDF-1.7')
+        self.assertEqual(replay.execGetRequest(url)[
+                        'full-text-retrieval-response']['pubmed-id'], '111')
+
+    def test_replaySearchAndRefs(self):
+        # a small harvest, recorded here (no committed cassette): a 2 page
+        #  search, an article's details and its pdf
+        pdf = b'%PDF-1.7 \xff' + b'x'*100
+        client = self.record([searchPage(['S1', 'S2'], 3),
+                              searchPage(['S3'], 3),
+                              detailsResponse('S2', pmid='222'),
+                              pdfResponse(pdf)])
+        query = {'qs': 'mice', 'pub': '"Bone"'}
+
+        def harvest(elsClient):
+            search = sdl.SciDirectSearch(elsClient, query, getAll=True,
+                                                        increment=2).execute()
+            refs = list(search.getIterator())
+            return ([r.getPii() for r in refs], refs[1].getPmid(),
+                    refs[1].getPubType(), refs[1].getPdf())
+        recorded = harvest(client)
+        self.assertEqual(recorded, (['S1', 'S2', 'S3'], '222', 'fla', pdf))
+        self.assertEqual(harvest(rr.replayClient(self.cassetteDir)), recorded)
+
+    def test_repeatedRequests(self):
+        url = sdl.url_base + 'content/article/pii/S1?view=META'
+        client = self.record([FakeResponse(404, b'not yet'),
+                              detailsResponse('S1', pmid='111')])
+        self.assertRaises(requests.HTTPError, client.execGetRequest, url)
+        client.execGetRequest(url)
+
+        replay = rr.replayClient(self.cassetteDir)
+        self.assertRaises(requests.HTTPError, replay.execGetRequest, url)
+        for i in range(2):      # the last response repeats
+            self.assertEqual(replay.execGetRequest(url)[
+                        'full-text-retrieval-response']['pubmed-id'], '111')
+
+    def test_miss(self):
+        replay = rr.replayClient(self.cassetteDir)
+        self.assertRaises(rr.CassetteMiss, replay.execGetRequest,
+                                            sdl.url_base + 'content/foo')
+
+    def test_latency(self):
+        cassette = rr.Cassette(self.cassetteDir)
+        cassette.addResponse('GET', 'http://x', None,
+                    rr.CassetteResponse(200, {}, b'{}', elapsed=0.25))
+        session = rr.ReplaySession(self.cassetteDir, latency=True)
+        slept = []
+        session._sleep = slept.append
+        self.assertEqual(session.request('GET', 'http://x').content, b'{}')
+        self.assertEqual(slept, [0.25])
+
+# end class recordReplay_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for resultSink.py
+
+Usage:   python test_resultSink.py [-v]
+"""
+import unittest
+import os
+import json
+import tempfile
+import resultSink as rs
+
+######################################
+
+class FakeSearch(object):
+    def __init__(self, pub): self.pub = pub
+
+class JsonlResultSink_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirPath = os.path.join(self.tmpdir.name, 'results')
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def readLines(self, path):
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_filePerSearch(self):
+        sink = rs.JsonlResultSink(self.dirPath)
+        s1, s2 = FakeSearch('Bone'), FakeSearch('Neuron')
+        self.assertIsNone(sink.getPath(s1))
+        sink(s1, [{'pii': 'S1'}, {'pii': 'S2'}])
+        sink(s2, [{'pii': 'N1'}])
+        sink(s1, [{'pii': 'S3'}])
+        self.assertNotEqual(sink.getPath(s1), sink.getPath(s2))
+        self.assertEqual([r['pii'] for r in self.readLines(sink.getPath(s1))],
+                                                        ['S1', 'S2', 'S3'])
+        self.assertEqual(self.readLines(sink.getPath(s2)), [{'pii': 'N1'}])
+
+    def test_nameFunc(self):
+        sink = rs.JsonlResultSink(self.dirPath,
+                                    nameFunc=lambda s: s.pub + '.jsonl')
+        sink(FakeSearch('Bone'), [{'pii': 'S1'}])
+        sink(FakeSearch('Bone'), [{'pii': 'S2'}])    # appends
+        path = os.path.join(self.dirPath, 'Bone.jsonl')
+        self.assertEqual(len(self.readLines(path)), 2)
+
+    def test_emptyPage(self):
+        sink = rs.JsonlResultSink(self.dirPath)
+        sink(FakeSearch('Bone'), [])
+        self.assertFalse(os.path.exists(self.dirPath))
+
+# end class JsonlResultSink_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for retryPolicy.py
+
+Usage:   python test_retryPolicy.py [-v]
+"""
+import unittest
+import retryPolicy as rp
+
+######################################
+
+class RetryPolicy_tests(unittest.TestCase):
+
+    def test_shouldRetry(self):
+        p = rp.RetryPolicy(maxRetries=2)
+        self.assertTrue(p.shouldRetry(0, statusCode=429))
+        self.assertTrue(p.shouldRetry(1, statusCode=503))
+        self.assertFalse(p.shouldRetry(2, statusCode=503))  # out of retries
+        self.assertFalse(p.shouldRetry(0, statusCode=404))
+        self.assertFalse(p.shouldRetry(0, statusCode=200))
+        self.assertTrue(p.shouldRetry(0, exception=IOError('reset')))
+        self.assertFalse(rp.NO_RETRIES.shouldRetry(0, statusCode=503))
+
+    def test_retryAfterTooLong(self):
+        p = rp.RetryPolicy(maxRetryAfter=60)
+        self.assertFalse(p.shouldRetry(0, statusCode=429,
+                                            headers={'Retry-After': '3600'}))
+
+    def test_backoff(self):
+        p = rp.RetryPolicy(backoffBase=2, backoffMax=10, jitter=0)
+        self.assertEqual([p.getDelay(i) for i in range(4)], [2, 4, 8, 10])
+
+    def test_jitter(self):
+        p = rp.RetryPolicy(backoffBase=4, jitter=0.5)
+        p._random = lambda: 0.0
+        self.assertEqual(p.getDelay(0), 2.0)
+        p._random = lambda: 1.0
+        self.assertEqual(p.getDelay(0), 6.0)
+
+    def test_retryAfterHeader(self):
+        p = rp.RetryPolicy(backoffBase=100)
+        self.assertEqual(p.getDelay(0, {'Retry-After': '7'}), 7.0)
+
+# end class RetryPolicy_tests ######################################
+
+class parse_tests(unittest.TestCase):
+
+    def test_parseRetryAfter(self):
+        self.assertIsNone(rp.parseRetryAfter(None))
+        self.assertIsNone(rp.parseRetryAfter('soon'))
+        self.assertEqual(rp.parseRetryAfter('12'), 12.0)
+        self.assertEqual(rp.parseRetryAfter('-3'), 0.0)
+        now = 1445412480.0      # Wed, 21 Oct 2015 07:28:00 GMT
+        self.assertEqual(rp.parseRetryAfter('Wed, 21 Oct 2015 07:28:30 GMT',
+                                                                now=now), 30.0)
+
+    def test_parseRateLimitHeaders(self):
+        now = 1700000000.0
+        headers = {'X-RateLimit-Remaining': '25',
+                   'X-RateLimit-Reset': '1700000060'}
+        self.assertEqual(rp.parseRateLimitHeaders(headers, now=now),
+                                                                (25, 60.0))
+        headers['X-RateLimit-Reset'] = '1700000060000'  # milliseconds
+        self.assertEqual(rp.parseRateLimitHeaders(headers, now=now),
+                                                                (25, 60.0))
+        self.assertEqual(rp.parseRateLimitHeaders({}), (None, None))
+
+# end class parse_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()
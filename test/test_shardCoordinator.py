@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""
+These are tests for shardCoordinator.py. They don't talk to the real API.
+Several workers are simulated by several coordinators (connections) on one
+local db file.
+
+Usage:   python test_shardCoordinator.py [-v]
+"""
+import unittest
+import os
+import tempfile
+import shardCoordinator as sc
+import rateLimiter
+from knownIds import KnownIdFilter
+from test_SciDirectLib_offline import FakeResponse, fakeClient, searchPage, \
+                                        detailsResponse, pdfResponse
+
+######################################
+
+class ShardCoordinator_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbPath = os.path.join(self.tmpdir.name, 'shard.db')
+        self.now = 1000.0
+        self.coordinators = []
+        self.c1 = self.newCoordinator()
+        self.c2 = self.newCoordinator()
+
+    def tearDown(self):
+        for c in self.coordinators:
+            c.close()
+        self.tmpdir.cleanup()
+
+    def newCoordinator(self):
+        c = sc.ShardCoordinator(self.dbPath, leaseSecs=100, maxAttempts=2)
+        c._clock = lambda: self.now
+        self.coordinators.append(c)
+        return c
+
+    def test_addItemsDedups(self):
+        self.assertEqual(self.c1.addItems('pii', [('S1', {}), ('S2', {})]), 2)
+        self.assertEqual(self.c2.addItems('pii', [('S2', {}), ('S3', {})]), 1)
+        self.assertEqual(self.c1.addItems('journal', [('S1', {})]), 1)
+        self.assertEqual(self.c1.getCounts(),
+                            {'pii': {'ready': 3}, 'journal': {'ready': 1}})
+
+    def test_leasesAreExclusive(self):
+        self.c1.addItems('pii', [('S%d' % i, {'n': i}) for i in range(5)])
+        items1 = self.c1.lease('w1', 'pii', 3)
+        items2 = self.c2.lease('w2', 'pii', 3)
+        self.assertEqual([i.key for i in items1], ['S0', 'S1', 'S2'])
+        self.assertEqual([i.key for i in items2], ['S3', 'S4'])
+        self.assertEqual(items1[1].payload, {'n': 1})
+        self.assertEqual(self.c1.lease('w1', 'pii', 3), [])
+        self.assertEqual(self.c1.lease('w1', 'journal', 3), [])
+
+        for item in items1 + items2:
+            self.assertTrue(self.c1.complete(item))
+        self.assertTrue(self.c2.isFinished())
+        self.assertEqual(self.c2.getCounts(), {'pii': {'done': 5}})
+
+    def test_expiredLeases(self):
+        self.c1.addItems('pii', [('S1', {}), ('S2', {})])
+        items = self.c1.lease('w1', 'pii', 2)
+        self.now += 60
+        self.c1.heartbeat('w1')         # w1 keeps its leases
+        self.now += 60
+        self.assertEqual(self.c2.lease('w2', 'pii', 2), [])
+        self.assertFalse(self.c1.isFinished())
+
+        self.now += 101                 # w1 died, w2 gets its items
+        retried = self.c2.lease('w2', 'pii', 2)
+        self.assertEqual([i.key for i in retried], ['S1', 'S2'])
+        self.assertEqual(retried[0].attempts, 2)
+        self.assertFalse(self.c1.complete(items[0]))   # lost the lease
+        self.assertTrue(self.c2.complete(retried[0]))
+
+        self.now += 101                 # w2 died too, S2 is out of attempts
+        self.assertEqual(self.c1.lease('w1', 'pii', 2), [])
+        self.assertTrue(self.c1.isFinished())
+        self.assertEqual(self.c1.getFailed('pii'), [('S2', 'lease expired')])
+
+    def test_fail(self):
+        self.c1.addItems('journal', [('Bone', {})])
+        item = self.c1.lease('w1', 'journal')[0]
+        self.assertTrue(self.c1.fail(item, ValueError('oops')))
+        item = self.c2.lease('w2', 'journal')[0]
+        self.assertTrue(self.c2.fail(item, ValueError('oops again')))
+        self.assertEqual(self.c1.lease('w1', 'journal'), [])
+        self.assertEqual(self.c1.getFailed('journal'), [('Bone', 'oops again')])
+
+    def test_wait(self):
+        self.c1.addItems('pii', [('S1', {})])
+        item = self.c1.lease('w1', 'pii')[0]
+        self.assertTrue(self.c1.wait(item))
+        self.assertFalse(self.c1.wait(item))        # not leased anymore
+        self.assertTrue(self.c1.isFinished())      # a later run rechecks it
+        self.assertEqual(self.c2.lease('w2', 'pii'), [])
+        self.assertEqual(self.c1.getCounts(), {'pii': {'waiting': 1}})
+
+        self.now += 2*sc.DAY                        # due, w/ fresh attempts
+        item = self.c2.lease('w2', 'pii')[0]
+        self.assertEqual(item.attempts, 1)
+        self.assertTrue(self.c2.wait(item))
+        self.now += 3*sc.DAY                        # 2nd wait is 4 days
+        self.assertEqual(self.c2.lease('w2', 'pii'), [])
+        self.now += sc.DAY
+        item = self.c2.lease('w2', 'pii')[0]
+        self.assertTrue(self.c2.complete(item))
+
+    def test_waitsRunOut(self):
+        c = sc.ShardCoordinator(self.dbPath, firstWait=10, maxWaits=2)
+        c._clock = lambda: self.now
+        self.coordinators.append(c)
+        c.addItems('pii', [('S1', {})])
+        for i in range(3):
+            item = c.lease('w1', 'pii')[0]
+            self.assertTrue(c.wait(item))
+            self.now += 100
+        self.assertEqual(c.lease('w1', 'pii'), [])
+        self.assertEqual(c.getFailed('pii'), [('S1', 'no PMID')])
+
+    def test_removeWorker(self):
+        self.c1.addItems('pii', [('S1', {})])
+        self.c1.lease('w1', 'pii')
+        self.c1.removeWorker('w1')
+        item = self.c2.lease('w2', 'pii')[0]
+        self.assertEqual(item.attempts, 1)
+
+    def test_budgetShare(self):
+        self.assertEqual(self.c1.getBudgetShare(6.0), 6.0)
+        self.c1.heartbeat('w1')
+        self.c2.heartbeat('w2')
+        self.c2.heartbeat('w3')
+        self.assertEqual(self.c1.getNumLiveWorkers(), 3)
+        self.assertEqual(self.c1.getBudgetShare(6.0), 2.0)
+        self.now += 50
+        self.c1.heartbeat('w1')
+        self.now += 51                  # w2 & w3 missed their heartbeats
+        self.assertEqual(self.c2.getBudgetShare(6.0), 6.0)
+        self.c1.removeWorker('w1')
+        self.assertEqual(self.c1.getNumLiveWorkers(), 0)
+
+    def test_workerShare(self):
+        w1 = sc.ShardWorker(self.c1, 'w1', totalRate=6.0, heartbeatSecs=60)
+        w2 = sc.ShardWorker(self.c2, 'w2', totalRate=6.0, heartbeatSecs=60)
+        with w1:
+            self.assertEqual(w1.getLimiter().getMaxRate(), 6.0)
+            with w2:
+                self.assertEqual(w2.getLimiter().getMaxRate(), 3.0)
+                self.assertEqual(w1.beat(), 3.0)
+                self.assertEqual(w1.getLimiter().getRate(), 3.0)
+            self.assertEqual(w1.beat(), 6.0)
+            self.assertEqual(w1.getLimiter().getRate(), 3.0)  # creeps back up
+        self.assertEqual(self.c1.getNumLiveWorkers(), 0)
+
+    def test_sharedBudget(self):
+        w1 = sc.ShardWorker(self.c1, 'w1', totalRate=2.0, heartbeatSecs=60)
+        w2 = sc.ShardWorker(self.c2, 'w2', totalRate=2.0, heartbeatSecs=60)
+        limiters = [w1.getBudgetLimiter(), w2.getBudgetLimiter()]
+        for limiter in limiters:
+            limiter.getSharedLimiter()._clock = lambda: self.now
+        # before either has its share, the two take turns from one bucket
+        self.assertEqual([l.reserve() for l in limiters*2],
+                                                        [0.0, 0.5, 1.0, 1.5])
+        self.assertEqual(limiters[0].getRate(), 2.0)
+        limiters[0].onThrottled()
+        self.assertEqual(w1.getLimiter().getRate(), 1.0)
+        self.assertEqual(limiters[0].getRate(), 1.0)
+        self.assertEqual(w2.getLimiter().getRate(), 2.0)
+
+# end class ShardCoordinator_tests ######################################
+
+class runShard_tests(unittest.TestCase):
+
+    pdf = b'%PDF-1.7' + b'x'*100
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbPath = os.path.join(self.tmpdir.name, 'shard.db')
+        self.pdfDir = os.path.join(self.tmpdir.name, 'pdfs')
+        os.mkdir(self.pdfDir)
+        self.coordinator = sc.ShardCoordinator(self.dbPath, maxAttempts=1)
+
+    def tearDown(self):
+        self.coordinator.close()
+        self.tmpdir.cleanup()
+
+    def processRefs(self, knownIds=None):
+        return lambda refs: sc.downloadPdfs(refs,
+                lambda r: os.path.join(self.pdfDir, 'PMID_%s.pdf' % r.getPmid()),
+                workers=1, knownIds=knownIds)
+
+    def test_runShard(self):
+        self.coordinator.addItems('journal', [('Bone', {'query':
+                                            {'pub': '"Bone"', 'qs': 'mice'}})])
+        worker = sc.ShardWorker(self.coordinator, 'w1',
+                                    limiter=rateLimiter.AdaptiveRateLimiter())
+        client = fakeClient([searchPage(['S1', 'S2', 'S3', 'S4'], 4),
+                             detailsResponse('S1', '111'),
+                             FakeResponse(500, b'server error'),
+                             FakeResponse(content=b'{"full-text-retrieval-'
+                                b'response": {"coredata": {"pii": "S3"}}}'),
+                             detailsResponse('S4', '444'),
+                             pdfResponse(self.pdf)])
+        with worker:
+            counts = sc.runShard(worker, client,
+                                self.processRefs(KnownIdFilter(pmids=['444'])),
+                                batchSize=5, idleSecs=0)
+
+        # S3 has no PMID yet, it waits in the shard db. S4 we have.
+        self.assertEqual(counts,
+                    {'journals': 1, 'piis': 2, 'waiting': 1, 'failed': 1})
+        self.assertEqual(os.listdir(self.pdfDir), ['PMID_111.pdf'])
+        with open(os.path.join(self.pdfDir, 'PMID_111.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), self.pdf)
+        self.assertEqual(len(client.getSession().requests), 6)  # 1 pdf
+        self.assertEqual(self.coordinator.getCounts(), {'journal': {'done': 1},
+                            'pii': {'done': 2, 'failed': 1, 'waiting': 1}})
+        self.assertEqual([key for key, e in self.coordinator.getFailed('pii')],
+                                                                        ['S2'])
+
+    def test_searchOnly(self):
+        # e.g., a debugging run w/o pdfs: the articles are left for others
+        self.coordinator.addItems('journal', [('Bone', {'query':
+                                            {'pub': '"Bone"', 'qs': 'mice'}})])
+        worker = sc.ShardWorker(self.coordinator, 'w1')
+        client = fakeClient([searchPage(['S1', 'S2'], 2)])
+        with worker:
+            counts = sc.runShard(worker, client, None, idleSecs=0)
+        self.assertEqual(counts,
+                    {'journals': 1, 'piis': 0, 'waiting': 0, 'failed': 0})
+        self.assertEqual(self.coordinator.getCounts(),
+                            {'journal': {'done': 1}, 'pii': {'ready': 2}})
+        self.assertTrue(self.coordinator.isFinished('journal'))
+        self.assertFalse(self.coordinator.isFinished())
+
+# end class runShard_tests ######################################
+
+if __name__ == '__main__':
+    unittest.main()